@@ -24,6 +24,10 @@ from . import acssum
 from . import satdet
 from . import utils_calib
 
+import sys
+if sys.version_info >= (3, 7):
+    from . import acs_destripe_async
+
 # These lines allow TEAL to print out the names of TEAL-enabled tasks
 # upon importing this package.
 import os
@@ -19,6 +19,9 @@ For more information, see
     * Uses the dark image specified by the image header keyword DARKFILE.
       If keyword value is 'N/A', then dummy dark with zeroes is used.
 
+    * Row statistics can use ``bottleneck``, if installed, for faster
+      reductions (see :func:`set_reduction_backend`).
+
 Examples
 --------
 
@@ -53,6 +56,7 @@ from __future__ import absolute_import, division, print_function
 
 # STDLIB
 import logging
+import os
 
 # THIRD-PARTY
 import astropy
@@ -67,7 +71,8 @@ __taskname__ = 'acs_destripe'
 __version__ = '0.8.2'
 __vdate__ = '22-Sep-2016'
 __author__ = 'Norman Grogin, STScI, March 2012.'
-__all__ = ['clean']
+__all__ = ['clean', 'CleanSession', 'set_reduction_backend',
+           'get_reduction_backend', 'check_reduction_backend']
 
 #
 # HISTORY:
@@ -83,11 +88,188 @@ __all__ = ['clean']
 
 MJD_SM4 = 54967
 
+# Number of image rows processed at once by StripeArray.calibrate()
+_CALIBRATE_CHUNK_ROWS = 64
+
 logging.basicConfig()
 LOG = logging.getLogger(__taskname__)
 LOG.setLevel(logging.INFO)
 
 
+class _NumpyReductions(object):
+    """Reference (pure NumPy) implementation of row reductions used by
+    de-striping statistics. Masks have values of 0 or 1."""
+    name = 'numpy'
+
+    @staticmethod
+    def count(mask):
+        return np.sum(mask)
+
+    @staticmethod
+    def masked_sum(arr, mask):
+        return np.sum(1.0 * arr * mask)
+
+    @staticmethod
+    def masked_ssd(arr, mean, mask):
+        """Sum of squared deviations from ``mean``."""
+        return np.sum((1.0 * arr - mean) ** 2 * mask)
+
+    @staticmethod
+    def sum_squares(arr):
+        return np.sum(arr ** 2)
+
+    @staticmethod
+    def mean(arr):
+        return np.average(arr)
+
+    @staticmethod
+    def median(arr):
+        return np.median(arr)
+
+
+class _BottleneckReductions(_NumpyReductions):
+    """Row reductions using ``bottleneck`` kernels where available.
+
+    ``bottleneck`` accumulates sums in the precision of the input, without
+    pairwise summation, so single precision inputs are promoted to double
+    precision. Only kernels that propagate NaNs like NumPy are used.
+    Results differ from NumPy by rounding, about 0.01 e- in de-stripe
+    corrections.
+
+    """
+    name = 'bottleneck'
+
+    def __init__(self):
+        import bottleneck
+        self._bn = bottleneck
+
+    def count(self, mask):
+        return np.count_nonzero(mask)
+
+    def masked_ssd(self, arr, mean, mask):
+        # with 0/1 masks, (x - m)**2 * mask == ((x - m) * mask)**2
+        return self._bn.ss(np.multiply(np.subtract(arr, mean,
+                                                   dtype=np.float64), mask))
+
+    def sum_squares(self, arr):
+        return self._bn.ss(arr.astype(np.float64))
+
+    def median(self, arr):
+        return self._bn.median(arr)
+
+
+_REDUCTION_BACKENDS = {'numpy': _NumpyReductions,
+                       'bottleneck': _BottleneckReductions}
+_reductions = None
+_reductions_by_name = {}
+
+
+def _get_reductions(backend=None):
+    """Return reductions object for the given backend name, or for
+    the default backend if `None`."""
+    if backend is None:
+        if _reductions is None:
+            set_reduction_backend()
+        return _reductions
+
+    if not isinstance(backend, str):
+        # already a reductions object
+        return backend
+
+    if backend not in _reductions_by_name:
+        try:
+            cls = _REDUCTION_BACKENDS[backend]
+        except KeyError:
+            raise ValueError(
+                "Unsupported reduction backend '{0}'. Supported backends "
+                "are: {1}.".format(backend,
+                                   ', '.join(sorted(_REDUCTION_BACKENDS))))
+        _reductions_by_name[backend] = cls()
+    return _reductions_by_name[backend]
+
+
+def get_reduction_backend():
+    """Return name of the default backend used for row reductions
+    (sums, means, medians, etc.) in de-striping statistics."""
+    return _get_reductions().name
+
+
+def set_reduction_backend(backend=None):
+    """Set default backend for row reductions in de-striping statistics.
+
+    Parameters
+    ----------
+    backend : {'numpy', 'bottleneck'}, None
+        Name of the backend. If `None`, ``'numpy'`` (the reference
+        implementation) is used. ``'bottleneck'`` is faster, but its
+        results differ by rounding (see :func:`check_reduction_backend`).
+
+    """
+    global _reductions
+    _reductions = _get_reductions('numpy' if backend is None else backend)
+
+
+def check_reduction_backend(backend, size=4096, rtol=1e-6, seed=0):
+    """Check that row reductions computed with the given backend agree
+    with the reference (NumPy) implementation.
+
+    Parameters
+    ----------
+    backend : str or reductions object
+        Backend to check.
+
+    size : int
+        Size of the random test rows.
+
+    rtol : float
+        Relative tolerance of the comparison.
+
+    seed : int
+        Seed for the random number generator.
+
+    Returns
+    -------
+    passed : bool
+        `True` if all results agree.
+
+    """
+    ref = _NumpyReductions()
+    red = _get_reductions(backend)
+    rng = np.random.RandomState(seed)
+    passed = True
+
+    for dtype in (np.float32, np.float64):
+        arr = (100.0 + 10.0 * rng.standard_normal(size)).astype(dtype)
+        mask = (rng.uniform(size=size) > 0.2).astype(np.byte)
+        mean = ref.masked_sum(arr, mask) / ref.count(mask)
+
+        # NaNs must propagate as with NumPy
+        nanarr = arr.copy()
+        nanarr[size // 2] = np.nan
+        nanmask = mask.copy()
+        nanmask[size // 2] = 1
+
+        for case, a, m in (('', arr, mask), (' with NaN', nanarr, nanmask)):
+            tests = [('count', (m, )),
+                     ('masked_sum', (a, m)),
+                     ('masked_ssd', (a, mean, m)),
+                     ('sum_squares', (a, )),
+                     ('mean', (a, )),
+                     ('median', (a[m.astype(bool)], ))]
+            for name, args in tests:
+                expected = getattr(ref, name)(*args)
+                result = getattr(red, name)(*args)
+                if not np.allclose(result, expected, rtol=rtol, atol=0,
+                                   equal_nan=True):
+                    LOG.warn('check_reduction_backend - {0}.{1} mismatch '
+                             'for {2}{3}: {4!r} != {5!r}'.format(
+                                 red.name, name, np.dtype(dtype).name, case,
+                                 result, expected))
+                    passed = False
+
+    return passed
+
+
 class StripeArray(object):
     """Class to handle data array to be destriped."""
 
@@ -114,6 +296,7 @@ class StripeArray(object):
         self.ingest_dark()
         self.ingest_flash()
         self.ingest_flatfield()
+        self.calibrate()
 
     def ingest_flatfield(self):
         """Process flatfield."""
@@ -124,12 +307,11 @@ class StripeArray(object):
         # If BIAS or DARK, set flatfield to unity
         if self.invflat is None:
             self.invflat = np.ones_like(self.science)
+            self.apply_flat = False
             return
 
         # Apply the flatfield if necessary
-        if self.flatcorr != 'COMPLETE':
-            self.science = self.science * self.invflat
-            self.err = self.err * self.invflat
+        self.apply_flat = self.flatcorr != 'COMPLETE'
 
     def ingest_flash(self):
         """Process post-flash."""
@@ -139,12 +321,12 @@ class StripeArray(object):
         # Set post-flash to zeros
         if self.flash is None:
             self.flash = np.zeros_like(self.science)
+            self.apply_flash = False
             return
 
         # Apply the flash subtraction if necessary.
         # Not applied to ERR, to be consistent with ingest_dark()
-        if self.flshcorr != 'COMPLETE':
-            self.science = self.science - self.flash
+        self.apply_flash = self.flshcorr != 'COMPLETE'
 
     def ingest_dark(self):
         """Process dark."""
@@ -154,28 +336,69 @@ class StripeArray(object):
         # If BIAS or DARK, set dark to zeros
         if self.dark is None:
             self.dark = np.zeros_like(self.science)
+            self.apply_dark = False
             return
 
         # Apply the dark subtraction if necessary.
         # Effect of DARK on ERR is insignificant for de-striping.
-        if self.darkcorr != 'COMPLETE':
-            self.science = self.science - self.dark
+        self.apply_dark = self.darkcorr != 'COMPLETE'
 
-    def write_corrected(self, output, clobber=False):
-        """Write out the destriped data."""
+    def calibrate(self, inverse=False):
+        """Subtract dark and post-flash and apply flatfield (or reverse
+        these steps if ``inverse`` is `True`), as selected by
+        ``ingest_*()`` methods.
+
+        All steps are done in a single in-place pass over chunks of
+        image rows, to avoid full-frame temporary arrays.
+
+        """
+        if not (self.apply_dark or self.apply_flash or self.apply_flat):
+            return
+
+        # Convert to the type (and native byte order) that out-of-place
+        # arithmetic would have produced; this is the only copy made:
+        sci_dtype = np.result_type(
+            self.science,
+            *[ref for ref, apply in ((self.dark, self.apply_dark),
+                                     (self.flash, self.apply_flash),
+                                     (self.invflat, self.apply_flat))
+              if apply])
+        if self.science.dtype != sci_dtype:
+            self.science = self.science.astype(sci_dtype)
+
+        if self.apply_flat:
+            err_dtype = np.result_type(self.err, self.invflat)
+            if self.err.dtype != err_dtype:
+                self.err = self.err.astype(err_dtype)
+
+        nrows = self.science.shape[0]
+        for r in range(0, nrows, _CALIBRATE_CHUNK_ROWS):
+            rows = slice(r, min(r + _CALIBRATE_CHUNK_ROWS, nrows))
+            sci = self.science[rows]
+
+            if inverse:
+                if self.apply_flat:
+                    sci /= self.invflat[rows]
+                    self.err[rows] /= self.invflat[rows]
+                if self.apply_flash:
+                    sci += self.flash[rows]
+                if self.apply_dark:
+                    sci += self.dark[rows]
 
-        # un-apply the flatfield if necessary
-        if self.flatcorr != 'COMPLETE':
-            self.science = self.science / self.invflat
-            self.err = self.err / self.invflat
+            else:
+                if self.apply_dark:
+                    sci -= self.dark[rows]
+                if self.apply_flash:
+                    sci -= self.flash[rows]
+                if self.apply_flat:
+                    sci *= self.invflat[rows]
+                    self.err[rows] *= self.invflat[rows]
 
-        # un-apply the post-flash if necessary
-        if self.flshcorr != 'COMPLETE':
-            self.science = self.science + self.flash
+    def write_corrected(self, output, clobber=False):
+        """Write out the destriped data."""
 
-        # un-apply the dark if necessary
-        if self.darkcorr != 'COMPLETE':
-            self.science = self.science + self.dark
+        # un-apply the flatfield, post-flash, and dark if necessary
+        self.calibrate(inverse=True)
 
         # reverse the amp merge
         if (self.ampstring == 'ABCD'):
@@ -201,6 +424,202 @@ class StripeArray(object):
         self.hdulist.close()
 
 
+class CleanSession(object):
+    """De-striping session for iterating on user masks.
+
+    The session keeps the image and the per-row bias stripe statistics
+    from the last cleaning. When the image is cleaned again with edited
+    masks, statistics are recomputed only for rows whose effective
+    mask (user masks merged with the DQ array) changed. Zero-mean
+    normalization and corrections are then redone for the whole image.
+    Since mask edits usually touch only a small fraction of rows,
+    this is much faster than running :func:`clean` again.
+
+    Only a single (initial) cleaning is performed, i.e., repeated
+    cleanings (``rpt_clean`` of :func:`clean`) are not supported.
+
+    Parameters
+    ----------
+    image : str
+        Input image filename.
+
+    stat, maxiter, sigrej, lower, upper, binwidth, dqbits
+        See :func:`clean`.
+
+    Examples
+    --------
+    >>> from acstools import acs_destripe
+    >>> session = acs_destripe.CleanSession('uncorrected_flt.fits',
+    ...                                     dqbits='~16')
+    >>> session.clean(mask1='mymask_sci1.fits', mask2='mymask_sci2.fits')
+    >>> # ... edit masks ...
+    >>> session.clean(mask1='mymask_sci1.fits', mask2='mymask_sci2.fits')
+    >>> session.write('csck_flt.fits', clobber=True)
+    >>> session.close()
+
+    """
+
+    def __init__(self, image, stat="pmode1", maxiter=15, sigrej=2.0,
+                 lower=None, upper=None, binwidth=0.3, dqbits=None):
+        stat = stat.lower().strip()
+        if stat not in ['pmode1', 'pmode2', 'mean', 'mode', 'median',
+                        'midpt']:
+            raise ValueError("Unsupported value for 'stat'.")
+
+        self.image = image
+        self.stat = stat
+        self.maxiter = maxiter
+        self.sigrej = sigrej
+        self.lower = lower
+        self.upper = upper
+        self.binwidth = binwidth
+        self.dqbits = dqbits
+
+        self.frame = StripeArray(image)
+
+        # uncorrected data to which corrections are re-applied:
+        self._science0 = self.frame.science.copy()
+        self._err0 = self.frame.err.copy()
+
+        # effective mask and per-row statistics from the last cleaning:
+        nrows = self._science0.shape[0]
+        self._mask = None
+        self._corr = np.zeros(nrows, dtype=np.float64)
+        self._npix = np.zeros(nrows, dtype=int)
+        self._corr_scale = np.zeros(nrows, dtype=np.float64)
+        self._sigcorr2 = np.zeros(nrows, dtype=np.float64)
+        self._niter = np.zeros(nrows, dtype=int)
+
+    def _merge_mask(self, mask):
+        mask = _mergeUserMaskAndDQ(self.frame.dq, mask, self.dqbits)
+
+        # "no mask" is equivalent to all pixels being good:
+        if mask is None:
+            mask = np.ones(self._science0.shape, dtype=np.uint8)
+
+        return mask
+
+    def clean(self, mask1=None, mask2=None, verbose=True):
+        """Clean the image using given user masks.
+
+        Parameters
+        ----------
+        mask1, mask2 : str, `numpy.ndarray`, None
+            Mask images or arrays for ``[SCI,1]`` and ``[SCI,2]``.
+            See :func:`clean`.
+
+        verbose : bool
+            Print informational messages.
+
+        Returns
+        -------
+        NRecomputed : int
+            Number of rows for which statistics were recomputed.
+
+        """
+        mask = self._merge_mask(_read_mask(mask1, mask2))
+        if mask.shape != self._science0.shape:
+            raise ValueError('Mask shape does not match science data shape')
+
+        if self._mask is None:
+            rows = np.arange(mask.shape[0])
+        else:
+            rows = np.flatnonzero(np.any(mask != self._mask, axis=1))
+
+        if verbose:
+            LOG.info('CleanSession - Recomputing bias stripe statistics '
+                     'for {0} of {1} rows.'.format(rows.size, mask.shape[0]))
+
+        # statistics are always computed on the uncorrected data:
+        self.frame.science = self._science0.copy()
+        self.frame.err = self._err0.copy()
+
+        for i in rows:
+            (self._corr[i], self._npix[i], self._corr_scale[i],
+             self._sigcorr2[i], self._niter[i]) = _row_stripe_stats(
+                 self.frame, i, self.stat, self.maxiter, self.sigrej,
+                 self.lower, self.upper, mask[i]
+            )
+
+        self._mask = mask
+
+        Success, NUpdRows, NMaxIter, Bkgrnd, STDDEVCorr, MaxCorr = \
+            self._apply()
+
+        if not Success:
+            LOG.warn('CleanSession - No good data points; cannot de-stripe.')
+        elif verbose:
+            LOG.info('CleanSession - Estimated background: '
+                     '{:.5g}.'.format(Bkgrnd))
+            LOG.info('CleanSession - STDDEV of applied de-stripe '
+                     'corrections {:.3g}.'.format(STDDEVCorr))
+            LOG.info('CleanSession - Maximum applied correction: '
+                     '{:.3g}.'.format(MaxCorr))
+            LOG.info('CleanSession - Total number of corrected rows: '
+                     '{}.'.format(NUpdRows))
+
+        if NMaxIter >= self.maxiter:
+            LOG.warn(
+                'CleanSession - Maximum number of clipping iterations '
+                'specified by the user ({}) has been reached.'.format(
+                    self.maxiter))
+
+        return rows.size
+
+    def _apply(self):
+        """Normalize corrections and apply them to the uncorrected data,
+        as in a single pass of :func:`clean_streak`."""
+        good = self._npix > 0
+        npix = self._npix[good]
+        tnpix = np.sum(npix)
+        NMaxIter = np.amax(self._niter)
+
+        if tnpix <= 0:
+            return False, 0, NMaxIter, 0.0, 0.0, 0.0
+
+        # require that bias stripe corrections have zero mean and
+        # convert them to the "raw" space:
+        Bkgrnd = np.sum(self._corr[good] * npix) / tnpix
+        corr = np.zeros_like(self._corr)
+        corr[good] = (self._corr[good] - Bkgrnd) * self._corr_scale[good]
+
+        # weighted mean, sample variance, and max value for
+        # corrections to the *RAW* image:
+        trim_corr = corr[good]
+        cwmean = np.sum(npix * trim_corr) / tnpix
+        trim_corr -= cwmean
+        wvar = np.sum(npix * trim_corr ** 2) / tnpix
+        uwvar = wvar / (1.0 - float(np.sum(npix ** 2)) / float(tnpix) ** 2)
+        STDDEVCorr = np.sqrt(uwvar)
+        MaxCorr = np.amax(np.abs(trim_corr))
+
+        # apply corrections and add (in quadratures) an error term
+        # associated with the accuracy of bias stripe correction:
+        image = self.frame
+        imerr2 = image.err**2
+        rows = np.flatnonzero(good)
+        _apply_stripe_corr(image, corr, imerr2, rows)
+        sigcorr2 = np.where(good, self._sigcorr2, 0.0)
+        truecorr_sig2 = ((sigcorr2 * (image.invflat ** 2).T).T).astype(image.err.dtype)  # noqa
+        image.err[:, :] = np.sqrt(np.abs(imerr2 + truecorr_sig2))
+
+        return True, rows.size, NMaxIter, Bkgrnd, STDDEVCorr, MaxCorr
+
+    def write(self, output, clobber=False):
+        """Write out the image with corrections from the last cleaning."""
+        if self._mask is None:
+            raise RuntimeError('Image has not been cleaned yet.')
+        # write_corrected() un-applies calibrations in-place; keep
+        # the corrected data so that the session can be used again:
+        science, err = self.frame.science.copy(), self.frame.err.copy()
+        self.frame.write_corrected(output, clobber=clobber)
+        self.frame.science, self.frame.err = science, err
+
+    def close(self):
+        """Close open file(s)."""
+        self.frame.close()
+
+
 def _read_mask(mask1, mask2):
     if isinstance(mask1, str):
         mask1 = fits.getdata(mask1)
@@ -228,7 +647,8 @@ def _read_mask(mask1, mask2):
 def clean(input, suffix, stat="pmode1", maxiter=15, sigrej=2.0,
           lower=None, upper=None, binwidth=0.3,
           mask1=None, mask2=None, dqbits=None,
-          rpt_clean=0, atol=0.01, clobber=False, verbose=True):
+          rpt_clean=0, atol=0.01, clobber=False, verbose=True,
+          prior_profile=None, save_profile=False):
     """Remove horizontal stripes from ACS WFC post-SM4 data.
 
     Parameters
@@ -366,6 +786,92 @@ def clean(input, suffix, stat="pmode1", maxiter=15, sigrej=2.0,
     verbose : bool
         Print informational messages. Default = True.
 
+    prior_profile : bool, str, `numpy.ndarray`, None, or list of these types
+        Per-row bias stripe corrections from a previous cleaning of the
+        input images, one for each input file, given either as arrays or
+        as profile file names (see `save_profile`). They are applied before
+        cleaning so that only residual stripes need to be removed, which
+        usually converges in a single pass when reprocessing an exposure
+        (e.g., after a reference file update). If `True`, profile files
+        saved next to output files by a previous run are used, when they
+        exist. Default = None (start from scratch).
+
+    save_profile : bool
+        Save total per-row bias stripe corrections next to each output
+        file, in a FITS file with the ``'_stripes'`` suffix appended to
+        the output file name (e.g., ``'*_csck_stripes.fits'``).
+        Default = False.
+
+    Returns
+    -------
+    stats : list of dict
+        Overall statistics of de-stripe corrections for each input image,
+        as returned by :func:`perform_correction`.
+
+    """
+    stats = []
+    for image, output, maskdata, profile in _iter_clean_jobs(
+            input, suffix, mask1, mask2, prior_profile=prior_profile):
+        if save_profile:
+            profile_output = _profile_filename(output)
+        else:
+            profile_output = None
+
+        stats.append(perform_correction(
+            image, output, stat=stat, maxiter=maxiter, sigrej=sigrej,
+            lower=lower, upper=upper, binwidth=binwidth, mask=maskdata,
+            dqbits=dqbits, rpt_clean=rpt_clean, atol=atol, clobber=clobber,
+            verbose=verbose, prior_profile=profile,
+            profile_output=profile_output))
+        LOG.info(output + ' created')
+
+    return stats
+
+
+def _profile_filename(output):
+    """Name of the file with stripe corrections for a given output."""
+    return output.replace('.fits', '_stripes.fits')
+
+
+def _read_profile(prior_profile, nrows):
+    """Return a copy of the given profile, reading it from file if
+    needed, or zeros if not given."""
+    if prior_profile is None:
+        return np.zeros(nrows, dtype=np.float64)
+    if isinstance(prior_profile, str):
+        prior_profile = fits.getdata(prior_profile)
+    return np.array(prior_profile, dtype=np.float64)
+
+
+def _check_outputs(output, profile_output, clobber):
+    """Raise an error if output files exist and cannot be overwritten,
+    so that a run does not fail after writing some of them."""
+    if clobber:
+        return
+    for filename in (output, profile_output):
+        if filename is not None and os.path.exists(filename):
+            raise IOError('File {0} already exists.'.format(filename))
+
+
+def _write_profile(filename, profile, image, clobber=False):
+    """Save per-row stripe corrections to a FITS file."""
+    hdu = fits.PrimaryHDU(profile)
+    hdu.header['FILENAME'] = (os.path.basename(filename), 'name of file')
+    hdu.header['IMAGE'] = (os.path.basename(image),
+                           'de-striped image')
+    hdu.header['BUNIT'] = ('ELECTRONS', 'per-row RAW stripe corrections')
+    if minversion(astropy, '1.3'):
+        hdu.writeto(filename, overwrite=clobber)
+    else:
+        hdu.writeto(filename, clobber=clobber)
+
+
+def _iter_clean_jobs(input, suffix, mask1, mask2, prior_profile=None):
+    """Parse and check input images and masks given to :func:`clean` and
+    yield ``(image, output, mask, prior_profile)`` for each image that
+    needs to be processed. Masks are read only when the corresponding
+    image is reached.
+
     """
     from stsci.tools import parseinput  # Optional package dependency
 
@@ -431,7 +937,22 @@ def clean(input, suffix, stat="pmode1", maxiter=15, sigrej=2.0,
     elif n_mask2 != n_input:
         raise ValueError('Insufficient masks for [SCI,2]')
 
-    for image, maskfile1, maskfile2 in zip(flist, mlist1, mlist2):
+    if prior_profile is None or prior_profile is True:
+        plist = [prior_profile] * n_input
+    elif isinstance(prior_profile, (str, np.ndarray)):
+        plist = [prior_profile]
+    elif isinstance(prior_profile, list):
+        plist = prior_profile
+    else:
+        raise TypeError("'prior_profile' must be either a bool, a str, "
+                        "a numpy.ndarray, or a list of str or "
+                        "numpy.ndarray values.")
+
+    if len(plist) != n_input:
+        raise ValueError('Insufficient prior stripe profiles')
+
+    for image, maskfile1, maskfile2, profile in zip(flist, mlist1, mlist2,
+                                                    plist):
         # Skip processing pre-SM4 images
         if (fits.getval(image, 'EXPSTART') <= MJD_SM4):
             LOG.warn('{0} is pre-SM4. Skipping...'.format(image))
@@ -460,19 +981,20 @@ def clean(input, suffix, stat="pmode1", maxiter=15, sigrej=2.0,
             raise ValueError("Both 'mask1' and 'mask2' must be specified "
                              "or not specified together.")
 
-        maskdata = _read_mask(maskfile1, maskfile2)
-        perform_correction(image, output, stat=stat, maxiter=maxiter,
-                           sigrej=sigrej, lower=lower, upper=upper,
-                           binwidth=binwidth, mask=maskdata, dqbits=dqbits,
-                           rpt_clean=rpt_clean, atol=atol,
-                           clobber=clobber, verbose=verbose)
-        LOG.info(output + ' created')
+        # use profile from a previous run, if any:
+        if profile is True:
+            profile = _profile_filename(output)
+            if not os.path.isfile(profile):
+                profile = None
+
+        yield image, output, _read_mask(maskfile1, maskfile2), profile
 
 
 def perform_correction(image, output, stat="pmode1", maxiter=15, sigrej=2.0,
                        lower=None, upper=None, binwidth=0.3,
                        mask=None, dqbits=None,
-                       rpt_clean=0, atol=0.01, clobber=False, verbose=True):
+                       rpt_clean=0, atol=0.01, clobber=False, verbose=True,
+                       prior_profile=None, profile_output=None):
     """
     Clean each input image.
 
@@ -507,11 +1029,52 @@ def perform_correction(image, output, stat="pmode1", maxiter=15, sigrej=2.0,
     verbose : bool
         Print informational messages. Default = True.
 
+    prior_profile : str, `numpy.ndarray`, None
+        Per-row bias stripe corrections from a previous cleaning of the
+        input image, or name of the file they were saved to.
+        See :func:`clean` for more details.
+
+    profile_output : str, None
+        If given, total per-row bias stripe corrections are saved to a
+        FITS file with this name.
+
+    Returns
+    -------
+    stats : dict
+        Overall statistics of de-stripe corrections with keys
+        ``'success'``, ``'rows_corrected'``, ``'clipping_iterations'``,
+        ``'background'``, ``'stddev_correction'``, ``'max_correction'``,
+        and ``'repeated_cleanings'``. See :func:`clean_streak`.
+
     """
+    _check_outputs(output, profile_output, clobber)
+
     # construct the frame to be cleaned, including the
     # associated data stuctures needed for cleaning
     frame = StripeArray(image)
+    profile = _read_profile(prior_profile, frame.science.shape[0])
+
+    stats = _clean_frame(frame, stat=stat, maxiter=maxiter, sigrej=sigrej,
+                         lower=lower, upper=upper, binwidth=binwidth,
+                         mask=mask, dqbits=dqbits, rpt_clean=rpt_clean,
+                         atol=atol, verbose=verbose, profile=profile)
+
+    frame.write_corrected(output, clobber=clobber)
+    frame.close()
+
+    if profile_output is not None:
+        _write_profile(profile_output, profile, image, clobber=clobber)
+
+    return stats
+
 
+def _clean_frame(frame, stat="pmode1", maxiter=15, sigrej=2.0,
+                 lower=None, upper=None, binwidth=0.3, mask=None,
+                 dqbits=None, rpt_clean=0, atol=0.01, verbose=True,
+                 profile=None, callback=None):
+    """Destripe an already loaded `StripeArray` in-place and
+    report overall statistics, which are also returned as a `dict`.
+    Used by :func:`perform_correction`."""
     # combine user mask with image's DQ array:
     mask = _mergeUserMaskAndDQ(frame.dq, mask, dqbits)
 
@@ -519,7 +1082,8 @@ def perform_correction(image, output, stat="pmode1", maxiter=15, sigrej=2.0,
     Success, NUpdRows, NMaxIter, Bkgrnd, STDDEVCorr, MaxCorr, Nrpt = clean_streak(
         frame, stat=stat, maxiter=maxiter, sigrej=sigrej,
         lower=lower, upper=upper, binwidth=binwidth, mask=mask,
-        rpt_clean=rpt_clean, atol=atol, verbose=verbose
+        rpt_clean=rpt_clean, atol=atol, verbose=verbose, callback=callback,
+        profile=profile
     )
 
     if Success:
@@ -549,22 +1113,35 @@ def perform_correction(image, output, stat="pmode1", maxiter=15, sigrej=2.0,
             LOG.info('perform_correction - Total number of corrected rows: '
                      '{}.'.format(NUpdRows))
 
-    frame.write_corrected(output, clobber=clobber)
-    frame.close()
+    return {'success': bool(Success), 'rows_corrected': int(NUpdRows),
+            'clipping_iterations': int(NMaxIter),
+            'background': float(Bkgrnd),
+            'stddev_correction': float(STDDEVCorr),
+            'max_correction': float(MaxCorr),
+            'repeated_cleanings': int(Nrpt)}
+
+
+def _interpret_bit_flags(dqbits):
+    # Optional package dependency
+    try:
+        from stsci.tools.bitmask import interpret_bit_flags
+    except ImportError:
+        from stsci.tools.bitmask import (
+            interpret_bits_value as interpret_bit_flags
+        )
+    return interpret_bit_flags(dqbits)
 
 
 def _mergeUserMaskAndDQ(dq, mask, dqbits):
     # Optional package dependency
     try:
-        from stsci.tools.bitmask import (interpret_bit_flags,
-                                         bitfield_to_boolean_mask)
+        from stsci.tools.bitmask import bitfield_to_boolean_mask
     except ImportError:
         from stsci.tools.bitmask import (
-            interpret_bits_value as interpret_bit_flags,
             bitmask2mask as bitfield_to_boolean_mask
         )
 
-    dqbits = interpret_bit_flags(dqbits)
+    dqbits = _interpret_bit_flags(dqbits)
     if dqbits is None:
         if mask is None:
             return None
@@ -588,7 +1165,8 @@ def _mergeUserMaskAndDQ(dq, mask, dqbits):
 
 def clean_streak(image, stat="pmode1", maxiter=15, sigrej=2.0,
                  lower=None, upper=None, binwidth=0.3, mask=None,
-                 rpt_clean=0, atol=0.01, verbose=True):
+                 rpt_clean=0, atol=0.01, verbose=True, callback=None,
+                 profile=None, backend=None):
     """
     Apply destriping algorithm to input array.
 
@@ -619,6 +1197,27 @@ def clean_streak(image, stat="pmode1", maxiter=15, sigrej=2.0,
     verbose : bool
         Print informational messages. Default = True.
 
+    callback : callable, None
+        If given, it is called as ``callback(stage, rpt)`` right before
+        row statistics (``stage='statistics'``) are computed and before
+        corrections (``stage='apply'``) are applied to the image, where
+        ``rpt`` is the cleaning number (0 for the initial cleaning).
+        Exceptions raised by the callback abort the cleaning, leaving
+        the image partially corrected.
+
+    profile : `numpy.ndarray`, None
+        Per-row bias stripe corrections to the *RAW* image.
+        On input, corrections obtained from a previous cleaning of the
+        same exposure (e.g., before a reference file update) are applied
+        to the image first, so that statistics are computed only on
+        the residual stripes (warm start). Set to zeros for a normal
+        cleaning. On output, it is updated in-place with total
+        applied corrections.
+
+    backend : str, None
+        Backend for row reductions (see :func:`set_reduction_backend`).
+        If `None`, the default backend is used.
+
     Returns
     -------
     Success : bool
@@ -647,6 +1246,10 @@ def clean_streak(image, stat="pmode1", maxiter=15, sigrej=2.0,
     if mask is not None and image.science.shape != mask.shape:
         raise ValueError('Mask shape does not match science data shape')
 
+    if profile is not None and profile.shape != image.science.shape[:1]:
+        raise ValueError('Stripe profile size does not match number of '
+                         'image rows')
+
     Nrpt = 0
     warn_maxiter = False
     NUpdRows = 0
@@ -664,56 +1267,36 @@ def clean_streak(image, stat="pmode1", maxiter=15, sigrej=2.0,
 
     # array to hold cumulative stripe amplitudes and latest row npix:
     cumcorr = np.zeros(image.science.shape[0], dtype=np.float64)
-    cnpix = np.zeros(image.science.shape[0], dtype=np.int)
+    cnpix = np.zeros(image.science.shape[0], dtype=int)
 
     # other arrays
     corr_scale = np.empty(image.science.shape[0], dtype=np.float64)
-    npix = np.empty(image.science.shape[0], dtype=np.int)
+    npix = np.empty(image.science.shape[0], dtype=int)
     sigcorr2 = np.zeros(image.science.shape[0], dtype=np.float64)
-    updrows = np.zeros(image.science.shape[0], dtype=np.int)
+    updrows = np.zeros(image.science.shape[0], dtype=int)
 
     # for speed-up and to reduce rounding errors in ERR computations,
     # keep a copy of the squared error array:
     imerr2 = image.err**2
 
+    # warm start from a previous solution:
+    if profile is not None and np.any(profile):
+        if verbose:
+            LOG.info("clean_streak - Applying previous bias stripe "
+                     "corrections.")
+        rows = np.flatnonzero(profile)
+        _apply_stripe_corr(image, profile, imerr2, rows)
+        updrows[rows] = 1
+        cumcorr += profile
+
     # arrays for detecting oscillatory behaviour:
     nonconvi0 = np.arange(image.science.shape[0])
     corr0 = np.zeros(image.science.shape[0], dtype=np.float64)
 
-    if stat == 'pmode1':
-        # SExtractor-esque central value statistic; slightly sturdier against
-        # skewness of pixel histogram due to faint source flux
-        def getcorr(): return (2.5 * SMedian - 1.5 * SMean)
+    if stat in ['mode', 'midpt'] and ImageStats is None:
+        raise ImportError('stsci.imagestats is missing')
 
-    elif stat == 'pmode2':
-        # "Original Pearson"-ian estimate for mode:
-        def getcorr(): return (3.0 * SMedian - 2.0 * SMean)
-
-    elif stat == 'mean':
-        def getcorr(): return (SMean)
-
-    elif stat == 'median':
-        def getcorr(): return (SMedian)
-
-    elif stat == 'mode':
-        if ImageStats is None:
-            raise ImportError('stsci.imagestats is missing')
-
-        def getcorr():
-            imstat = ImageStats(image.science[i][BMask], 'mode',
-                                lower=lower, upper=upper, nclip=0)
-            assert(imstat.npix == NPix)
-            return (imstat.mode)
-
-    elif stat == 'midpt':
-        if ImageStats is None:
-            raise ImportError('stsci.imagestats is missing')
-
-        def getcorr():
-            imstat = ImageStats(image.science[i][BMask], 'midpt',
-                                lower=lower, upper=upper, nclip=0)
-            assert(imstat.npix == NPix)
-            return (imstat.midpt)
+    red = _get_reductions(backend)
 
     nmax_rpt = 1 if rpt_clean is None else max(1, rpt_clean+1)
 
@@ -741,25 +1324,25 @@ def clean_streak(image, stat="pmode1", maxiter=15, sigrej=2.0,
         tnpix2 = 0
         NMaxIter = 0
 
+        if callback is not None:
+            callback('statistics', rpt)
+
         # loop over rows to fit the stripe amplitude
         mask_arr = None
         for i in range(image.science.shape[0]):
             if mask is not None:
                 mask_arr = mask[i]
 
-            # row-by-row iterative sigma-clipped mean;
-            # sigma, iters are adjustable
-            SMean, SSig, SMedian, NPix, NIter, BMask = djs_iterstat(
-                image.science[i], MaxIter=maxiter, SigRej=sigrej,
-                Min=lower, Max=upper, Mask=mask_arr, lineno=i+1
+            rcorr, NPix, rscale, rsig2, NIter = _row_stripe_stats(
+                image, i, stat, maxiter, sigrej, lower, upper, mask_arr,
+                backend=red
             )
 
             if NPix > 0:
-                corr[i] = getcorr()
+                corr[i] = rcorr
                 npix[i] = NPix
-                corr_scale[i] = 1.0 / np.average(image.invflat[i][BMask])
-                sigcorr2[i] = corr_scale[i]**2 * \
-                    np.sum((image.err[i][BMask])**2)/NPix**2
+                corr_scale[i] = rscale
+                sigcorr2[i] = rsig2
                 cnpix[i] = NPix
                 tnpix += NPix
                 tnpix2 += NPix*NPix
@@ -798,37 +1381,13 @@ def clean_streak(image, stat="pmode1", maxiter=15, sigrej=2.0,
         # keep track of total corrections:
         cumcorr += corr
 
-        # apply corrections row-by-row
-        for i in range(image.science.shape[0]):
-            if npix[i] < 1:
-                continue
-            updrows[i] = 1
-
-            ffdark = (image.dark[i] + image.flash[i]) * image.invflat[i]
-            t1 = np.maximum(image.science[i] + ffdark, 0.0)
-
-            # stripe is constant along the row, before flatfielding;
-            # afterwards it has the shape of the inverse flatfield
-            truecorr = corr[i] * image.invflat[i]
-            #truecorr_sig2 = sigcorr2[i] * image.invflat[i]**2  # DEBUG
-
-            # correct the SCI extension
-            image.science[i] -= truecorr
-
-            t2 = np.maximum(image.science[i] + ffdark, 0.0)
+        if callback is not None:
+            callback('apply', rpt)
 
-            T = (t1 - t2) * image.invflat[i]
-
-            # correct the ERR extension
-            # NOTE: np.abs() in the err array recomputation is used for safety
-            #       only and, in principle, assuming no errors have been made
-            #       in the derivation of the formula, np.abs() should not be
-            #       necessary.
-            imerr2[i] -= T
-            image.err[i] = np.sqrt(np.abs(imerr2[i]))
-            # NOTE: for debugging purposes, one may want to uncomment
-            #       next line:
-            #assert( np.all(imerr2 >= 0.0))
+        # apply corrections row-by-row
+        rows = np.flatnonzero(npix > 0)
+        _apply_stripe_corr(image, corr, imerr2, rows)
+        updrows[rows] = 1
 
         if atol is not None:
             if current_max_corr < atol:
@@ -893,9 +1452,107 @@ def clean_streak(image, stat="pmode1", maxiter=15, sigrej=2.0,
 
     NUpdRows = np.sum(updrows)
 
+    if profile is not None:
+        profile[:] = cumcorr
+
     return True, NUpdRows, NMaxIter, Bkgrnd, STDDEVCorr, MaxCorr, Nrpt-1
 
 
+def _row_stripe_stats(image, i, stat, maxiter, sigrej, lower, upper,
+                      mask_arr, backend=None):
+    """Fit bias stripe amplitude in row ``i`` of the image.
+
+    Returns
+    -------
+    corr : float
+        Central value of the row in the flat-fielded space.
+
+    NPix : int
+        Number of pixels used. If zero, other values are meaningless.
+
+    corr_scale : float
+        Scale factor to convert corrections to the *RAW* space.
+
+    sigcorr2 : float
+        Squared error of the correction in the *RAW* space.
+
+    NIter : int
+        Number of performed clipping iterations.
+
+    """
+    # row-by-row iterative sigma-clipped mean;
+    # sigma, iters are adjustable
+    SMean, SSig, SMedian, NPix, NIter, BMask = djs_iterstat(
+        image.science[i], MaxIter=maxiter, SigRej=sigrej,
+        Min=lower, Max=upper, Mask=mask_arr, lineno=i+1, backend=backend
+    )
+
+    if NPix <= 0:
+        return 0.0, 0, 0.0, 0.0, NIter
+
+    if stat == 'pmode1':
+        # SExtractor-esque central value statistic; slightly sturdier against
+        # skewness of pixel histogram due to faint source flux
+        corr = 2.5 * SMedian - 1.5 * SMean
+
+    elif stat == 'pmode2':
+        # "Original Pearson"-ian estimate for mode:
+        corr = 3.0 * SMedian - 2.0 * SMean
+
+    elif stat == 'mean':
+        corr = SMean
+
+    elif stat == 'median':
+        corr = SMedian
+
+    else:
+        # 'mode' or 'midpt'
+        from stsci.imagestats import ImageStats
+        imstat = ImageStats(image.science[i][BMask], stat,
+                            lower=lower, upper=upper, nclip=0)
+        assert(imstat.npix == NPix)
+        corr = getattr(imstat, stat)
+
+    red = _get_reductions(backend)
+    # np.float64 (like an element of a float64 array), so that sigcorr2 is
+    # computed in double precision also with NumPy 2 (NEP 50) promotion:
+    corr_scale = np.float64(1.0 / red.mean(image.invflat[i][BMask]))
+    sigcorr2 = corr_scale**2 * red.sum_squares(image.err[i][BMask])/NPix**2
+
+    return corr, NPix, corr_scale, sigcorr2, NIter
+
+
+def _apply_stripe_corr(image, corr, imerr2, rows):
+    """Apply *RAW* space stripe corrections ``corr`` to the given rows
+    of the image and update squared errors ``imerr2`` accordingly."""
+    for i in rows:
+        ffdark = (image.dark[i] + image.flash[i]) * image.invflat[i]
+        t1 = np.maximum(image.science[i] + ffdark, 0.0)
+
+        # stripe is constant along the row, before flatfielding;
+        # afterwards it has the shape of the inverse flatfield
+        truecorr = corr[i] * image.invflat[i]
+        #truecorr_sig2 = sigcorr2[i] * image.invflat[i]**2  # DEBUG
+
+        # correct the SCI extension
+        image.science[i] -= truecorr
+
+        t2 = np.maximum(image.science[i] + ffdark, 0.0)
+
+        T = (t1 - t2) * image.invflat[i]
+
+        # correct the ERR extension
+        # NOTE: np.abs() in the err array recomputation is used for safety
+        #       only and, in principle, assuming no errors have been made
+        #       in the derivation of the formula, np.abs() should not be
+        #       necessary.
+        imerr2[i] -= T
+        image.err[i] = np.sqrt(np.abs(imerr2[i]))
+        # NOTE: for debugging purposes, one may want to uncomment
+        #       next line:
+        #assert( np.all(imerr2 >= 0.0))
+
+
 def _write_row_number(lineno, offset=1, pad=1):
     if lineno is None:
         return ''
@@ -903,7 +1560,7 @@ def _write_row_number(lineno, offset=1, pad=1):
 
 
 def djs_iterstat(InputArr, MaxIter=10, SigRej=3.0,
-                 Max=None, Min=None, Mask=None, lineno=None):
+                 Max=None, Min=None, Mask=None, lineno=None, backend=None):
     """
     Iterative sigma-clipping.
 
@@ -925,6 +1582,10 @@ def djs_iterstat(InputArr, MaxIter=10, SigRej=3.0,
     lineno : int or None
         Line number to be used in log and/or warning messages.
 
+    backend : str, None
+        Backend for row reductions (see :func:`set_reduction_backend`).
+        If `None`, the default backend is used.
+
     Returns
     -------
     FMean, FSig, FMedian, NPix : float
@@ -937,6 +1598,8 @@ def djs_iterstat(InputArr, MaxIter=10, SigRej=3.0,
         Logical image mask from the final iteration.
 
     """
+    red = _get_reductions(backend)
+
     NGood = InputArr.size
     ArrShape = InputArr.shape
     if NGood == 0:
@@ -970,12 +1633,12 @@ def djs_iterstat(InputArr, MaxIter=10, SigRej=3.0,
     Mask[InputArr > Max] = 0
     Mask[InputArr < Min] = 0
 
-    FMean = np.sum(1.0 * InputArr * Mask) / NGood
-    FSig  = np.sqrt(np.sum((1.0 * InputArr - FMean) ** 2 * Mask) / (NGood - 1))
+    FMean = red.masked_sum(InputArr, Mask) / NGood
+    FSig  = np.sqrt(red.masked_ssd(InputArr, FMean, Mask) / (NGood - 1))
 
     NLast = -1
     Iter  = 0
-    NGood = np.sum(Mask)
+    NGood = red.count(Mask)
     if NGood < 2:
         imrow = _write_row_number(lineno=lineno, offset=0, pad=1)
         LOG.warn('djs_iterstat - No good data points; '
@@ -993,22 +1656,21 @@ def djs_iterstat(InputArr, MaxIter=10, SigRej=3.0,
         Mask[InputArr < LoVal] = 0
         Mask[InputArr > HiVal] = 0
         NLast = NGood
-        npix = np.sum(Mask)
+        npix = red.count(Mask)
 
         if npix >= 2:
-            FMean = np.sum(1.0 * InputArr * Mask) / npix
-            FSig = np.sqrt(np.sum(
-                (1.0 * InputArr - FMean) ** 2 * Mask) / (npix - 1))
+            FMean = red.masked_sum(InputArr, Mask) / npix
+            FSig = np.sqrt(red.masked_ssd(InputArr, FMean, Mask) / (npix - 1))
             SaveMask = Mask.copy()  # last mask used for computation of mean
             NGood = npix
             Iter += 1
         else:
             break
 
-    logical_mask = SaveMask.astype(np.bool)
+    logical_mask = SaveMask.astype(bool)
 
     if NLast > 1:
-        FMedian = np.median(InputArr[logical_mask])
+        FMedian = red.median(InputArr[logical_mask])
         NLast = NGood
     else:
         FMedian = FMean
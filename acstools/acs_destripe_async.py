@@ -0,0 +1,278 @@
+"""
+Asynchronous (:mod:`asyncio`) interface to :ref:`acsdestripe`.
+
+Destriping an exposure takes tens of seconds of computations and FITS I/O.
+The coroutines in this module run these in an executor so that the event
+loop remains responsive, which allows one process to keep many exposures
+in flight along with its other (e.g., network) I/O.
+
+Each exposure goes through the following stages, in order:
+``'load'``, ``'statistics'``, ``'apply'`` (``'statistics'`` and ``'apply'``
+are repeated for each repeated cleaning requested via ``rpt_clean``),
+``'write'``, and ``'done'``. A progress callback, if given, is notified
+at the start of each stage. Cancelling a task stops processing of its
+exposure at the next stage boundary; the output file is not written.
+
+.. note::
+
+    * Requires Python 3.7 or later.
+
+    * Computations operate on arrays shared between stages, so the
+      executor must be thread-based (e.g.,
+      :class:`concurrent.futures.ThreadPoolExecutor`).
+
+Examples
+--------
+
+>>> import asyncio
+>>> from acstools import acs_destripe_async
+>>> asyncio.run(acs_destripe_async.clean_async(
+...     '*_flt.fits', 'csck', progress=print, max_concurrent=4))
+ProgressEvent(image='j12345678_flt.fits', stage='load', rpt=None)
+ProgressEvent(image='j12345679_flt.fits', stage='load', rpt=None)
+ProgressEvent(image='j12345678_flt.fits', stage='statistics', rpt=0)
+...
+
+"""
+import asyncio
+import functools
+import logging
+import threading
+from collections import namedtuple
+
+# LOCAL
+from . import acs_destripe
+
+__taskname__ = 'acs_destripe_async'
+__version__ = '0.1.0'
+__vdate__ = '18-Oct-2026'
+__author__ = 'STScI'
+__all__ = ['ProgressEvent', 'clean_async', 'perform_correction_async']
+
+logging.basicConfig()
+LOG = logging.getLogger(__taskname__)
+LOG.setLevel(logging.INFO)
+
+#: Progress event passed to the ``progress`` callback. ``rpt`` is the
+#: cleaning number (0 for the initial cleaning) for the ``'statistics'``
+#: and ``'apply'`` stages and `None` for the others.
+ProgressEvent = namedtuple('ProgressEvent', ['image', 'stage', 'rpt'])
+
+
+class _Cancelled(Exception):
+    """Raised in a worker thread to abort a cancelled job."""
+
+
+class _DestripeJob(object):
+    """State of a single exposure shared between the event loop and the
+    worker threads running its stages."""
+
+    def __init__(self, loop, image, progress):
+        self.loop = loop
+        self.image = image
+        self.progress = progress
+        self.frame = None
+        self.profile = None
+        self._lock = threading.Lock()
+        self._running = False
+        self._cancelled = False
+
+    def report(self, stage, rpt=None):
+        """Notify progress. Safe to call from any thread."""
+        if self.progress is not None:
+            self.loop.call_soon_threadsafe(
+                self.progress, ProgressEvent(self.image, stage, rpt))
+
+    def callback(self, stage, rpt):
+        """Callback for :func:`~acstools.acs_destripe.clean_streak`."""
+        if self._cancelled:
+            raise _Cancelled(self.image)
+        self.report(stage, rpt)
+
+    def _close(self):
+        if self.frame is not None:
+            self.frame.close()
+            self.frame = None
+
+    def _call(self, func, *args, **kwargs):
+        # Runs in a worker thread.
+        with self._lock:
+            if self._cancelled:
+                raise _Cancelled(self.image)
+            self._running = True
+
+        success = False
+        try:
+            result = func(*args, **kwargs)
+            success = True
+        finally:
+            with self._lock:
+                self._running = False
+                if self._cancelled or not success:
+                    self._close()
+
+        return result
+
+    async def run(self, executor, func, *args, **kwargs):
+        """Run one stage in the executor."""
+        try:
+            return await self.loop.run_in_executor(
+                executor, functools.partial(self._call, func, *args, **kwargs))
+        except asyncio.CancelledError:
+            with self._lock:
+                self._cancelled = True
+                # Otherwise, the worker closes the file when it is done.
+                if not self._running:
+                    self._close()
+            raise
+
+    def load(self, prior_profile):
+        self.frame = acs_destripe.StripeArray(self.image)
+        self.profile = acs_destripe._read_profile(
+            prior_profile, self.frame.science.shape[0])
+
+    def write(self, output, clobber, profile_output):
+        self.frame.write_corrected(output, clobber=clobber)
+        self._close()
+        if profile_output is not None:
+            acs_destripe._write_profile(profile_output, self.profile,
+                                        self.image, clobber=clobber)
+
+
+async def perform_correction_async(image, output, stat="pmode1", maxiter=15,
+                                   sigrej=2.0, lower=None, upper=None,
+                                   binwidth=0.3, mask=None, dqbits=None,
+                                   rpt_clean=0, atol=0.01, clobber=False,
+                                   verbose=True, prior_profile=None,
+                                   profile_output=None, executor=None,
+                                   progress=None):
+    """
+    Coroutine to clean an input image.
+
+    This is the asynchronous counterpart of
+    :func:`acstools.acs_destripe.perform_correction`.
+
+    Parameters
+    ----------
+    image, output, stat, maxiter, sigrej, lower, upper, binwidth, mask, dqbits, rpt_clean, atol, clobber, verbose, prior_profile, profile_output
+        See :func:`acstools.acs_destripe.perform_correction`.
+
+    executor : `concurrent.futures.Executor`, None
+        Thread-based executor for the computations. If `None`, the
+        default executor of the event loop is used. FITS I/O is always
+        done by the default executor.
+
+    progress : callable, None
+        Called with a `ProgressEvent` at the start of each stage.
+        It is always called from the event loop thread.
+
+    Returns
+    -------
+    stats : dict
+        See :func:`acstools.acs_destripe.perform_correction`.
+
+    """
+    acs_destripe._check_outputs(output, profile_output, clobber)
+
+    loop = asyncio.get_running_loop()
+    job = _DestripeJob(loop, image, progress)
+
+    job.report('load')
+    await job.run(None, job.load, prior_profile)
+
+    stats = await job.run(
+        executor, acs_destripe._clean_frame, job.frame, stat=stat,
+        maxiter=maxiter, sigrej=sigrej, lower=lower, upper=upper,
+        binwidth=binwidth, mask=mask, dqbits=dqbits, rpt_clean=rpt_clean,
+        atol=atol, verbose=verbose, profile=job.profile,
+        callback=job.callback)
+
+    job.report('write')
+    await job.run(None, job.write, output, clobber, profile_output)
+
+    job.report('done')
+    return stats
+
+
+async def clean_async(input, suffix, stat="pmode1", maxiter=15, sigrej=2.0,
+                      lower=None, upper=None, binwidth=0.3,
+                      mask1=None, mask2=None, dqbits=None,
+                      rpt_clean=0, atol=0.01, clobber=False, verbose=True,
+                      prior_profile=None, save_profile=False, executor=None,
+                      progress=None, max_concurrent=None):
+    """
+    Coroutine to remove horizontal stripes from ACS WFC post-SM4 data.
+
+    This is the asynchronous counterpart of
+    :func:`acstools.acs_destripe.clean`. Input images are processed
+    concurrently. If processing of any image fails, processing of
+    the other images is cancelled and the exception is re-raised.
+
+    Parameters
+    ----------
+    input, suffix, stat, maxiter, sigrej, lower, upper, binwidth, mask1, mask2, dqbits, rpt_clean, atol, clobber, verbose, prior_profile, save_profile
+        See :func:`acstools.acs_destripe.clean`.
+
+    executor, progress
+        See :func:`perform_correction_async`.
+
+    max_concurrent : int, None
+        Maximum number of images in flight at the same time.
+        If `None`, it is only limited by the executor.
+
+    Returns
+    -------
+    stats : list of dict
+        See :func:`acstools.acs_destripe.clean`.
+
+    """
+    loop = asyncio.get_running_loop()
+    if max_concurrent is None:
+        semaphore = None
+    else:
+        semaphore = asyncio.Semaphore(max_concurrent)
+
+    async def process(image, output, maskdata, profile):
+        if save_profile:
+            profile_output = acs_destripe._profile_filename(output)
+        else:
+            profile_output = None
+
+        stats = await perform_correction_async(
+            image, output, stat=stat, maxiter=maxiter, sigrej=sigrej,
+            lower=lower, upper=upper, binwidth=binwidth, mask=maskdata,
+            dqbits=dqbits, rpt_clean=rpt_clean, atol=atol, clobber=clobber,
+            verbose=verbose, prior_profile=profile,
+            profile_output=profile_output, executor=executor,
+            progress=progress)
+        LOG.info(output + ' created')
+        return stats
+
+    # Checking input images and reading masks involve file I/O
+    jobs = acs_destripe._iter_clean_jobs(input, suffix, mask1, mask2,
+                                         prior_profile=prior_profile)
+    tasks = []
+
+    try:
+        while True:
+            # Do not read masks of images that cannot be started yet
+            if semaphore is not None:
+                await semaphore.acquire()
+
+            job = await loop.run_in_executor(None, next, jobs, None)
+            if job is None:
+                if semaphore is not None:
+                    semaphore.release()
+                break
+
+            task = asyncio.ensure_future(process(*job))
+            if semaphore is not None:
+                task.add_done_callback(lambda t: semaphore.release())
+            tasks.append(task)
+
+        return await asyncio.gather(*tasks)
+
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        raise
@@ -21,7 +21,7 @@ Examples
 In Python without TEAL:
 
 >>> from acstools import acs_destripe_plus
->>> acs_destripe_plus.destripe_plus(
+>>> done, errors, reports = acs_destripe_plus.destripe_plus(
 ...     'j12345678_raw.fits', suffix='strp', maxiter=15, sigrej=2.0,
 ...     scimask1='mymask_sci1.fits', scimask2='mymask_sci2.fits',
 ...     clobber=False, cte_correct=True)
@@ -45,6 +45,9 @@ From command line::
                         [--binwidth BINWIDTH] [--sci1_mask SCI1_MASK]
                         [--sci2_mask SCI2_MASK] [--dqbits [DQBITS]]
                         [--rpt_clean RPT_CLEAN] [--atol [ATOL]] [--nocte]
+                        [--nproc NPROC] [--scratch_dir SCRATCH_DIR]
+                        [--cpu_budget CPU_BUDGET] [--report REPORT]
+                        [--skip_up_to_date] [--products PRODUCTS] [--plan]
                         [--clobber] [-q] [--version]
                         input
 
@@ -72,9 +75,24 @@ From command line::
 from __future__ import absolute_import, division, print_function
 
 # STDLIB
+import contextlib
+import hashlib
+import json
 import logging
+import multiprocessing
 import os
+import shutil
 import subprocess
+import tempfile
+import threading
+import time
+from multiprocessing import Process, Queue
+from multiprocessing.pool import ThreadPool
+
+try:
+    from queue import Empty
+except ImportError:  # Python 2
+    from Queue import Empty
 
 # ASTROPY
 from astropy.io import fits
@@ -85,15 +103,16 @@ import numpy as np
 
 # LOCAL
 from . import acs_destripe
+from .utils_calib import extract_ref_dq, from_irafpath
 from . import acs2d
 from . import acsccd
 from . import acscte
 
 __taskname__ = 'acs_destripe_plus'
-__version__ = '0.4.1'
-__vdate__ = '12-Jan-2016'
+__version__ = '0.5.0'
+__vdate__ = '19-Oct-2026'
 __author__ = 'Leonardo Ubeda, Sara Ogaz (ACS Team), STScI'
-__all__ = ['destripe_plus']
+__all__ = ['destripe_plus', 'plan']
 
 SM4_DATE = Time('2008-01-01')
 SUBARRAY_LIST = [
@@ -104,6 +123,24 @@ SUBARRAY_LIST = [
     'WFC1A-512', 'WFC1A-1K', 'WFC1A-2K', 'WFC1B-512', 'WFC1B-1K', 'WFC1B-2K',
     'WFC2C-512', 'WFC2C-1K', 'WFC2C-2K', 'WFC2D-512', 'WFC2D-1K', 'WFC2D-2K']
 
+# Processing parameters recorded in manifests of products:
+_MANIFEST_PARAMS = ('stat', 'maxiter', 'sigrej', 'lower', 'upper', 'binwidth',
+                    'dqbits', 'rpt_clean', 'atol', 'cte_correct', 'products',
+                    'fast_dq')
+
+# Switches of ACS2D steps that set DQ flags other than those of the dark,
+# flash, and flat-field reference files (see utils_calib.extract_ref_dq).
+# DQICORR is normally done by ACSCCD already:
+_ACS2D_DQ_SWITCHES = ('DQICORR', 'SINKCORR', 'GLINCORR', 'LFLGCORR')
+
+# Maximum length of the comma-separated list of files passed to a single
+# ACSCCD call (a single command line argument is limited to 128 KiB on Linux):
+_ACSCCD_MAX_ARG_LEN = 32000
+
+# Interval, in seconds, at which worker processes are checked for having
+# exited (e.g., killed when out of memory) without reporting a status:
+_WORKER_POLL_INTERVAL = 5.0
+
 logging.basicConfig()
 LOG = logging.getLogger(__taskname__)
 LOG.setLevel(logging.INFO)
@@ -113,7 +150,11 @@ def destripe_plus(inputfile, suffix='strp', stat='pmode1', maxiter=15,
                   sigrej=2.0, lower=None, upper=None, binwidth=0.3,
                   scimask1=None, scimask2=None,
                   dqbits=None, rpt_clean=0, atol=0.01,
-                  cte_correct=True, clobber=False, verbose=True):
+                  cte_correct=True, clobber=False, verbose=True,
+                  n_processes=1, scratch_dir=None,
+                  stage_limits=None, batch_acsccd=False, report=False,
+                  cpu_budget=None, skip_up_to_date=False,
+                  products=('flt', 'flc'), fast_dq=False):
     """Calibrate post-SM4 ACS/WFC exposure(s) and use
     standalone :ref:`acsdestripe`.
 
@@ -258,6 +299,133 @@ def destripe_plus(inputfile, suffix='strp', stat='pmode1', maxiter=15,
     verbose : bool
         Print informational messages. Default = True.
 
+    n_processes : int, None
+        Number of exposures to process concurrently, each in its own
+        process, when multiple input files are given. If 1, exposures
+        are processed one after another. If `None`, the number of CPUs
+        is used. Default = 1.
+
+    scratch_dir : str, None
+        Directory for intermediate files, preferably on fast local storage
+        (e.g., local SSD or ``tmpfs``). Each exposure is copied into its own
+        temporary subdirectory there and processed; only final FLT, FLC,
+        and trailer (``.tra``) files are moved back next to the input file,
+        after which the subdirectory is removed. This also makes concurrent
+        runs in the same input directory safe. If `None` or empty,
+        intermediate files are created next to the input file.
+        Default = None.
+
+    stage_limits : dict, None
+        Process multiple input files in a pipeline, in which different
+        exposures can be in different processing stages at the same time
+        (e.g., ACSCCD of one exposure runs during de-striping of another
+        and CTE correction of a third one). This keeps both CPUs and disks
+        busy, since stages have very different resource usage. Keys are
+        stage names and values are the maximum numbers of exposures
+        in that stage at the same time. Stages are: ``'acsccd'``
+        (including preparation of DQ masks), ``'destripe'``,
+        ``'acscte'``, and ``'acs2d'``. Stages that are not given are
+        limited to one exposure at a time. Example:
+        ``{'acsccd': 2, 'destripe': 1, 'acscte': 1, 'acs2d': 2}``.
+        If given, `n_processes` and `batch_acsccd` are ignored, since
+        ACSCCD runs in the pipeline. This option is only available from
+        Python, not from TEAL or the command line. Default = None
+        (no pipeline).
+
+    batch_acsccd : bool
+        When multiple input files are given, run ACSCCD on all of them
+        before the other stages, in as few ACSCCD calls as the command
+        line length allows, instead of once per exposure. This saves
+        startup and reference file loading time of ACSCCD, but RAW files
+        of all exposures are copied to `scratch_dir` (if given) and all
+        intermediate ACSCCD products are on disk at the same time, and no
+        exposure goes past ACSCCD until all of them are through it.
+        Default = False.
+
+    report : bool, str
+        If `True` or a file name, return a processing report for each
+        input file. If a file name, also write the reports to that file
+        as JSON. Each report is a `dict` with keys ``'input'``,
+        ``'success'``, ``'error'``, ``'skipped'`` (see `skip_up_to_date`),
+        ``'wall_time'``, ``'destripe'`` (overall de-stripe statistics
+        returned by :func:`~acstools.acs_destripe.clean`), and
+        ``'stages'``. The latter is a list of records for each processing
+        stage the exposure went through, with keys ``'stage'``,
+        ``'wall_time'``, ``'cpu_time'`` (including CALACS executables),
+        ``'exit_status'``, ``'output_sizes'`` (in bytes), and
+        ``'shared_by'`` (number of exposures processed by the same ACSCCD
+        call, see `batch_acsccd`). Stages are: ``'scratch_in'``,
+        ``'acsccd'``, ``'acs2d_dq'``
+        (ACS2D run only to obtain DQ arrays), ``'destripe'``,
+        ``'acscte'``, ``'acs2d_flt'``, ``'acs2d_flc'``, and
+        ``'scratch_out'``. CPU times are measured for the whole process,
+        so they include other exposures being processed at the same time
+        when `stage_limits` is used. Times are in seconds. The
+        ``'acscte'`` record also has the number of ``'threads'`` given
+        to ACSCTE by `cpu_budget` (`None` if not limited).
+        Default = False.
+
+    cpu_budget : int, None
+        Maximum number of CPUs to be used by exposures processed at the
+        same time (see `n_processes` and `stage_limits`). Each stage other
+        than CTE correction takes one CPU. ACSCTE, which otherwise uses all
+        CPUs of the computer, is given a fair share of the budget (the
+        budget divided by the number of exposures in a stage, including
+        its own), so it gets more threads as fewer exposures remain.
+        Stages wait until CPUs are available; ACSCTE waits for its whole
+        share, and other stages do not start while it waits.
+        If `None`, CPU usage is not limited. Default = None.
+
+    skip_up_to_date : bool
+        Skip exposures whose products are up to date. If set, after an
+        exposure is processed, a manifest (``*_manifest.json``) is written
+        next to its products. It records the size, modification time, and
+        checksum of the RAW file, checksums of the masks, the names and
+        modification times of the reference files in the RAW header, the
+        processing parameters, the CALACS version, and the size and
+        modification time of each product. An exposure is up to date if
+        none of these have changed, in which case its products are not
+        deleted even if `clobber` is set. Default = False.
+
+    products : list of str, str
+        Products to make: ``'flt'``, ``'flc'``, or both (also as a
+        comma-separated string). ACS2D is run only for the requested
+        products, and CTE correction only if FLC is requested. If CTE
+        correction is not performed for an exposure, its FLT is made
+        even if only FLC was requested.
+        Default = ``('flt', 'flc')``.
+
+    fast_dq : bool
+        Obtain DQ arrays for `dqbits` from the ACSCCD product and the DQ
+        arrays of the dark, flash, and flat-field reference files instead
+        of running ACS2D just for that. This is only done for exposures
+        for which ACS2D would not set any other DQ flags, i.e., whose
+        ``DQICORR`` is done by ACSCCD, whose ``SINKCORR``, ``GLINCORR``,
+        and ``LFLGCORR`` are not ``PERFORM``, and that have no ``SATUFILE``
+        (full-well saturation flags); ACS2D is run for all other exposures.
+        Default = False.
+
+    Returns
+    -------
+    done : list of str
+        Input files that were processed successfully (or skipped
+        as up to date).
+
+    errors : dict
+        Dictionary mapping input files that failed to process to the
+        error message explaining why processing failed. Failure of
+        one exposure does not stop processing of the other exposures.
+        Always empty for a single input file, for which exceptions
+        are raised instead.
+
+    reports : list of dict, None
+        Processing reports in the order of input files,
+        or `None` if `report` is not set.
+
+    .. versionchanged:: 0.5.0
+        Returns ``(done, errors, reports)``. Previously, `None` was
+        returned and processing stopped at the first failed exposure.
+
     Raises
     ------
     ImportError
@@ -270,14 +438,8 @@ def destripe_plus(inputfile, suffix='strp', stat='pmode1', maxiter=15,
         Invalid header values or CALACS version.
 
     """
-    # Optional package dependencies
+    # Optional package dependency
     from stsci.tools import parseinput
-    try:
-        from stsci.tools.bitmask import interpret_bit_flags
-    except ImportError:
-        from stsci.tools.bitmask import (
-            interpret_bits_value as interpret_bit_flags
-        )
 
     # process input file(s) and if we have multiple input files - recursively
     # call acs_destripe_plus for each input image:
@@ -343,58 +505,294 @@ def destripe_plus(inputfile, suffix='strp', stat='pmode1', maxiter=15,
     elif n_mask2 != n_input:
         raise ValueError('Insufficient masks for [SCI,2]')
 
+    products = _check_products(products, cte_correct)
+    if 'flc' not in products:
+        cte_correct = False
+
+    if cpu_budget is not None:
+        if cpu_budget < 1:
+            raise ValueError("'cpu_budget' must be a positive integer.")
+        cpu_budget = _CPUBudget(cpu_budget)
+
+    kwargs = {
+        'suffix': suffix, 'stat': stat, 'maxiter': maxiter,
+        'sigrej': sigrej, 'lower': lower, 'upper': upper,
+        'binwidth': binwidth, 'dqbits': dqbits, 'rpt_clean': rpt_clean,
+        'atol': atol, 'cte_correct': cte_correct, 'clobber': clobber,
+        'verbose': verbose, 'scratch_dir': scratch_dir,
+        'cpu_budget': cpu_budget, 'skip_up_to_date': skip_up_to_date,
+        'products': products, 'fast_dq': fast_dq}
+
     if n_input > 1:
-        for img, mf1, mf2 in zip(flist, mlist1, mlist2):
-            destripe_plus(
-                inputfile=img, suffix=suffix, stat=stat,
-                lower=lower, upper=upper, binwidth=binwidth,
-                maxiter=maxiter, sigrej=sigrej,
-                scimask1=scimask1, scimask2=scimask2, dqbits=dqbits,
-                cte_correct=cte_correct, clobber=clobber, verbose=verbose
-            )
-        return
+        jobs = [(img, mf1, mf2, None)
+                for img, mf1, mf2 in zip(flist, mlist1, mlist2)]
+        if batch_acsccd and stage_limits is None:
+            jobs, skipped, prep_errors, reports = _prepare_batch(jobs, kwargs)
+        else:
+            skipped = []
+            prep_errors = {}
+            reports = []
+        if stage_limits is not None:
+            done, errors, job_reports = _destripe_plus_pipeline(
+                jobs, kwargs, stage_limits)
+        else:
+            done, errors, job_reports = _destripe_plus_batch(
+                jobs, kwargs, n_processes)
+        done = skipped + done
+        errors.update(prep_errors)
+
+        if not report:
+            return done, errors, None
+
+        order = dict((img, k) for k, img in enumerate(flist))
+        reports = sorted(reports + job_reports,
+                         key=lambda r: order[r['input']])
+        if isinstance(report, str):
+            _write_report(report, reports)
+        return done, errors, reports
+
+    exposure_report = _ExposureReport(flist[0])
+    error = None
+    try:
+        _destripe_exposure(flist[0], mlist1[0], mlist2[0],
+                           report=exposure_report, **kwargs)
+    except Exception as e:
+        error = '{0}: {1}'.format(type(e), str(e))
+        raise
+    finally:
+        exposure_report.finish(error)
+        if report and isinstance(report, str):
+            _write_report(report, [exposure_report.as_dict()])
+
+    if not report:
+        return flist, {}, None
+    return flist, {}, [exposure_report.as_dict()]
+
+
+def plan(inputfile, cte_correct=True, dqbits=None, products=('flt', 'flc'),
+         n_threads=8, fast_dq=False):
+    """Plan processing of post-SM4 ACS/WFC exposure(s) by
+    :func:`destripe_plus` without running it.
+
+    Only primary headers of RAW files are read (by several threads),
+    so that large batches can be checked quickly for exposures that
+    will be rejected or processed differently, e.g., without CTE
+    correction.
 
-    inputfile = flist[0]
-    scimask1 = mlist1[0]
-    scimask2 = mlist2[0]
+    Parameters
+    ----------
+    inputfile : str or list of str
+        Input filenames. See :func:`destripe_plus`.
 
-    # verify that the RAW image exists in cwd
-    cwddir = os.getcwd()
-    if not os.path.exists(os.path.join(cwddir, inputfile)):
-        raise IOError("{0} does not exist.".format(inputfile))
+    cte_correct : bool, int, str, None
+        See :func:`destripe_plus`.
 
-    # get image's primary header:
-    header = fits.getheader(inputfile)
+    dqbits : int, str, None
+        See :func:`destripe_plus`. Used to plan the ACS2D run needed
+        to obtain DQ arrays.
 
-    # verify masks defined (or not) simultaneously:
-    if header['CCDAMP'] == 'ABCD' and \
-       ((scimask1 is not None and scimask2 is None) or \
-        (scimask1 is None and scimask2 is not None)):
-        raise ValueError("Both 'scimask1' and 'scimask2' must be specified "
-                         "or not specified together.")
+    products : list of str, str
+        See :func:`destripe_plus`.
+
+    n_threads : int
+        Number of threads reading headers. Default = 8.
+
+    fast_dq : bool
+        See :func:`destripe_plus`.
+
+    Returns
+    -------
+    plans : list of dict
+        Plan of each input file with keys ``'input'``, ``'accepted'``,
+        ``'reason'`` (why the file is rejected or CTE correction is off,
+        or `None`), ``'aperture'``, ``'cte_correct'``, ``'stages'`` (list
+        of stage names, see the ``report`` parameter of
+        :func:`destripe_plus`), ``'products'``, and ``'cost_class'``
+        (``'small'``, ``'medium'``, or ``'large'``, based on the image
+        size and CTE correction; `None` for rejected files).
+
+    totals : dict
+        Numbers of ``'files'``, ``'accepted'`` and ``'rejected'`` files,
+        files with ``'cte_correct'``, and ``'products'``, as well as
+        dictionaries of numbers of files going through each stage
+        (``'stages'``) and in each cost class (``'cost_classes'``).
+
+    Raises
+    ------
+    ImportError
+        ``stsci.tools`` not found.
+
+    ValueError
+        No input files or invalid `products`.
+
+    """
+    # Optional package dependency
+    from stsci.tools import parseinput
+
+    flist = parseinput.parseinput(inputfile)[0]
+    if len(flist) == 0:
+        raise ValueError(
+            'No input file(s) provided or the file(s) do not exist')
+
+    products = _check_products(products, cte_correct)
+    if 'flc' not in products:
+        cte_correct = False
+
+    pool = ThreadPool(max(1, min(n_threads, len(flist))))
+    try:
+        plans = pool.map(
+            lambda f: _plan_exposure(f, cte_correct, dqbits, products,
+                                     fast_dq),
+            flist)
+    finally:
+        pool.close()
+        pool.join()
+
+    totals = {'files': len(plans), 'accepted': 0, 'rejected': 0,
+              'cte_correct': 0, 'products': 0, 'stages': {},
+              'cost_classes': {}}
+    for p in plans:
+        if not p['accepted']:
+            totals['rejected'] += 1
+            continue
+        totals['accepted'] += 1
+        totals['cte_correct'] += int(p['cte_correct'])
+        totals['products'] += len(p['products'])
+        for stage in p['stages']:
+            totals['stages'][stage] = totals['stages'].get(stage, 0) + 1
+        totals['cost_classes'][p['cost_class']] = \
+            totals['cost_classes'].get(p['cost_class'], 0) + 1
+
+    return plans, totals
+
+
+@contextlib.contextmanager
+def _timed_stage(name, outputs, append):
+    """Time a processing stage and pass its record to ``append``."""
+    record = {'stage': name, 'shared_by': 1}
+    wall0 = time.time()
+    cpu0 = _cpu_time()
+    try:
+        yield record
+    except subprocess.CalledProcessError as e:
+        record['exit_status'] = e.returncode
+        raise
+    except Exception:
+        record['exit_status'] = 1
+        raise
+    else:
+        record['exit_status'] = 0
+    finally:
+        record['wall_time'] = time.time() - wall0
+        record['cpu_time'] = _cpu_time() - cpu0
+        record['output_sizes'] = _file_sizes(outputs)
+        append(record)
+
+
+def _cpu_time():
+    """CPU time of this process and its finished child processes."""
+    t = os.times()
+    return t[0] + t[1] + t[2] + t[3]
+
+
+def _file_sizes(filenames):
+    return dict((os.path.basename(f), os.path.getsize(f))
+                for f in filenames if os.path.isfile(f))
+
+
+def _write_report(filename, reports):
+    with open(filename, 'w') as fh:
+        json.dump(reports, fh, indent=2, sort_keys=True)
+
+
+class _ExposureReport(object):
+    """Processing report of a single exposure. See the ``report``
+    parameter of :func:`destripe_plus`."""
+
+    def __init__(self, inputfile):
+        self.inputfile = inputfile
+        self.stages = []
+        self.destripe = None
+        self.error = None
+        self.skipped = False
+        self.wall_time = None
+        self._start = time.time()
+
+    def stage(self, name, outputs=()):
+        """Context manager timing a processing stage."""
+        return _timed_stage(name, outputs, self.stages.append)
+
+    def finish(self, error=None):
+        self.error = error
+        self.wall_time = time.time() - self._start
+
+    def as_dict(self):
+        return {'input': self.inputfile, 'success': self.error is None,
+                'error': self.error, 'skipped': self.skipped,
+                'wall_time': self.wall_time,
+                'destripe': self.destripe, 'stages': self.stages}
+
+
+class _Exposure(object):
+    """State of a single exposure set up by :func:`_prepare_exposure`."""
+
+    def __init__(self, inputfile, work_name, jobdir, cte_correct, is_sub2K,
+                 ctecorr, report):
+        self.inputfile = inputfile
+        self.work_name = work_name
+        self.jobdir = jobdir
+        self.cte_correct = cte_correct
+        self.is_sub2K = is_sub2K
+        self.ctecorr = ctecorr
+        self.report = report
+        self.manifest = None
+        self.acsccd_done = False
+
+    def outputs(self):
+        """Final products that are moved back from the scratch directory."""
+        outputs = [_product_name(self.inputfile, 'flt'),
+                   _product_name(self.inputfile, '.tra')]
+        if self.cte_correct:
+            outputs.append(_product_name(self.inputfile, 'flc'))
+        return outputs
+
+    def cleanup(self):
+        """Remove the scratch directory, if any."""
+        if self.jobdir is not None:
+            shutil.rmtree(self.jobdir, ignore_errors=True)
+            self.jobdir = None
+
+
+_calacs_version_str = None
+
+
+def _calacs_version():
+    """Make sure CALACS is recent enough and return its version.
+    Checked once per process."""
+    global _calacs_version_str
+    if _calacs_version_str is not None:
+        return _calacs_version_str
 
     calacs_str = subprocess.check_output(['calacs.e', '--version']).split()[0]
-    calacs_ver = [int(x) for x in calacs_str.decode().split('.')]
+    calacs_str = calacs_str.decode()
+    calacs_ver = [int(x) for x in calacs_str.split('.')]
     if calacs_ver < [8, 3, 1]:
         raise ValueError('CALACS {0} is incomptible. '
                          'Must be 8.3.1 or later.'.format(calacs_str))
+    _calacs_version_str = calacs_str
+    return calacs_str
 
-    # check date for post-SM4 and if 2K subarray or full frame
+
+def _check_header(inputfile, header, cte_correct):
+    """Check primary header of a RAW file. Returns whether it is one of
+    2K subarrays in ``SUBARRAY_LIST``, whether CTE correction is to be
+    performed, and a warning message (or `None`)."""
     is_sub2K = False
-    ctecorr = header['PCTECORR']
+    warning = None
     aperture = header['APERTURE']
     detector = header['DETECTOR']
     date_obs = Time(header['DATE-OBS'])
 
-    # intermediate filenames
-    blvtmp_name = inputfile.replace('raw', 'blv_tmp')
-    blctmp_name = inputfile.replace('raw', 'blc_tmp')
-
-    # output filenames
-    tra_name = inputfile.replace('_raw.fits', '.tra')
-    flt_name = inputfile.replace('raw', 'flt')
-    flc_name = inputfile.replace('raw', 'flc')
-
     if detector != 'WFC':
         raise ValueError("{0} is not a WFC image, please check the 'DETECTOR'"
                          " keyword.".format(inputfile))
@@ -407,123 +805,859 @@ def destripe_plus(inputfile, suffix='strp', stat='pmode1', maxiter=15,
         if aperture in SUBARRAY_LIST:
             is_sub2K = True
         else:
-            LOG.warning('Using non-2K subarray, turning CTE correction off')
+            warning = 'Using non-2K subarray, turning CTE correction off'
             cte_correct = False
 
-    # delete files from previous CALACS runs
+    return is_sub2K, cte_correct, warning
+
+
+def _plan_exposure(inputfile, cte_correct, dqbits, products, fast_dq):
+    """Plan processing of one exposure. See :func:`plan`."""
+    p = {'input': inputfile, 'accepted': False, 'reason': None,
+         'aperture': None, 'cte_correct': False, 'stages': [],
+         'products': [], 'cost_class': None}
+
+    try:
+        header = fits.getheader(inputfile)
+        p['aperture'] = header.get('APERTURE')
+        is_sub2K, cte_correct, p['reason'] = _check_header(
+            inputfile, header, cte_correct)
+        ctecorr = header['PCTECORR']
+    except (IOError, KeyError, ValueError) as e:
+        p['reason'] = str(e)
+        return p
+
+    # CTE correction of 2K subarrays is turned on by destripe_plus:
+    if cte_correct and not is_sub2K and ctecorr != 'PERFORM':
+        p['reason'] = "PCTECORR={0}, cannot run CTE correction".format(
+            ctecorr)
+        cte_correct = False
+
+    p['accepted'] = True
+    p['cte_correct'] = bool(cte_correct)
+    p['stages'] = ['acsccd']
+    if dqbits is not None and _needs_acs2d_dq(header, fast_dq, raw=True):
+        p['stages'].append('acs2d_dq')
+    p['stages'].append('destripe')
+    if cte_correct:
+        p['stages'].append('acscte')
+    for kind in _final_products(products, cte_correct):
+        p['stages'].append('acs2d_' + kind)
+        p['products'].append(_product_name(inputfile, kind))
+
+    if not header['SUBARRAY']:
+        p['cost_class'] = 'large' if cte_correct else 'medium'
+    else:
+        p['cost_class'] = 'medium' if cte_correct else 'small'
+
+    return p
+
+
+def _prepare_exposure(inputfile, scimask1, scimask2, cte_correct, clobber,
+                      scratch_dir, report, params, skip_up_to_date):
+    """Check a single exposure, delete its old products if requested,
+    and stage it in ``scratch_dir`` if given. Returns an `_Exposure`
+    that records its processing in ``report`` (an `_ExposureReport`),
+    or `None` if ``skip_up_to_date`` is set and its products are up to
+    date with respect to ``params`` (values of ``_MANIFEST_PARAMS``).
+    See :func:`destripe_plus` for other parameters."""
+    # verify that the RAW image exists in cwd
+    cwddir = os.getcwd()
+    if not os.path.exists(os.path.join(cwddir, inputfile)):
+        raise IOError("{0} does not exist.".format(inputfile))
+
+    # get image's primary header:
+    header = fits.getheader(inputfile)
+
+    # verify masks defined (or not) simultaneously:
+    if header['CCDAMP'] == 'ABCD' and \
+       ((scimask1 is not None and scimask2 is None) or \
+        (scimask1 is None and scimask2 is not None)):
+        raise ValueError("Both 'scimask1' and 'scimask2' must be specified "
+                         "or not specified together.")
+
+    calacs_version = _calacs_version()
+
+    # check date for post-SM4 and if 2K subarray or full frame
+    ctecorr = header['PCTECORR']
+    is_sub2K, cte_correct, warning = _check_header(inputfile, header,
+                                                   cte_correct)
+    if warning is not None:
+        LOG.warning(warning)
+
+    # output filenames
+    tra_name = _product_name(inputfile, '.tra')
+    flt_name = _product_name(inputfile, 'flt')
+    flc_name = _product_name(inputfile, 'flc')
+
+    # manifests (with checksums) are only needed to skip exposures:
+    manifest = None
+    if skip_up_to_date:
+        manifest = _exposure_manifest(inputfile, header, scimask1, scimask2,
+                                      params, calacs_version)
+        if _is_up_to_date(inputfile, manifest):
+            LOG.info('{0} is up to date, skipping.'.format(inputfile))
+            report.skipped = True
+            return None
+
+    if not scratch_dir:
+        # delete files from previous CALACS runs
+        if clobber:
+            for tmpfilename in [_product_name(inputfile, 'blv_tmp'),
+                                _product_name(inputfile, 'blc_tmp'),
+                                flt_name, flc_name, tra_name]:
+                if os.path.exists(tmpfilename):
+                    os.remove(tmpfilename)
+
+        exposure = _Exposure(inputfile, inputfile, None, cte_correct,
+                             is_sub2K, ctecorr, report)
+        exposure.manifest = manifest
+        return exposure
+
+    # stage RAW (and trailer) files in a private scratch directory:
     if clobber:
-        for tmpfilename in [blvtmp_name, blctmp_name, flt_name, flc_name,
-                            tra_name]:
-            if os.path.exists(tmpfilename):
-                os.remove(tmpfilename)
-
-    # run ACSCCD on RAW subarray
-    acsccd.acsccd(inputfile)
-
-    # modify user mask with DQ masks if requested
-    dqbits = interpret_bit_flags(dqbits)
-    if dqbits is not None:
-        # save 'tra' file in memory to trick the log file
-        # not to save first acs2d log as this is done only
-        # for the purpose of obtaining DQ masks.
-        # WISH: it would have been nice is there was an easy way of obtaining
-        #       just the DQ masks as if data were calibrated but without
-        #       having to recalibrate them with acs2d.
-        if os.path.isfile(tra_name):
-            fh = open(tra_name)
-            tra_lines = fh.readlines()
-            fh.close()
-        else:
-            tra_lines = None
+        for outfilename in [flt_name, flc_name, tra_name]:
+            if os.path.exists(outfilename):
+                os.remove(outfilename)
+    else:
+        for outfilename in [flt_name, flc_name]:
+            if os.path.exists(outfilename):
+                raise IOError("{0} already exists.".format(outfilename))
+
+    jobdir = tempfile.mkdtemp(
+        prefix=os.path.basename(inputfile).replace('_raw.fits', '_'),
+        dir=scratch_dir)
+    exposure = _Exposure(inputfile,
+                         os.path.join(jobdir, os.path.basename(inputfile)),
+                         jobdir, cte_correct, is_sub2K, ctecorr, report)
+    exposure.manifest = manifest
 
-        # apply flats, etc.
-        acs2d.acs2d(blvtmp_name, verbose=False, quiet=True)
+    try:
+        with report.stage('scratch_in', [exposure.work_name]):
+            shutil.copy(inputfile, exposure.work_name)
+            if os.path.isfile(tra_name):
+                shutil.copy(tra_name,
+                            _product_name(exposure.work_name, '.tra'))
+    except Exception:
+        exposure.cleanup()
+        raise
+
+    return exposure
+
+
+def _destripe_exposure(inputfile, scimask1, scimask2, suffix, stat, maxiter,
+                       sigrej, lower, upper, binwidth, dqbits, rpt_clean,
+                       atol, cte_correct, clobber, verbose,
+                       scratch_dir, cpu_budget, skip_up_to_date, products,
+                       fast_dq, stage_locks=None, exposure=None,
+                       report=None):
+    """Check and process a single exposure. See :func:`destripe_plus`.
+
+    ``stage_locks``, if given, maps stage names to semaphores that are
+    held while the exposure goes through the corresponding stage.
+    ``cpu_budget`` is a `_CPUBudget` or `None`.
+    ``exposure``, if given, is the `_Exposure` already set up by
+    :func:`_prepare_exposure` (and possibly run through ACSCCD).
+    Otherwise, processing is recorded in ``report``, if given.
 
-        # extract DQ arrays from the FLT image:
-        dq1, dq2 = _read_DQ_arrays(flt_name)
-        if isinstance(scimask1, str):
-            if scimask1.strip() is '':
-                mask1 = None
-                scimask1 = None
-            else:
-                mask1 = fits.getdata(scimask1)
-        elif isinstance(scimask1, np.ndarray):
-            mask1 = scimask1.copy()
-        elif scimask1 is None:
-            mask1 = None
+    """
+    if exposure is None:
+        if report is None:
+            report = _ExposureReport(inputfile)
+        params = dict(zip(_MANIFEST_PARAMS,
+                          (stat, maxiter, sigrej, lower, upper, binwidth,
+                           dqbits, rpt_clean, atol, cte_correct, products,
+                           fast_dq)))
+        exposure = _prepare_exposure(inputfile, scimask1, scimask2,
+                                     cte_correct, clobber, scratch_dir,
+                                     report, params, skip_up_to_date)
+        if exposure is None:
+            return
+
+    try:
+        cte_correct = _calibrate_and_destripe(
+            exposure.work_name, suffix, stat, maxiter, sigrej, lower,
+            upper, binwidth, scimask1, scimask2, dqbits, rpt_clean, atol,
+            exposure.cte_correct, exposure.is_sub2K, exposure.ctecorr,
+            clobber, verbose, exposure.report, stage_locks,
+            cpu_budget, products, fast_dq,
+            run_acsccd=not exposure.acsccd_done)
+
+        # move final products back:
+        if exposure.jobdir is not None:
+            outputs = exposure.outputs()
+            with exposure.report.stage('scratch_out', outputs):
+                for outfilename in outputs:
+                    workfilename = os.path.join(
+                        exposure.jobdir, os.path.basename(outfilename))
+                    if os.path.isfile(workfilename):
+                        shutil.move(workfilename, outfilename)
+
+    finally:
+        exposure.cleanup()
+
+    if exposure.manifest is not None:
+        _write_manifest(inputfile, exposure.manifest)
+
+    info_str = 'Done.\n'
+    for kind in _final_products(products, cte_correct):
+        info_str += '{0}: {1}\n'.format(kind.upper(),
+                                        _product_name(inputfile, kind))
+    LOG.info(info_str)
+
+
+def _run_acsccd_batch(exposures):
+    """Run ACSCCD on prepared exposures with as few calls as the
+    command line length allows. Exposures of a failed call are left
+    to be run through ACSCCD one at a time."""
+    chunks = []
+    chunk = []
+    length = 0
+    for exposure in exposures:
+        n = len(exposure.work_name) + 1  # with separating comma
+        if chunk and length + n > _ACSCCD_MAX_ARG_LEN:
+            chunks.append(chunk)
+            chunk = []
+            length = 0
+        chunk.append(exposure)
+        length += n
+    if chunk:
+        chunks.append(chunk)
+
+    for chunk in chunks:
+        blvtmp_names = [_product_name(exposure.work_name, 'blv_tmp')
+                        for exposure in chunk]
+        existed = [os.path.exists(f) for f in blvtmp_names]
+        records = []
+
+        try:
+            with _timed_stage('acsccd', (), records.append):
+                acsccd.acsccd([exposure.work_name for exposure in chunk])
+        except (subprocess.CalledProcessError, OSError) as e:
+            LOG.warning('ACSCCD failed on a batch of {0} exposures ({1}); '
+                        'running it one exposure at a time.'
+                        ''.format(len(chunk), str(e)))
+            _add_batch_record(records[0], chunk, blvtmp_names)
+            # remove products of this call, so that runs on single
+            # exposures do not fail on them:
+            for blvtmp_name, old in zip(blvtmp_names, existed):
+                if not old and os.path.isfile(blvtmp_name):
+                    os.remove(blvtmp_name)
+            continue
+
+        _add_batch_record(records[0], chunk, blvtmp_names)
+        for exposure, blvtmp_name, old in zip(chunk, blvtmp_names, existed):
+            exposure.acsccd_done = not old and os.path.isfile(blvtmp_name)
+
+
+def _add_batch_record(record, exposures, blvtmp_names):
+    """Add record of an ACSCCD call shared by exposures to their reports."""
+    for exposure, blvtmp_name in zip(exposures, blvtmp_names):
+        exposure_record = dict(record)
+        exposure_record['shared_by'] = len(exposures)
+        exposure_record['output_sizes'] = _file_sizes([blvtmp_name])
+        exposure.report.stages.append(exposure_record)
+
+
+def _prepare_batch(jobs, kwargs):
+    """Prepare ``(inputfile, scimask1, scimask2, None)`` jobs and run
+    ACSCCD on all of them. Returns jobs with their `_Exposure` set,
+    skipped (up to date) input files, and errors and reports of exposures
+    that were not prepared."""
+    prepared = []
+    skipped = []
+    errors = {}
+    reports = []
+    params = dict((name, kwargs[name]) for name in _MANIFEST_PARAMS)
+    for img, mf1, mf2, exposure in jobs:
+        report = _ExposureReport(img)
+        try:
+            exposure = _prepare_exposure(
+                img, mf1, mf2, kwargs['cte_correct'], kwargs['clobber'],
+                kwargs['scratch_dir'], report, params,
+                kwargs['skip_up_to_date'])
+        except Exception as e:
+            errmsg = '{0}: {1}'.format(type(e), str(e))
+            LOG.error('{0} failed: {1}'.format(img, errmsg))
+            errors[img] = errmsg
+            report.finish(errmsg)
+            reports.append(report.as_dict())
+            continue
+
+        if exposure is None:
+            skipped.append(img)
+            report.finish()
+            reports.append(report.as_dict())
         else:
-            raise TypeError("'scimask1' must be either a str file name, "
-                            "a numpy.ndarray, or None.")
+            prepared.append((img, mf1, mf2, exposure))
+
+    _run_acsccd_batch([job[3] for job in prepared])
+
+    return prepared, skipped, errors, reports
+
+
+def _product_name(rawname, kind):
+    """Name of a product of the given RAW file, in the same directory.
+    ``kind`` replaces ``'raw'`` in the file name (e.g., ``'flt'``),
+    except for kinds starting with ``'.'`` or ``'_'`` (e.g., ``'.tra'``),
+    which replace ``'_raw.fits'``."""
+    dirname, basename = os.path.split(rawname)
+    if kind[0] in '._':
+        basename = basename.replace('_raw.fits', kind)
+    else:
+        basename = basename.replace('raw', kind)
+    return os.path.join(dirname, basename)
+
+
+def _needs_acs2d_dq(header, fast_dq, raw=False):
+    """Whether ACS2D has to be run to obtain DQ arrays of the FLT image
+    of an exposure, given the primary header of its ACSCCD product (or of
+    its RAW file if ``raw`` is `True`, in which case ``DQICORR=PERFORM``
+    is left to ACSCCD). See ``fast_dq`` in :func:`destripe_plus`."""
+    if not fast_dq:
+        return True
+    if header.get('SATUFILE', 'N/A').strip() not in ('', 'N/A'):
+        return True
+    for key in _ACS2D_DQ_SWITCHES:
+        value = header.get(key, 'OMIT')
+        if raw and key == 'DQICORR' and value == 'PERFORM':
+            continue
+        if value not in ('OMIT', 'COMPLETE'):
+            return True
+    return False
+
+
+def _calibrate_and_destripe(inputfile, suffix, stat, maxiter, sigrej,
+                            lower, upper, binwidth, scimask1, scimask2,
+                            dqbits, rpt_clean, atol, cte_correct, is_sub2K,
+                            ctecorr, clobber, verbose, report,
+                            stage_locks=None, cpu_budget=None,
+                            products=('flt', 'flc'), fast_dq=False,
+                            run_acsccd=True):
+    """Run CALACS and ``acs_destripe`` on a single exposure, writing all
+    files next to ``inputfile``. ACSCCD is skipped if ``run_acsccd`` is
+    `False` (i.e., its product already exists). Stages are recorded in
+    ``report`` (an `_ExposureReport`) and take CPUs from ``cpu_budget``
+    (a `_CPUBudget`), if given. ACS2D is run only for the requested
+    ``products`` (and for DQ arrays, unless ``fast_dq`` allows otherwise).
+    Returns whether CTE correction was done.
+    See :func:`destripe_plus` for other parameters."""
+    # Optional package dependency
+    try:
+        from stsci.tools.bitmask import interpret_bit_flags
+    except ImportError:
+        from stsci.tools.bitmask import (
+            interpret_bits_value as interpret_bit_flags
+        )
+
+    # intermediate filenames
+    blvtmp_name = _product_name(inputfile, 'blv_tmp')
+    blctmp_name = _product_name(inputfile, 'blc_tmp')
 
-        scimask1 = acs_destripe._mergeUserMaskAndDQ(dq1, mask1, dqbits)
+    # output filenames
+    tra_name = _product_name(inputfile, '.tra')
+    flt_name = _product_name(inputfile, 'flt')
+
+    with _stage(stage_locks, 'acsccd'), _cpus(cpu_budget):
+        # run ACSCCD on RAW subarray
+        if run_acsccd:
+            with report.stage('acsccd', [blvtmp_name]):
+                acsccd.acsccd(inputfile)
+
+        # modify user mask with DQ masks if requested
+        dqbits = interpret_bit_flags(dqbits)
+        if dqbits is not None:
+            use_acs2d = _needs_acs2d_dq(fits.getheader(blvtmp_name),
+                                        fast_dq)
+
+            if use_acs2d:
+                # save 'tra' file in memory to trick the log file
+                # not to save first acs2d log as this is done only
+                # for the purpose of obtaining DQ masks.
+                if os.path.isfile(tra_name):
+                    fh = open(tra_name)
+                    tra_lines = fh.readlines()
+                    fh.close()
+                else:
+                    tra_lines = None
+
+                # apply flats, etc.
+                with report.stage('acs2d_dq', [flt_name]):
+                    acs2d.acs2d(blvtmp_name, verbose=False, quiet=True)
+
+                # extract DQ arrays from the FLT image:
+                dq1, dq2 = _read_DQ_arrays(flt_name)
 
-        if isinstance(scimask2, str):
-            if scimask2.strip() is '':
+            else:
+                dq1, dq2 = _read_DQ_arrays(blvtmp_name, add_ref_dq=True)
+
+            if isinstance(scimask1, str):
+                if scimask1.strip() is '':
+                    mask1 = None
+                    scimask1 = None
+                else:
+                    mask1 = fits.getdata(scimask1)
+            elif isinstance(scimask1, np.ndarray):
+                mask1 = scimask1.copy()
+            elif scimask1 is None:
+                mask1 = None
+            else:
+                raise TypeError("'scimask1' must be either a str file name, "
+                                "a numpy.ndarray, or None.")
+
+            scimask1 = acs_destripe._mergeUserMaskAndDQ(dq1, mask1, dqbits)
+
+            if isinstance(scimask2, str):
+                if scimask2.strip() is '':
+                    mask2 = None
+                    scimask2 = None
+                else:
+                    mask2 = fits.getdata(scimask2)
+            elif isinstance(scimask2, np.ndarray):
+                mask2 = scimask2.copy()
+            elif scimask2 is None:
                 mask2 = None
-                scimask2 = None
             else:
-                mask2 = fits.getdata(scimask2)
-        elif isinstance(scimask2, np.ndarray):
-            mask2 = scimask2.copy()
-        elif scimask2 is None:
-            mask2 = None
+                raise TypeError("'scimask2' must be either a str file name, "
+                                "a numpy.ndarray, or None.")
+
+            if dq2 is not None:
+                scimask2 = acs_destripe._mergeUserMaskAndDQ(dq2, mask2, dqbits)
+
+            if use_acs2d:
+                # reconstruct trailer file:
+                if tra_lines is not None:
+                    fh = open(tra_name, mode='w')
+                    fh.writelines(tra_lines)
+                    fh.close()
+
+                # delete temporary FLT image:
+                if os.path.isfile(flt_name):
+                    os.remove(flt_name)
+
+    with _stage(stage_locks, 'destripe'), _cpus(cpu_budget):
+        # execute destriping of the subarray (post-SM4 data only)
+        blvtmpsfx_name = _product_name(inputfile,
+                                       'blv_tmp_{0}'.format(suffix))
+        with report.stage('destripe', [blvtmpsfx_name]):
+            stats = acs_destripe.clean(
+                blvtmp_name, suffix, stat=stat, maxiter=maxiter,
+                sigrej=sigrej, lower=lower, upper=upper, binwidth=binwidth,
+                mask1=scimask1, mask2=scimask2, dqbits=dqbits,
+                rpt_clean=rpt_clean, atol=atol, clobber=clobber,
+                verbose=verbose)
+        # clean() skips (with a warning) images it cannot de-stripe:
+        if stats:
+            report.destripe = stats[0]
+            os.rename(blvtmpsfx_name, blvtmp_name)
         else:
-            raise TypeError("'scimask2' must be either a str file name, "
-                            "a numpy.ndarray, or None.")
+            LOG.warning('{0} was not de-striped'.format(inputfile))
 
-        if dq2 is not None:
-            scimask2 = acs_destripe._mergeUserMaskAndDQ(dq2, mask2, dqbits)
-
-        # reconstruct trailer file:
-        if tra_lines is not None:
-            fh = open(tra_name, mode='w')
-            fh.writelines(tra_lines)
-            fh.close()
-
-        # delete temporary FLT image:
-        if os.path.isfile(flt_name):
-            os.remove(flt_name)
-
-    # execute destriping of the subarray (post-SM4 data only)
-    acs_destripe.clean(
-        blvtmp_name, suffix, stat=stat, maxiter=maxiter, sigrej=sigrej,
-        lower=lower, upper=upper, binwidth=binwidth,
-        mask1=scimask1, mask2=scimask2, dqbits=dqbits,
-        rpt_clean=rpt_clean, atol=atol, clobber=clobber, verbose=verbose)
-    blvtmpsfx = 'blv_tmp_{0}'.format(suffix)
-    os.rename(inputfile.replace('raw', blvtmpsfx), blvtmp_name)
-
-    # update subarray header
-    if is_sub2K and cte_correct:
-        fits.setval(blvtmp_name, 'PCTECORR', value='PERFORM')
-        ctecorr = 'PERFORM'
+        # update subarray header
+        if is_sub2K and cte_correct:
+            fits.setval(blvtmp_name, 'PCTECORR', value='PERFORM')
+            ctecorr = 'PERFORM'
 
     # perform CTE correction on destriped image
     if cte_correct:
         if ctecorr == 'PERFORM':
-            acscte.acscte(blvtmp_name)
+            with _stage(stage_locks, 'acscte'), \
+                    _cpus(cpu_budget, cte=True) as n_threads, \
+                    report.stage('acscte', [blctmp_name]) as record:
+                record['threads'] = n_threads
+                if n_threads is None:
+                    acscte.acscte(blvtmp_name)
+                elif n_threads == 1:
+                    acscte.acscte(blvtmp_name, single_core=True)
+                else:
+                    acscte.acscte(blvtmp_name,
+                                  exe_args=['--nThreads', str(n_threads)])
         else:
             LOG.warning(
                 "PCTECORR={0}, cannot run CTE correction".format(ctecorr))
             cte_correct = False
 
-    # run ACS2D to get FLT and FLC images
-    acs2d.acs2d(blvtmp_name)
-    if cte_correct:
-        acs2d.acs2d(blctmp_name)
+    final_products = _final_products(products, cte_correct)
+    if 'flt' in final_products and 'flt' not in products:
+        LOG.warning('No CTE correction, making FLT instead of FLC.')
+
+    with _stage(stage_locks, 'acs2d'), _cpus(cpu_budget):
+        # run ACS2D to get requested FLT and FLC images
+        if 'flt' in final_products:
+            with report.stage('acs2d_flt', [flt_name]):
+                acs2d.acs2d(blvtmp_name)
+        if 'flc' in final_products:
+            with report.stage('acs2d_flc', [_product_name(inputfile, 'flc')]):
+                acs2d.acs2d(blctmp_name)
 
     # delete intermediate files
     os.remove(blvtmp_name)
     if cte_correct and os.path.isfile(blctmp_name):
         os.remove(blctmp_name)
 
-    info_str = 'Done.\nFLT: {0}\n'.format(flt_name)
-    if cte_correct:
-        info_str += 'FLC: {0}\n'.format(flc_name)
-    LOG.info(info_str)
-
+    return cte_correct
+
+
+def _check_products(products, cte_correct):
+    """Return requested products as a sorted list of kinds."""
+    if isinstance(products, str):
+        products = products.split(',')
+    products = sorted(set(p.strip().lower() for p in products))
+    if not products or not set(products).issubset(('flt', 'flc')):
+        raise ValueError("'products' must be 'flt', 'flc', or both.")
+    if not cte_correct and products == ['flc']:
+        raise ValueError("FLC products require CTE correction.")
+    return products
+
+
+def _final_products(products, cte_correct):
+    """Kinds of products made for the requested ``products``."""
+    if not cte_correct:
+        return ['flt']
+    return [kind for kind in ('flt', 'flc') if kind in products]
+
+
+class _NoStage(object):
+    """Stand-in for a stage semaphore when stages are not limited."""
+
+    def __enter__(self):
+        return None
+
+    def __exit__(self, *args):
+        return False
+
+
+def _stage(stage_locks, name):
+    """Return the context manager guarding the given processing stage."""
+    if stage_locks is None:
+        return _NoStage()
+    return stage_locks[name]
+
+
+class _CPUBudget(object):
+    """CPUs shared by exposures processed at the same time, in threads
+    or processes. See the ``cpu_budget`` parameter of
+    :func:`destripe_plus`."""
+
+    def __init__(self, n_cpus):
+        self.n_cpus = n_cpus
+        self._cond = multiprocessing.Condition()
+        self._free = multiprocessing.RawValue('i', n_cpus)
+        # exposures holding CPUs, and CTE corrections waiting for them:
+        self._active = multiprocessing.RawValue('i', 0)
+        self._cte_waiting = multiprocessing.RawValue('i', 0)
+
+    def _share(self):
+        return max(self.n_cpus // (self._active.value + 1), 1)
+
+    @contextlib.contextmanager
+    def cpus(self, cte=False):
+        """Hold CPUs for a stage and yield their number: one, or a fair
+        share of the budget for CTE correction. CTE correction waits until
+        its share is free, and other stages do not start meanwhile."""
+        with self._cond:
+            if cte:
+                self._cte_waiting.value += 1
+                while self._free.value < self._share():
+                    self._cond.wait()
+                self._cte_waiting.value -= 1
+                n = self._share()
+            else:
+                while self._free.value < 1 or self._cte_waiting.value > 0:
+                    self._cond.wait()
+                n = 1
+            self._free.value -= n
+            self._active.value += 1
+
+        try:
+            yield n
+        finally:
+            with self._cond:
+                self._free.value += n
+                self._active.value -= 1
+                self._cond.notify_all()
+
+
+def _cpus(cpu_budget, cte=False):
+    """Return the context manager holding CPUs of ``cpu_budget`` for
+    a stage. It yields the number of CPUs, or `None` if not limited."""
+    if cpu_budget is None:
+        return _NoStage()
+    return cpu_budget.cpus(cte=cte)
+
+
+def _destripe_plus_one(img, mf1, mf2, exposure, kwargs, stage_locks=None):
+    """Process one exposure of a batch, returning an error message
+    instead of raising, and the processing report."""
+    if exposure is None:
+        report = _ExposureReport(img)
+    else:
+        report = exposure.report
 
-def _read_DQ_arrays(flt_name):
+    try:
+        _destripe_exposure(img, mf1, mf2, stage_locks=stage_locks,
+                           exposure=exposure, report=report, **kwargs)
+    except Exception as e:
+        errmsg = '{0}: {1}'.format(type(e), str(e))
+        report.finish(errmsg)
+        return False, errmsg, report.as_dict()
+
+    report.finish()
+    return True, None, report.as_dict()
+
+
+def _destripe_plus_worker(work_queue, done_queue, kwargs):
+    """Multiprocessing worker."""
+    for img, mf1, mf2, exposure in iter(work_queue.get, 'STOP'):
+        retcode, errmsg, report = _destripe_plus_one(img, mf1, mf2, exposure,
+                                                     kwargs)
+        done_queue.put((retcode, img, errmsg, report))
+
+    return True
+
+
+def _destripe_plus_batch(jobs, kwargs, n_processes):
+    """Process ``(inputfile, scimask1, scimask2, exposure)`` jobs with
+    :func:`destripe_plus`, concurrently if requested. ``exposure`` is
+    `None` or an `_Exposure` from :func:`_prepare_batch`."""
+    done = []
+    errors = {}
+    reports = []
+
+    # Adjust number of processes
+    n_cpu = multiprocessing.cpu_count()
+    if n_processes is None or n_processes > n_cpu:
+        n_processes = n_cpu
+    if n_processes > len(jobs):
+        n_processes = len(jobs)
+
+    # No multiprocessing
+    if n_processes <= 1:
+        for img, mf1, mf2, exposure in jobs:
+            retcode, errmsg, report = _destripe_plus_one(img, mf1, mf2,
+                                                         exposure, kwargs)
+            reports.append(report)
+            if retcode:
+                done.append(img)
+            else:
+                LOG.error('{0} failed: {1}'.format(img, errmsg))
+                errors[img] = errmsg
+        return done, errors, reports
+
+    # Multiprocessing.
+    # The work queue is shared by all processes. When a worker finishes
+    # an exposure, its status is put into done queue.
+    LOG.info('Using {0} processes'.format(n_processes))
+
+    work_queue = Queue()
+    done_queue = Queue()
+    processes = []
+
+    for job in jobs:
+        work_queue.put(job)
+
+    for w in range(n_processes):
+        p = Process(target=_destripe_plus_worker,
+                    args=(work_queue, done_queue, kwargs))
+        p.start()
+        processes.append(p)
+        work_queue.put('STOP')
+
+    # Collect status before joining, so that workers never block on
+    # a full done queue. A worker that dies never reports the exposure it
+    # was processing, so stop waiting once all workers have exited.
+    pending = [job[0] for job in jobs]
+    exited = False
+    while pending:
+        try:
+            retcode, img, errmsg, report = done_queue.get(
+                timeout=_WORKER_POLL_INTERVAL)
+        except Empty:
+            if exited:
+                break
+            # Check once more after all workers have exited, in case their
+            # last status was still in transit.
+            exited = not any(p.is_alive() for p in processes)
+            continue
+
+        pending.remove(img)
+        reports.append(report)
+        if retcode:
+            done.append(img)
+        else:
+            LOG.error('{0} failed: {1}'.format(img, errmsg))
+            errors[img] = errmsg
+
+    for p in processes:
+        p.join()
+
+    for img in pending:
+        errmsg = ('Worker process exited without reporting status '
+                  '(exit codes: {0})'.format(
+                      ', '.join(str(p.exitcode) for p in processes)))
+        LOG.error('{0} failed: {1}'.format(img, errmsg))
+        errors[img] = errmsg
+        report = _ExposureReport(img)
+        report.finish(errmsg)
+        reports.append(report.as_dict())
+
+    return done, errors, reports
+
+
+def _destripe_plus_pipeline(jobs, kwargs, stage_limits):
+    """Process ``(inputfile, scimask1, scimask2, exposure)`` jobs with
+    :func:`destripe_plus` in a pipeline of stages, each of which
+    allows a limited number of exposures at a time."""
+    stages = ('acsccd', 'destripe', 'acscte', 'acs2d')
+    for name in stage_limits:
+        if name not in stages:
+            raise ValueError("Unknown processing stage '{0}'. Stages are: "
+                             "{1}.".format(name, ', '.join(stages)))
+
+    limits = dict((name, max(1, stage_limits.get(name, 1)))
+                  for name in stages)
+    stage_locks = dict((name, threading.Semaphore(limits[name]))
+                       for name in stages)
+
+    # Limit number of exposures in flight (and their intermediate files)
+    # to the number of exposures that can be processed at the same time:
+    in_flight = threading.Semaphore(sum(limits.values()))
+
+    done = []
+    errors = {}
+    reports = []
+    lock = threading.Lock()
+
+    def process(img, mf1, mf2, exposure):
+        try:
+            retcode, errmsg, report = _destripe_plus_one(
+                img, mf1, mf2, exposure, kwargs, stage_locks=stage_locks)
+            with lock:
+                reports.append(report)
+                if retcode:
+                    done.append(img)
+                else:
+                    LOG.error('{0} failed: {1}'.format(img, errmsg))
+                    errors[img] = errmsg
+        finally:
+            in_flight.release()
+
+    threads = []
+    for job in jobs:
+        in_flight.acquire()
+        t = threading.Thread(target=process, args=job)
+        t.start()
+        threads.append(t)
+
+    for t in threads:
+        t.join()
+
+    return done, errors, reports
+
+
+def _file_checksum(filename):
+    h = hashlib.sha256()
+    with open(filename, 'rb') as fh:
+        for block in iter(lambda: fh.read(1 << 20), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+def _file_info(filename):
+    st = os.stat(filename)
+    return {'size': st.st_size, 'mtime': st.st_mtime}
+
+
+def _mask_checksum(mask):
+    if mask is None:
+        return None
+    if isinstance(mask, str):
+        if mask.strip() == '':
+            return None
+        return _file_checksum(mask)
+    return hashlib.sha256(np.ascontiguousarray(mask).tobytes()).hexdigest()
+
+
+def _exposure_manifest(inputfile, header, scimask1, scimask2, params,
+                       calacs_version):
+    """Everything products of an exposure depend on, except for the
+    checksum of the RAW file, which is added by :func:`_write_manifest`.
+    ``header`` is the primary header of the RAW file."""
+    reffiles = {}
+    for key, value in header.items():
+        if not (key.endswith('FILE') or key.endswith('TAB')):
+            continue
+        if not isinstance(value, str) or value.strip() in ('', 'N/A'):
+            continue
+        try:
+            mtime = os.path.getmtime(from_irafpath(value))
+        except (OSError, ValueError):
+            mtime = None
+        reffiles[key] = {'name': value, 'mtime': mtime}
+
+    manifest = {
+        'input': dict(_file_info(inputfile),
+                      name=os.path.basename(inputfile)),
+        'masks': [_mask_checksum(scimask1), _mask_checksum(scimask2)],
+        'reference_files': reffiles,
+        'parameters': params,
+        'calacs_version': calacs_version,
+        'destripe': {'version': acs_destripe.__version__,
+                     'reduction_backend':
+                         acs_destripe.get_reduction_backend()}}
+    return manifest
+
+
+def _write_manifest(inputfile, manifest):
+    """Record products of a processed exposure in its manifest."""
+    manifest = dict(manifest)
+    manifest['input'] = dict(manifest['input'],
+                             sha256=_file_checksum(inputfile))
+    manifest['products'] = {}
+    for kind in ('flt', 'flc'):
+        filename = _product_name(inputfile, kind)
+        if os.path.isfile(filename):
+            manifest['products'][os.path.basename(filename)] = \
+                _file_info(filename)
+
+    with open(_product_name(inputfile, '_manifest.json'), 'w') as fh:
+        json.dump(manifest, fh, indent=2, sort_keys=True)
+
+
+def _is_up_to_date(inputfile, manifest):
+    """Compare the manifest of existing products of an exposure
+    with ``manifest`` from :func:`_exposure_manifest`."""
+    try:
+        with open(_product_name(inputfile, '_manifest.json')) as fh:
+            old = json.load(fh)
+    except (IOError, ValueError):
+        return False
+
+    for key in ('masks', 'reference_files', 'parameters', 'calacs_version',
+                'destripe'):
+        if old.get(key) != manifest[key]:
+            return False
+
+    # checksum RAW file only if it may have changed:
+    old_input = old.get('input', {})
+    new_input = manifest['input']
+    if (old_input.get('size') != new_input['size'] or
+            old_input.get('mtime') != new_input['mtime']):
+        if old_input.get('sha256') != _file_checksum(inputfile):
+            return False
+
+    products = old.get('products')
+    if not products:
+        return False
+    for name, info in products.items():
+        filename = os.path.join(os.path.dirname(inputfile), name)
+        if not os.path.isfile(filename) or _file_info(filename) != info:
+            return False
+
+    return True
+
+
+def _read_DQ_arrays(flt_name, add_ref_dq=False):
     h = fits.open(flt_name)
     ampstring = h[0].header['CCDAMP']
     dq1 = h['dq',1].data
@@ -531,6 +1665,13 @@ def _read_DQ_arrays(flt_name):
         dq2 = h['dq',2].data
     else:
         dq2 = None
+
+    # add DQ flags that ACS2D would propagate from reference files:
+    if add_ref_dq:
+        dq1 = dq1 | extract_ref_dq(h[0].header, h['sci',1], extver=1)
+        if dq2 is not None:
+            dq2 = dq2 | extract_ref_dq(h[0].header, h['sci',2], extver=2)
+
     return (dq1, dq2)
 
 
@@ -561,7 +1702,15 @@ def run(configobj=None):
         atol=configobj['atol'],
         cte_correct=configobj['cte_correct'],
         clobber=configobj['clobber'],
-        verbose=configobj['verbose'])
+        verbose=configobj['verbose'],
+        n_processes=configobj['n_processes'],
+        scratch_dir=configobj['scratch_dir'],
+        report=configobj['report'],
+        cpu_budget=configobj['cpu_budget'],
+        skip_up_to_date=configobj['skip_up_to_date'],
+        products=configobj['products'],
+        batch_acsccd=configobj['batch_acsccd'],
+        fast_dq=configobj['fast_dq'])
 
 
 #-----------------------------#
@@ -615,6 +1764,33 @@ def main():
         help='Absolute tolerance to stop *repeated* bias de-stripes.')
     parser.add_argument(
         '--nocte', action='store_true', help='Turn off CTE correction.')
+    parser.add_argument(
+        '--nproc', type=int, default=1,
+        help='Number of exposures to process concurrently.')
+    parser.add_argument(
+        '--scratch_dir', type=str, default=None,
+        help='Directory for intermediate files.')
+    parser.add_argument(
+        '--cpu_budget', type=int, default=None,
+        help='Maximum number of CPUs to use.')
+    parser.add_argument(
+        '--report', type=str, default=False,
+        help='JSON file for processing report.')
+    parser.add_argument(
+        '--skip_up_to_date', action='store_true',
+        help='Skip exposures with up-to-date products.')
+    parser.add_argument(
+        '--products', type=str, default='flt,flc',
+        help='Comma-separated products to make (flt, flc).')
+    parser.add_argument(
+        '--batch_acsccd', action='store_true',
+        help='Run ACSCCD on all inputs in as few calls as possible.')
+    parser.add_argument(
+        '--fast_dq', action='store_true',
+        help='Build DQ masks without ACS2D when possible.')
+    parser.add_argument(
+        '--plan', action='store_true',
+        help='Only print processing plan based on image headers.')
     parser.add_argument(
         '--clobber', action='store_true', help='Clobber output')
     parser.add_argument(
@@ -625,6 +1801,29 @@ def main():
         version='{0} v{1} ({2})'.format(__taskname__, __version__, __vdate__))
     options = parser.parse_args()
 
+    if options.plan:
+        plans, totals = plan(options.arg0, cte_correct=not options.nocte,
+                             dqbits=options.dqbits,
+                             products=options.products,
+                             fast_dq=options.fast_dq)
+        for p in plans:
+            if p['accepted']:
+                print('{0}  {1}  cte={2}  {3}'.format(
+                    p['input'], p['cost_class'], p['cte_correct'],
+                    ','.join(p['stages'])))
+            else:
+                print('{0}  REJECTED'.format(p['input']))
+            if p['reason']:
+                print('    {0}'.format(p['reason']))
+        print('{0} files: {1} accepted, {2} rejected, {3} with CTE '
+              'correction.'.format(totals['files'], totals['accepted'],
+                                   totals['rejected'],
+                                   totals['cte_correct']))
+        print('Cost classes: {0}'.format(', '.join(
+            '{0}={1}'.format(k, v)
+            for k, v in sorted(totals['cost_classes'].items()))))
+        return
+
     if options.sci1_mask:
         mask1 = options.sci1_mask[0]
     else:
@@ -642,7 +1841,13 @@ def main():
                   scimask1=mask1, scimask2=mask2, dqbits=options.dqbits,
                   rpt_clean=options.rpt_clean, atol=options.atol,
                   cte_correct=not options.nocte, clobber=options.clobber,
-                  verbose=not options.quiet)
+                  verbose=not options.quiet, n_processes=options.nproc,
+                  scratch_dir=options.scratch_dir, report=options.report,
+                  cpu_budget=options.cpu_budget,
+                  skip_up_to_date=options.skip_up_to_date,
+                  products=options.products,
+                  batch_acsccd=options.batch_acsccd,
+                  fast_dq=options.fast_dq)
 
 
 if __name__=='__main__':
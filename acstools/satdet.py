@@ -88,6 +88,20 @@ array([[[1242, 1348],
 >>> errors
 {}
 
+Process the results of each image and extension as soon as they are
+available, instead of waiting for all the images to finish:
+
+>>> from acstools.satdet import iter_detsat
+>>> for filename, ext, result in iter_detsat(
+...         '*_flc.fits', chips=[1, 4], n_processes=12):
+...     if isinstance(result, str):
+...         print('{0}[{1}] failed: {2}'.format(filename, ext, result))
+...     elif len(result) > 0:
+...         print('{0}[{1}]: {2}'.format(filename, ext, len(result)))
+jc8m10syq_flc.fits[4]: 38
+abell2744_acs-wfc_f814w_13495_51_04_jc8n51hoq_flc.fits[4]: 34
+...
+
 For a given image and extension, create a DQ mask for a satellite trail using
 the first segment (other segments should give similar masks) based on the
 results from above (plots not shown):
@@ -113,6 +127,19 @@ Existing flagged NPIX=0
 Newly... flagged NPIX=156362
 jc8m10syq_flc.fits[6] updated
 
+Create the masks of all the trails found by :func:`detsat` with
+multiprocessing, and update the corresponding DQ arrays:
+
+>>> from acstools.satdet import make_masks
+>>> masks, errors = make_masks(results, n_processes=12, write_dq=True)
+Using 6 processes
+Number of pixel(s) masked:
+  abell2744-hffpar_acs-wfc_f814w_13495_11_01_jc8n11q9q_flc.fits[4]: 98210
+  ...
+  jc8m10syq_flc.fits[4]: 156362
+  ...
+Total run time: 12.1029410362 s
+
 """
 #
 # History:
@@ -137,7 +164,6 @@ import multiprocessing
 import time
 import warnings
 from functools import partial
-from multiprocessing import Process, Queue
 
 # THIRD PARTY
 import astropy
@@ -158,9 +184,11 @@ else:
 # OPTIONAL
 try:
     import skimage
+    from scipy import ndimage
     from scipy import stats
     from skimage import transform
     from skimage import morphology as morph
+    from skimage import draw
     from skimage import exposure
     from skimage.feature import canny
 except ImportError:
@@ -181,15 +209,41 @@ except ImportError:
 __version__ = '0.3.3'
 __vdate__ = '11-Jul-2017'
 __author__ = 'David Borncamp, Pey Lian Lim'
-__all__ = ['detsat', 'make_mask', 'update_dq']
+__all__ = ['detsat', 'iter_detsat', 'make_mask', 'make_masks', 'update_dq']
+
+# Half-width, in binned pixels, of the bands around trail candidates
+# that are searched at full resolution when binning is used.
+_BAND_HALFWIDTH = 3
+
+# Size, in full resolution pixels, of the tiles in which edges are
+# computed around trail candidates when binning is used.
+_TILE_SIZE = 256
+
+# Block size and clipping level, in units of the robust standard deviation,
+# of the image used to pre-screen for trails.
+_PRESCREEN_BINNING = 16
+_PRESCREEN_CLIP = 5.0
+
+# Number of randomly sampled pixels used for approximate percentiles.
+# The standard error of a percentile q (in percent) of the sample is
+# 100 * sqrt(q/100 * (1 - q/100) / _PERCENTILE_SAMPLE) percentile points,
+# i.e., 0.03-0.04 for the default percentiles of detsat, whatever the image.
+_PERCENTILE_SAMPLE = 500000
+
+# Number of steps along the trail whose profiles are computed together
+# by make_mask.
+_WALK_CHUNK = 16
 
 
 # ########################### from satdet.py ################################ #
 
 def _detsat_one(filename, ext, sigma=2.0, low_thresh=0.1, h_thresh=0.5,
                 small_edge=60, line_len=200, line_gap=75,
-                percentile=(4.5, 93.0), buf=200, plot=False, verbose=False):
-    """Called by :func:`detsat`."""
+                percentile=(4.5, 93.0), buf=200, plot=False, verbose=False,
+                binning=None, prescreen=None, fast_rescale=False,
+                image=None):
+    """Called by :func:`_detsat_file`. If ``image`` is given, it is used
+    as the data of ``filename[ext]`` instead of reading the file."""
     if verbose:
         t_beg = time.time()
 
@@ -201,11 +255,35 @@ def _detsat_one(filename, ext, sigma=2.0, low_thresh=0.1, h_thresh=0.5,
                       'ACS/WFC'.format(ext), AstropyUserWarning)
 
     # get the data
-    image = fits.getdata(filename, ext)
+    if image is None:
+        image = fits.getdata(filename, ext)
     # image = im.astype('float64')
 
+    # create an array of angles from 0 to 180, exactly 0 will get bad columns
+    # but it is unlikely that a satellite will be exactly at 0 degrees, so
+    # don't bother checking.
+    # then, convert to radians.
+    angle = np.radians(np.arange(2, 178, 0.5, dtype=float))
+
+    # skip everything else if there is definitely no trail
+    if prescreen is not None:
+        score = _trail_score(image, angle, line_len)
+
+        if verbose:
+            print('Pre-screen score: {0}'.format(score))
+
+        if score < prescreen:
+            if verbose:
+                print('No trail detected by pre-screen')
+                t_end = time.time()
+                print('Run time: {0} s'.format(t_end - t_beg))
+            return np.empty(0)
+
     # rescale the image
-    p1, p2 = np.percentile(image, percentile)
+    if fast_rescale:
+        p1, p2 = _approx_percentile(image, percentile)
+    else:
+        p1, p2 = np.percentile(image, percentile)
 
     # there should always be some counts in the image, anything lower should
     # be set to one. Makes things nicer for finding edges.
@@ -215,24 +293,26 @@ def _detsat_one(filename, ext, sigma=2.0, low_thresh=0.1, h_thresh=0.5,
     if verbose:
         print('Rescale intensity percentiles: {0}, {1}'.format(p1, p2))
 
-    image = exposure.rescale_intensity(image, in_range=(p1, p2))
+    if binning is not None and binning > 1:
+        # get the edges only around trail candidates from the binned image
+        edge = _coarse_to_fine_edges(
+            image, binning, (p1, p2), angle, fname, sigma=sigma,
+            low_thresh=low_thresh, h_thresh=h_thresh, small_edge=small_edge,
+            line_len=line_len, line_gap=line_gap, buf=buf,
+            fast_rescale=fast_rescale, verbose=verbose)
+    else:
+        image = _rescale_intensity(image, (p1, p2), fast=fast_rescale)
 
-    # get the edges
-    immax = np.max(image)
-    edge = canny(image, sigma=sigma,
-                 low_threshold=immax * low_thresh,
-                 high_threshold=immax * h_thresh)
+        # get the edges
+        immax = np.max(image)
+        edge = canny(image, sigma=sigma,
+                     low_threshold=immax * low_thresh,
+                     high_threshold=immax * h_thresh)
 
     # clean up the small objects, will make less noise
     morph.remove_small_objects(edge, min_size=small_edge, connectivity=8,
                                in_place=True)
 
-    # create an array of angles from 0 to 180, exactly 0 will get bad columns
-    # but it is unlikely that a satellite will be exactly at 0 degrees, so
-    # don't bother checking.
-    # then, convert to radians.
-    angle = np.radians(np.arange(2, 178, 0.5, dtype=float))
-
     # perform Hough Transform to detect straight lines.
     # only do if plotting to visualize the image in hough space.
     # otherwise just preform a Probabilistic Hough Transform.
@@ -248,11 +328,168 @@ def _detsat_one(filename, ext, sigma=2.0, low_thresh=0.1, h_thresh=0.5,
     result = np.asarray(result)
     n_result = len(result)
 
+    # only continue if there was more than one point (at least a line)
+    # returned from the PHT
+    satellite, result, trail_angle = _find_trail(
+        result, image.shape, buf, fname, verbose=verbose)
+    if satellite is None:
+        return result
+    n_result = len(result)
+
+    if satellite:
+        if verbose:
+            print('{0} trail segment(s) detected'.format(n_result))
+            print('Trail angle list (not returned): ')
+            print(trail_angle)
+            print('End point list:')
+            for i, ((px0, py0), (px1, py1)) in enumerate(result, 1):
+                print('{0:5d}. ({1:4d}, {2:4d}), ({3:4d}, {4:4d})'.format(
+                    i, px0, py0, px1, py1))
+
+        if plot and plt is not None:
+            mean = np.median(image)
+            stddev = image.std()
+            lower = mean - stddev
+            upper = mean + stddev
+
+            fig1, ax1 = plt.subplots()
+            ax1.imshow(edge, cmap=plt.cm.gray)
+            ax1.set_title('Edge image for {0}'.format(fname))
+
+            for (px0, py0), (px1, py1) in result:  # Draw trails
+                ax1.plot((px0, px1), (py0, py1), scalex=False, scaley=False)
+
+            fig2, ax2 = plt.subplots()
+            ax2.imshow(
+                np.log(1 + h),
+                extent=(np.rad2deg(theta[-1]), np.rad2deg(theta[0]),
+                        d[-1], d[0]), aspect=0.02)
+            ax2.set_title('Hough Transform')
+            ax2.set_xlabel('Angles (degrees)')
+            ax2.set_ylabel('Distance from Origin (pixels)')
+
+            fig3, ax3 = plt.subplots()
+            ax3.imshow(image, vmin=lower, vmax=upper, cmap=plt.cm.gray)
+            ax3.set_title(fname)
+
+            for (px0, py0), (px1, py1) in result:  # Draw trails
+                ax3.plot((px0, px1), (py0, py1), scalex=False, scaley=False)
+
+            plt.draw()
+
+    else:  # length of result was too small
+        result = np.empty(0)
+
+        if verbose:
+            print('No trail detected; found {0} segments'.format(n_result))
+
+        if plot and plt is not None:
+            fig1, ax1 = plt.subplots()
+            ax1.imshow(edge, cmap=plt.cm.gray)
+            ax1.set_title(fname)
+
+            # Draw trails
+            for (px0, py0), (px1, py1) in result:
+                ax1.plot((px0, px1), (py0, py1), scalex=False, scaley=False)
+
+    if verbose:
+        t_end = time.time()
+        print('Run time: {0} s'.format(t_end - t_beg))
+
+    return result
+
+
+def _approx_percentile(image, q):
+    """Percentiles ``q`` of ``_PERCENTILE_SAMPLE`` pixels of ``image``
+    drawn at random with a fixed seed (of all pixels if there are fewer)."""
+    data = image.ravel()
+    if data.size > _PERCENTILE_SAMPLE:
+        rng = np.random.RandomState(0)
+        data = data[rng.randint(0, data.size, _PERCENTILE_SAMPLE)]
+    return np.percentile(data, q)
+
+
+def _rescale_intensity(image, in_range, fast=False):
+    """Rescale ``image`` from ``in_range``, which must be non-negative,
+    to the range from 0 to 1, as ``skimage.exposure.rescale_intensity``.
+    If ``fast`` is `True`, the result is a new float32 array computed
+    without temporaries, instead of a float64 array."""
+    if not fast:
+        return exposure.rescale_intensity(image, in_range=in_range)
+
+    p1, p2 = in_range
+    out = np.clip(image, p1, p2, out=np.empty(image.shape, dtype=np.float32))
+    out -= p1
+    if p2 > p1:
+        out *= 1.0 / (p2 - p1)
+    return out
+
+
+def _trail_score(image, theta, line_len=200):
+    """Called by :func:`_detsat_one` to pre-screen an image.
+
+    The image is block-averaged by ``_PRESCREEN_BINNING``, normalized by
+    its median and robust standard deviation, and clipped at
+    ``_PRESCREEN_CLIP`` so that sources do not dominate. It is then
+    summed along straight lines at the Hough angles ``theta`` (but not
+    within 2.5 degrees of horizontal or vertical lines, which are never
+    accepted as trails). Returns the highest significance of these sums,
+    in units of their expected noise, for lines at least ``line_len``
+    pixels long.
+
+    """
+    binning = _PRESCREEN_BINNING
+    cny, cnx = image.shape[0] // binning, image.shape[1] // binning
+    coarse = image[:cny * binning, :cnx * binning].reshape(
+        cny, binning, cnx, binning).mean(axis=(1, 3))
+
+    med = np.median(coarse)
+    mad = 1.4826 * np.median(np.abs(coarse - med))
+    if not mad > 0:  # Cannot tell
+        return np.inf
+
+    coarse = np.clip((coarse - med) / mad, -_PRESCREEN_CLIP,
+                     _PRESCREEN_CLIP).ravel()
+    mean = coarse.mean()
+    stddev = coarse.std()
+    yy, xx = np.indices((cny, cnx), dtype=float)
+    yy = yy.ravel()
+    xx = xx.ravel()
+    min_count = max(line_len // binning, 1)
+    # normals of horizontal (90 deg) and vertical (0 or 180 deg) lines:
+    degrees = np.degrees(theta) % 90
+    theta = theta[np.minimum(degrees, 90 - degrees) > 2.5]
+    score = -np.inf
+
+    for t in theta:
+        rho = np.rint(xx * np.cos(t) + yy * np.sin(t)).astype(np.intp)
+        rho -= rho.min()
+        count = np.bincount(rho)
+        good = count >= min_count
+        total = np.bincount(rho, weights=coarse)[good]
+        count = count[good]
+        sig = (total - count * mean) / (np.sqrt(count) * stddev)
+        score = max(score, sig.max())
+
+    return score
+
+
+def _find_trail(result, shape, buf, fname, verbose=False):
+    """Decide whether the line segments from Probabilistic Hough Transform
+    make up a satellite trail that traverses an image of the given shape.
+    Called by :func:`_detsat_one`.
+
+    Returns ``(satellite, result, trail_angle)``, where ``result`` only
+    contains the segments along the trail. ``satellite`` is `None` if
+    the segments were rejected outright.
+
+    """
+    n_result = len(result)
+    trail_angle = None
+
     # initially assume there is no satellite
     satellite = False
 
-    # only continue if there was more than one point (at least a line)
-    # returned from the PHT
     if n_result > 1:
         if verbose:
             print('Length of PHT result: {0}'.format(n_result))
@@ -264,7 +501,7 @@ def _detsat_one(filename, ext, sigma=2.0, low_thresh=0.1, h_thresh=0.5,
         y1 = result[:, 1, 1]
 
         # set some boundries
-        ymax, xmax = image.shape
+        ymax, xmax = shape
         topx = xmax - buf
         topy = ymax - buf
 
@@ -289,7 +526,7 @@ def _detsat_one(filename, ext, sigma=2.0, low_thresh=0.1, h_thresh=0.5,
         if not np.any(mask):
             if verbose:
                 print('No round_angle found')
-            return np.empty(0)
+            return None, np.empty(0), None
 
         round_angle = round_angle[mask]
         trail_angle = trail_angle[mask]
@@ -314,7 +551,7 @@ def _detsat_one(filename, ext, sigma=2.0, low_thresh=0.1, h_thresh=0.5,
             print('Filtered trail_angle: {0}'.format(trail_angle))
 
         if n_result < 1:
-            return np.empty(0)
+            return None, np.empty(0), None
 
         # if there is an unreasonable amount of points, it picked up garbage
         elif n_result > 300:
@@ -322,7 +559,7 @@ def _detsat_one(filename, ext, sigma=2.0, low_thresh=0.1, h_thresh=0.5,
                 'Way too many segments results to be correct ({0}). '
                 'Rejecting detection on {1}.'.format(n_result, fname),
                 AstropyUserWarning)
-            return np.empty(0)
+            return None, np.empty(0), None
 
         # remake the point lists with things taken out
         x0 = result[:, 0, 0]
@@ -390,67 +627,94 @@ def _detsat_one(filename, ext, sigma=2.0, low_thresh=0.1, h_thresh=0.5,
             if verbose:
                 print('Trail Direction: Bottom to Right')
 
-    if satellite:
-        if verbose:
-            print('{0} trail segment(s) detected'.format(n_result))
-            print('Trail angle list (not returned): ')
-            print(trail_angle)
-            print('End point list:')
-            for i, ((px0, py0), (px1, py1)) in enumerate(result, 1):
-                print('{0:5d}. ({1:4d}, {2:4d}), ({3:4d}, {4:4d})'.format(
-                    i, px0, py0, px1, py1))
-
-        if plot and plt is not None:
-            mean = np.median(image)
-            stddev = image.std()
-            lower = mean - stddev
-            upper = mean + stddev
-
-            fig1, ax1 = plt.subplots()
-            ax1.imshow(edge, cmap=plt.cm.gray)
-            ax1.set_title('Edge image for {0}'.format(fname))
-
-            for (px0, py0), (px1, py1) in result:  # Draw trails
-                ax1.plot((px0, px1), (py0, py1), scalex=False, scaley=False)
-
-            fig2, ax2 = plt.subplots()
-            ax2.imshow(
-                np.log(1 + h),
-                extent=(np.rad2deg(theta[-1]), np.rad2deg(theta[0]),
-                        d[-1], d[0]), aspect=0.02)
-            ax2.set_title('Hough Transform')
-            ax2.set_xlabel('Angles (degrees)')
-            ax2.set_ylabel('Distance from Origin (pixels)')
-
-            fig3, ax3 = plt.subplots()
-            ax3.imshow(image, vmin=lower, vmax=upper, cmap=plt.cm.gray)
-            ax3.set_title(fname)
+    return satellite, result, trail_angle
 
-            for (px0, py0), (px1, py1) in result:  # Draw trails
-                ax3.plot((px0, px1), (py0, py1), scalex=False, scaley=False)
 
-            plt.draw()
+def _coarse_to_fine_edges(image, binning, in_range, theta, fname, sigma=2.0,
+                          low_thresh=0.1, h_thresh=0.5, small_edge=60,
+                          line_len=200, line_gap=75, buf=200,
+                          fast_rescale=False, verbose=False):
+    """Called by :func:`_detsat_one` for ``binning > 1``.
 
-    else:  # length of result was too small
-        result = np.empty(0)
+    Trail candidates are detected as in :func:`_detsat_one` on the image
+    block-averaged by ``binning``, with length parameters scaled
+    accordingly. The full resolution edge image is then only computed
+    in tiles that cover bands of ``_BAND_HALFWIDTH * binning`` pixels
+    on either side of the candidates; it is empty elsewhere, including
+    when there is no candidate.
 
+    """
+    ny, nx = image.shape
+    cny, cnx = ny // binning, nx // binning
+
+    # block-average and get the edges of the binned image
+    coarse = image[:cny * binning, :cnx * binning].reshape(
+        cny, binning, cnx, binning).mean(axis=(1, 3))
+    coarse = _rescale_intensity(coarse, in_range, fast=fast_rescale)
+    immax = np.max(coarse)
+    low_threshold = immax * low_thresh
+    high_threshold = immax * h_thresh
+    # binning reduces the noise by a factor of binning, so less smoothing
+    # is needed to get the same noise in the gradient image
+    coarse_edge = canny(coarse, sigma=sigma / np.sqrt(binning),
+                        low_threshold=low_threshold,
+                        high_threshold=high_threshold)
+    morph.remove_small_objects(
+        coarse_edge, min_size=max(small_edge // binning, 2), connectivity=8,
+        in_place=True)
+    candidates = transform.probabilistic_hough_line(
+        coarse_edge, threshold=max(210 // binning, 10),
+        line_length=max(line_len // binning, 2),
+        line_gap=max(line_gap // binning, 1), theta=theta)
+    satellite, candidates, _ = _find_trail(
+        np.asarray(candidates), coarse.shape, buf // binning, fname)
+
+    edge = np.zeros(image.shape, dtype=bool)
+    if not satellite:
         if verbose:
-            print('No trail detected; found {0} segments'.format(n_result))
-
-        if plot and plt is not None:
-            fig1, ax1 = plt.subplots()
-            ax1.imshow(edge, cmap=plt.cm.gray)
-            ax1.set_title(fname)
-
-            # Draw trails
-            for (px0, py0), (px1, py1) in result:
-                ax1.plot((px0, px1), (py0, py1), scalex=False, scaley=False)
+            print('No trail candidate in binned image')
+        return edge
 
     if verbose:
-        t_end = time.time()
-        print('Run time: {0} s'.format(t_end - t_beg))
-
-    return result
+        print('{0} trail candidate(s) in binned image'.format(
+            len(candidates)))
+
+    # mark the bands around the candidates in the binned image
+    band = np.zeros(coarse.shape, dtype=bool)
+    for (px0, py0), (px1, py1) in candidates:
+        rr, cc = draw.line(py0, px0, py1, px1)
+        band[rr, cc] = True
+    band = ndimage.binary_dilation(band, structure=np.ones((3, 3), dtype=bool),
+                                   iterations=_BAND_HALFWIDTH)
+
+    # get the full resolution edges in tiles overlapping the bands, only
+    # within the bounding box of the band in each tile. these are padded
+    # to avoid edge effects of the Gaussian filter.
+    tile = max(_TILE_SIZE // binning, 1)
+    pad = int(4 * sigma + 0.5) + 2
+    for ty in range(0, cny, tile):
+        for tx in range(0, cnx, tile):
+            tband = band[ty:ty + tile, tx:tx + tile]
+            rows = np.flatnonzero(np.any(tband, axis=1))
+            if len(rows) == 0:
+                continue
+            cols = np.flatnonzero(np.any(tband, axis=0))
+            tband = tband[rows[0]:rows[-1] + 1, cols[0]:cols[-1] + 1]
+            y0 = (ty + rows[0]) * binning
+            x0 = (tx + cols[0]) * binning
+            y1 = y0 + tband.shape[0] * binning
+            x1 = x0 + tband.shape[1] * binning
+            py0, px0 = max(y0 - pad, 0), max(x0 - pad, 0)
+            sub = _rescale_intensity(
+                image[py0:min(y1 + pad, ny), px0:min(x1 + pad, nx)],
+                in_range, fast=fast_rescale)
+            sub_edge = canny(sub, sigma=sigma, low_threshold=low_threshold,
+                             high_threshold=high_threshold)
+            edge[y0:y1, x0:x1] = (
+                sub_edge[y0 - py0:y1 - py0, x0 - px0:x1 - px0] &
+                tband.repeat(binning, axis=0).repeat(binning, axis=1))
+
+    return edge
 
 
 def _get_valid_indices(shape, ix0, ix1, iy0, iy1):
@@ -541,6 +805,374 @@ def _rotate_point(point, angle, ishape, rshape, reverse=False):
     return (newx, newy)
 
 
+def _rotation(shape, angle):
+    """Transformation matrix from rotated to original image coordinates,
+    and shape of the rotated image, as in :func:`skimage.transform.rotate`
+    with ``resize=True``."""
+    rows, cols = shape
+    center = np.array((cols, rows)) / 2. - 0.5
+    tform = (transform.SimilarityTransform(translation=-center) +
+             transform.SimilarityTransform(rotation=np.deg2rad(angle)) +
+             transform.SimilarityTransform(translation=center))
+    corners = tform.inverse(np.array(
+        [[0, 0], [0, rows - 1], [cols - 1, rows - 1], [cols - 1, 0]]))
+    minc, minr = corners.min(axis=0)
+    maxc, maxr = corners.max(axis=0)
+    rshape = tuple(np.around((maxr - minr + 1, maxc - minc + 1)).astype(int))
+    tform = transform.SimilarityTransform(translation=(minc, minr)) + tform
+    matrix = tform.params.copy()
+    matrix[2] = (0, 0, 1)
+    return matrix, rshape
+
+
+def _translation(x, y):
+    """Matrix of translation by ``(x, y)``."""
+    return np.array([[1., 0., x], [0., 1., y], [0., 0., 1.]])
+
+
+class _RotatedImage(object):
+    """Image as rotated by :func:`skimage.transform.rotate` with
+    ``resize=True``, without rotating all of it. Pixels of the rotated
+    image are only computed when a subarray is requested, by warping
+    the relevant part of the original image with the same transformation
+    and interpolation as :func:`skimage.transform.rotate`.
+
+    For ``order`` 0, 1, and 3, interpolation only uses neighboring pixels,
+    so subarrays are the same as those of the fully rotated image, up to
+    floating point rounding. Higher orders use splines of the whole image
+    in :func:`skimage.transform.rotate`, which are approximated by splines
+    of the part of the image around the subarray.
+
+    Parameters
+    ----------
+    image : ndarray
+        Original image, which must be non-negative.
+
+    angle : float
+        Rotation angle in degrees in counter-clockwise direction.
+
+    order : int
+        The order of the spline interpolation.
+
+    """
+    def __init__(self, image, angle, order=3):
+        self.image = image
+        self.angle = angle
+        self.order = order
+        self._max = image.max()
+        self._matrix, self.shape = _rotation(image.shape, angle)
+
+    def __getitem__(self, key):
+        """Subarray of the rotated image, e.g., ``rotated[y0:y1, x0:x1]``.
+        Only simple slices are supported."""
+        yslice, xslice = key
+        iy0, iy1, _ = yslice.indices(self.shape[0])
+        ix0, ix1, _ = xslice.indices(self.shape[1])
+        out = np.zeros((max(iy1 - iy0, 0), max(ix1 - ix0, 0)),
+                       dtype=self.image.dtype)
+        if out.size == 0:
+            return out
+
+        # Part of the original image that is needed, with some margin for
+        # the interpolation (or for the spline coefficients to converge)
+        rows, cols = self.image.shape
+        x, y, _ = np.dot(self._matrix, [[ix0, ix0, ix1 - 1, ix1 - 1],
+                                        [iy0, iy1 - 1, iy1 - 1, iy0],
+                                        [1, 1, 1, 1]])
+        margin = 3 if self.order in (0, 1, 3) else 12
+        x0 = max(int(np.floor(x.min())) - margin, 0)
+        x1 = min(int(np.ceil(x.max())) + margin + 1, cols)
+        y0 = max(int(np.floor(y.min())) - margin, 0)
+        y1 = min(int(np.ceil(y.max())) + margin + 1, rows)
+        if x1 <= x0 or y1 <= y0:
+            return out
+
+        matrix = np.dot(_translation(-x0, -y0),
+                        np.dot(self._matrix, _translation(ix0, iy0)))
+        out = transform.warp(self.image[y0:y1, x0:x1], matrix,
+                             output_shape=out.shape, order=self.order,
+                             mode='constant', cval=0, clip=False)
+
+        # As skimage, clip interpolation overshoots to the range of the
+        # whole image and the zeros outside of it
+        if self.order > 0:
+            np.clip(out, 0, self._max, out=out)
+
+        return out
+
+    def unrotate_mask(self, rectangles):
+        """Boolean mask for the original image from the union of the given
+        ``(y0, y1, x0, x1)`` rectangles in the rotated image.
+
+        The result is the same as rotating the mask back with
+        :func:`skimage.transform.rotate` (``resize=True`` and linear
+        interpolation), cutting out the center of the size of the original
+        image and including pixels that are partially covered.
+
+        """
+        rows, cols = self.image.shape
+        mask = np.zeros((rows, cols), dtype=bool)
+        if len(rectangles) == 0:
+            return mask
+
+        # Rotated mask, only around the rectangles, with a border of zeros
+        rect = np.asarray(rectangles)
+        ry0 = rect[:, 0].min() - 2
+        ry1 = rect[:, 1].max() + 2
+        rx0 = rect[:, 2].min() - 2
+        rx1 = rect[:, 3].max() + 2
+        rmask = np.zeros((ry1 - ry0, rx1 - rx0))
+        for y0, y1, x0, x1 in rectangles:
+            rmask[y0 - ry0:y1 - ry0, x0 - rx0:x1 - rx0] = 1
+
+        # Original pixels are the center of the mask rotated back
+        matrix, ushape = _rotation(self.shape, -self.angle)
+        offset = [int((n - m) / 2) for n, m in zip(ushape, (rows, cols))]
+        matrix = np.dot(_translation(-rx0, -ry0),
+                        np.dot(matrix, _translation(offset[1], offset[0])))
+
+        # Only the original pixels that fall within the rotated mask, which
+        # is a rotated rectangle in the original image. Find its columns
+        # in each row.
+        x, y, _ = np.dot(np.linalg.inv(matrix),
+                         [[-1, -1, rx1 - rx0, rx1 - rx0],
+                          [-1, ry1 - ry0, ry1 - ry0, -1],
+                          [1, 1, 1, 1]])
+        row0 = max(int(np.ceil(y.min())), 0)
+        row1 = min(int(np.floor(y.max())), rows - 1)
+        if row1 < row0:
+            return mask
+        rr = np.arange(row0, row1 + 1)
+        xnext = np.roll(x, -1)
+        ynext = np.roll(y, -1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            t = (rr[:, np.newaxis] - y) / (ynext - y)
+            xcross = np.where((t >= 0) & (t <= 1), x + t * (xnext - x),
+                              np.nan)
+        col0 = np.maximum(np.ceil(np.nanmin(xcross, axis=1)), 0).astype(int)
+        col1 = np.minimum(np.floor(np.nanmax(xcross, axis=1)),
+                          cols - 1).astype(int)
+        counts = np.maximum(col1 - col0 + 1, 0)
+        rr = np.repeat(rr, counts)
+        cc = (np.arange(counts.sum()) +
+              np.repeat(col0 - np.cumsum(counts) + counts, counts))
+        rx, ry, _ = np.dot(matrix, [cc, rr, np.ones(cc.size)])
+        mask[rr, cc] = ndimage.map_coordinates(
+            rmask, [ry, rx], order=1, mode='constant') > 0
+
+        return mask
+
+
+def _trail_profiles(rotate, windows, sigma, cache=None):
+    """Median profiles across the trail and their robust statistics in
+    the given ``(ix0, ix1, iy0, iy1)`` subarrays of the rotated image.
+
+    The rotated image is sampled in blocks of columns between the edges
+    of the subarrays, each shared by the subarrays that overlap it, and
+    the statistics of subarrays of the same shape are computed together.
+    Blocks are kept in ``cache``, if given, to be used by later calls.
+
+    Returns
+    -------
+    medarrs : list of ndarray
+        Median of each row of each subarray.
+
+    mean, stddev : ndarray
+        Sigma-clipped mean and biweight midvariance of each profile.
+
+    """
+    n = len(windows)
+    medarrs = [None] * n
+    mean = np.empty(n)
+    stddev = np.empty(n)
+    if n == 0:
+        return medarrs, mean, stddev
+
+    if cache is None:
+        cache = {}
+
+    wins = np.array(windows)
+    edges = np.unique(wins[:, :2])
+    blocks = []
+    for bx0, bx1 in zip(edges[:-1], edges[1:]):
+        over = wins[(wins[:, 0] < bx1) & (wins[:, 1] > bx0)]
+        if len(over) == 0:
+            blocks.append(None)
+            continue
+        by0 = over[:, 2].min()
+        by1 = over[:, 3].max()
+        if (bx0, bx1) in cache:
+            cy0, block = cache[bx0, bx1]
+            if cy0 <= by0 and cy0 + len(block) >= by1:
+                blocks.append((cy0, block))
+                continue
+        # Extra rows, so that blocks can be used for subarrays that
+        # are a few rows away
+        by0 = max(by0 - 8, 0)
+        by1 = min(by1 + 8, rotate.shape[0])
+        cache[bx0, bx1] = (by0, rotate[by0:by1, bx0:bx1])
+        blocks.append(cache[bx0, bx1])
+
+    def subarray(ix0, ix1, iy0, iy1):
+        first, last = np.searchsorted(edges, [ix0, ix1])
+        return np.hstack([block[iy0 - by0:iy1 - by0]
+                          for by0, block in blocks[first:last]])
+
+    groups = {}
+    for i, (ix0, ix1, iy0, iy1) in enumerate(windows):
+        groups.setdefault((iy1 - iy0, ix1 - ix0), []).append(i)
+
+    for indices in groups.values():
+        subrs = np.array([subarray(*w) for w in wins[indices]])
+        meds = np.median(subrs, axis=2)
+        mean[indices] = sigma_clipped_stats(meds, sigma=sigma, axis=1)[0]
+        if minversion(astropy, '2.0'):
+            stddev[indices] = biweight_midvariance(meds, axis=1)
+        else:  # No axis argument
+            stddev[indices] = [biweight_midvariance(m) for m in meds]
+        for i, med in zip(indices, meds):
+            medarrs[i] = med
+
+    return medarrs, mean, stddev
+
+
+def _walk_trail(rotate, ishape, newrad, nextx, centery, step, counter,
+                sublen, subwidth, sigma, pad, verbose=False):
+    """Follow the trail in the rotated image from ``(nextx, centery)``
+    in steps of ``step`` columns until an edge is hit or there is no
+    trail profile, for :func:`make_mask`.
+
+    Each step is centered on the trail profile found by the previous one.
+    Profiles are computed for several steps at a time, assuming that each
+    step is centered as it was in the previous computation, or as the
+    previous step if it was not computed yet. Steps are computed again
+    from the first one for which this was wrong, so the result is the
+    same as following the trail one step at a time.
+
+    Returns
+    -------
+    rectangles : list of tuple
+        Mask, as ``(lowery, uppery, lowerx, upperx)`` rectangles in the
+        rotated image.
+
+    counter : int
+        Number of steps taken so far, including the given ``counter``.
+
+    done : bool
+        Too many steps were taken.
+
+    """
+    dx = int(subwidth / 2)
+    rectangles = []
+    profiles = {}  # Step number: (centery, window or error, profile stats)
+    cache = {}  # Sampled blocks of the rotated image
+    guesses = {}  # Step number: centery expected from the previous step
+
+    k = 0
+    while True:
+        if k not in profiles or profiles[k][0] != centery:
+            # Only steps that can be reached by the walk
+            n = min(_WALK_CHUNK, 501 - counter)
+            steps = [k]
+            ys = [centery]
+            for j in range(k + 1, k + n):
+                x = nextx + (j - k) * step
+                if (x + subwidth > rotate.shape[1] if step > 0 else
+                        x - subwidth < 0):
+                    break
+                steps.append(j)
+                ys.append(guesses.get(j, ys[-1]))
+
+            windows = []
+            for j, y in zip(steps, ys):
+                x = nextx + (j - k) * step
+                try:
+                    windows.append(_get_valid_indices(
+                        rotate.shape, x - dx, x + dx, y - sublen, y + sublen))
+                except IndexError as e:
+                    windows.append(e)
+            valid = [i for i, w in enumerate(windows)
+                     if not isinstance(w, IndexError)]
+            stats = _trail_profiles(rotate, [windows[i] for i in valid],
+                                    sigma, cache=cache)
+            for j, y, window in zip(steps, ys, windows):
+                profiles[j] = (y, window, None)
+            for i, stat in zip(valid, zip(*stats)):
+                profiles[steps[i]] = (ys[i], windows[i], stat)
+                medarr, mean, stddev = stat
+                z = np.where(medarr > (mean + (sigma * stddev)))[0]
+                if len(z) > 0:
+                    guesses[steps[i] + 1] = max(
+                        np.floor(ys[i] - sublen + np.floor(z.min() - pad)),
+                        0) + z.max() - z.min()
+
+        y, window, stat = profiles.pop(k)
+        if isinstance(window, IndexError):
+            raise window
+        medarr, mean, stddev = stat
+        z = np.where(medarr > (mean + (sigma * stddev)))[0]
+
+        if len(z) < 1:
+            if verbose:
+                if step > 0:
+                    print('No good profile found for counter={0}. Start '
+                          'moving left from starting point.'.format(counter))
+                else:
+                    print('z={0} is less than 1, subr shape={1}, '
+                          'we are done'.format(z, (len(medarr), 2 * dx)))
+            return rectangles, counter, False
+
+        # get the bounds of the flagged points
+        lower = z.min()
+        upper = z.max()
+        diff = upper - lower
+
+        # add in a pading value to make sure all of the wings
+        # are accounted for
+        lower = np.floor(lower - pad)
+        upper = np.ceil(upper + pad)
+        lowerx, upperx, lowery, uppery = _get_valid_indices(
+            rotate.shape,
+            np.floor(nextx - subwidth),
+            np.ceil(nextx + subwidth),
+            np.floor(centery - sublen + lower),
+            np.ceil(centery - sublen + upper))
+        rectangles.append((lowery, uppery, lowerx, upperx))
+
+        upper_t = _rotate_point(
+            (upperx, uppery), newrad, ishape, rotate.shape, reverse=True)
+        highy = np.ceil(upper_t[1])
+        highx = np.ceil(upper_t[0])
+
+        # Reset the next subr to be at the center of the profile
+        nextx = nextx + step
+        centery = lowery + diff  # centery - sublen + lower + diff
+        k += 1
+
+        if (nextx + subwidth > rotate.shape[1] if step > 0 else
+                nextx - subwidth < 0):
+            if verbose:
+                print('Hit rotate edge at counter={0}'.format(counter))
+            edge = True
+        elif (highy > ishape[0]) or (highx > ishape[1]):
+            if verbose:
+                print('Hit image edge at counter={0}'.format(counter))
+            edge = True
+        else:
+            edge = False
+
+        counter += 1
+
+        # make sure it does not try to go infinetly
+        if counter > 500:
+            if verbose:
+                print('Too many loops, exiting')
+            return rectangles, counter, True
+
+        if edge:
+            return rectangles, counter, False
+
+
 def make_mask(filename, ext, trail_coords, sublen=75, subwidth=200, order=3,
               sigma=4, pad=10, plot=False, verbose=False):
     """Create DQ mask for an image for a given satellite trail.
@@ -548,8 +1180,8 @@ def make_mask(filename, ext, trail_coords, sublen=75, subwidth=200, order=3,
 
     .. note::
 
-        Unlike :func:`detsat`, multiprocessing is not available for
-        this function.
+        Use :func:`make_masks` to create the masks of the trails found
+        by :func:`detsat` in many images with multiprocessing.
 
     Parameters
     ----------
@@ -634,7 +1266,8 @@ def make_mask(filename, ext, trail_coords, sublen=75, subwidth=200, order=3,
     if verbose:
         print('Rotation: {0}'.format(deg))
 
-    rotate = transform.rotate(image, deg, resize=True, order=order)
+    # pixels of the rotated image are only computed around the trail
+    rotate = _RotatedImage(image, deg, order=order)
 
     if plot and plt is not None:
         plt.ion()
@@ -648,7 +1281,8 @@ def make_mask(filename, ext, trail_coords, sublen=75, subwidth=200, order=3,
         ax1.set_title(fname)
 
         fig2, ax2 = plt.subplots()
-        ax2.imshow(rotate, vmin=lower, vmax=upper, cmap=plt.cm.gray)
+        ax2.imshow(transform.rotate(image, deg, resize=True, order=order),
+                   vmin=lower, vmax=upper, cmap=plt.cm.gray)
         ax2.set_title('{0} rotated by {1} deg'.format(fname, deg))
 
         plt.draw()
@@ -669,9 +1303,7 @@ def make_mask(filename, ext, trail_coords, sublen=75, subwidth=200, order=3,
 
     # Flatten the array so we are looking along rows
     # Take median of each row, should filter out most outliers
-    # This list will get appended in the loop
     medarr = np.median(subr, axis=1)
-    flat = [medarr]
 
     # get the outliers
     # mean = biweight_location(medarr)
@@ -687,7 +1319,7 @@ def make_mask(filename, ext, trail_coords, sublen=75, subwidth=200, order=3,
         ax1.plot(z, medarr[z], 'r.')
         ax1.set_xlabel('Index')
         ax1.set_ylabel('Value')
-        ax1.set_title('Median array in flat[0]')
+        ax1.set_title('Median array')
         plt.draw()
 
     # Make sure there is something in the first pass before trying to move on
@@ -712,149 +1344,24 @@ def make_mask(filename, ext, trail_coords, sublen=75, subwidth=200, order=3,
         ax1.plot(padind, medarr[padind], 'yx')
         plt.draw()
 
-    # start to create a mask
-    mask = np.zeros(rotate.shape)
+    # start to create a mask, as rectangles in the rotated image
     lowerx, upperx, lowery, uppery = _get_valid_indices(
-        mask.shape, np.floor(sx - subwidth), np.ceil(sx + subwidth),
+        rotate.shape, np.floor(sx - subwidth), np.ceil(sx + subwidth),
         np.floor(sy - sublen + lower), np.ceil(sy - sublen + upper))
-    mask[lowery:uppery, lowerx:upperx] = 1
-
-    done = False
-    first = True
-    nextx = upperx  # np.ceil(sx + subwidth)
-    centery = np.ceil(lowery + diff)  # np.ceil(sy - sublen + lower + diff)
-    counter = 0
-
-    while not done:
-        # move to the right of the centerpoint first. do the same
-        # as above but keep moving right until the edge is hit.
-        ix0, ix1, iy0, iy1 = _get_valid_indices(
-            rotate.shape, nextx - dx, nextx + dx,
-            centery - sublen, centery + sublen)
-        subr = rotate[iy0:iy1, ix0:ix1]
-
-        # determines the edge, if the subr is not good, then the edge was
-        # hit.
-        if 0 in subr.shape:
-            if verbose:
-                print('Hit edge, subr shape={0}, first={1}'.format(
-                    subr.shape, first))
-            if first:
-                first = False
-                centery = sy
-                nextx = sx
-            else:
-                done = True
-            continue
-
-        medarr = np.median(subr, axis=1)
-        flat.append(medarr)
-
-        # mean = biweight_location(medarr)
-        mean = sigma_clipped_stats(medarr, sigma=sigma)[0]
-        # Might give RuntimeWarning
-        stddev = biweight_midvariance(medarr)
-        z = np.where(medarr > (mean + (sigma * stddev)))[0]
-
-        if len(z) < 1:
-            if first:
-                if verbose:
-                    print('No good profile found for counter={0}. Start '
-                          'moving left from starting point.'.format(counter))
-                centery = sy
-                nextx = sx
-                first = False
-            else:
-                if verbose:
-                    print('z={0} is less than 1, subr shape={1}, '
-                          'we are done'.format(z, subr.shape))
-                done = True
-            continue
-
-        # get the bounds of the flagged points
-        lower = z.min()
-        upper = z.max()
-        diff = upper - lower
-
-        # add in a pading value to make sure all of the wings
-        # are accounted for
-        lower = np.floor(lower - pad)
-        upper = np.ceil(upper + pad)
-        lowerx, upperx, lowery, uppery = _get_valid_indices(
-            mask.shape,
-            np.floor(nextx - subwidth),
-            np.ceil(nextx + subwidth),
-            np.floor(centery - sublen + lower),
-            np.ceil(centery - sublen + upper))
-        mask[lowery:uppery, lowerx:upperx] = 1
-
-        # lower_p = (lowerx, lowery)
-        upper_p = (upperx, uppery)
-        # lower_t = _rotate_point(
-        #     lower_p, newrad, image.shape, rotate.shape, reverse=True)
-        upper_t = _rotate_point(
-            upper_p, newrad, image.shape, rotate.shape, reverse=True)
-
-        # lowy = np.floor(lower_t[1])
-        highy = np.ceil(upper_t[1])
-        # lowx = np.floor(lower_t[0])
-        highx = np.ceil(upper_t[0])
-
-        # Reset the next subr to be at the center of the profile
-        if first:
-            nextx = nextx + dx
-            centery = lowery + diff  # centery - sublen + lower + diff
-
-            if (nextx + subwidth) > rotate.shape[1]:
-                if verbose:
-                    print('Hit rotate edge at counter={0}'.format(counter))
-                first = False
-            elif (highy > image.shape[0]) or (highx > image.shape[1]):
-                if verbose:
-                    print('Hit image edge at counter={0}'.format(counter))
-                first = False
+    rectangles = [(lowery, uppery, lowerx, upperx)]
 
-            if not first:
-                centery = sy
-                nextx = sx
+    # move to the right of the centerpoint first, then to the left of
+    # it, until the edge is hit.
+    walk = partial(_walk_trail, rotate, image.shape, newrad, sublen=sublen,
+                   subwidth=subwidth, sigma=sigma, pad=pad, verbose=verbose)
+    rects, counter, done = walk(upperx, np.ceil(lowery + diff), dx, 0)
+    rectangles += rects
+    if not done:
+        rects, counter, done = walk(sx, sy, -dx, counter)
+        rectangles += rects
 
-        # Not first, this is the pass the other way.
-        else:
-            nextx = nextx - dx
-            centery = lowery + diff  # centery - sublen + lower + diff
-
-            if (nextx - subwidth) < 0:
-                if verbose:
-                    print('Hit rotate edge at counter={0}'.format(counter))
-                done = True
-            elif (highy > image.shape[0]) or (highx > image.shape[1]):
-                if verbose:
-                    print('Hit image edge at counter={0}'.format(counter))
-                done = True
-
-        counter += 1
-
-        # make sure it does not try to go infinetly
-        if counter > 500:
-            if verbose:
-                print('Too many loops, exiting')
-            done = True
-    # End while
-
-    rot = transform.rotate(mask, -deg, resize=True, order=1)
-    ix0 = (rot.shape[1] - image.shape[1]) / 2
-    iy0 = (rot.shape[0] - image.shape[0]) / 2
-    lowerx, upperx, lowery, uppery = _get_valid_indices(
-        rot.shape, ix0, image.shape[1] + ix0, iy0, image.shape[0] + iy0)
-    mask = rot[lowery:uppery, lowerx:upperx]
-
-    if mask.shape != image.shape:
-        warnings.warn(
-            'Output mask shape is {0} but input image shape is '
-            '{1}'.format(mask.shape, image.shape), AstropyUserWarning)
-
-    # Change to boolean mask
-    mask = mask.astype(np.bool)
+    # rotate the mask back, only where there is something
+    mask = rotate.unrotate_mask(rectangles)
 
     if plot and plt is not None:
         # debugging array
@@ -938,35 +1445,189 @@ def update_dq(filename, ext, mask, dqval=16384, verbose=True):
 
 # ############################ from decttest.py ############################# #
 # Multiprocessing for multiple input files.
-# This is for detection only, not for mask.
 
-def _satdet_worker(work_queue, done_queue, sigma=2.0, low_thresh=0.1,
-                   h_thresh=0.5, small_edge=60, line_len=200, line_gap=75,
-                   percentile=(4.5, 93.0), buf=200):
-    """Multiprocessing worker."""
-    for fil, chip in iter(work_queue.get, 'STOP'):
+def _detsat_file(filename, chips, n_threads=1, verbose=False, **kwargs):
+    """Run :func:`_detsat_one` on the given extensions of a file, which is
+    opened (memory-mapped) only once. Extensions are processed by
+    ``n_threads`` threads.
+
+    Returns a list of ``(retcode, ext, result)``, where ``result`` is
+    the error message if ``retcode`` is `False`.
+
+    """
+    def _errmsg(e):
+        return '{0}: {1}'.format(type(e), str(e))
+
+    def _run(chip_image):
+        chip, image = chip_image
+        if verbose:
+            print('\nProcessing {0}[{1}]...'.format(filename, chip))
         try:
-            result = _detsat_one(
-                fil, chip, sigma=sigma,
-                low_thresh=low_thresh, h_thresh=h_thresh,
-                small_edge=small_edge, line_len=line_len, line_gap=line_gap,
-                percentile=percentile, buf=buf, plot=False, verbose=False)
+            result = _detsat_one(filename, chip, verbose=verbose,
+                                 image=image, **kwargs)
         except Exception as e:
-            retcode = False
-            result = '{0}: {1}'.format(type(e), str(e))
+            errmsg = _errmsg(e)
+            if verbose:
+                print(errmsg)
+            return False, chip, errmsg
+        return True, chip, result
+
+    try:
+        pf = fits.open(filename, memmap=True)
+    except Exception as e:
+        errmsg = _errmsg(e)
+        if verbose:
+            print(errmsg)
+        return [(False, chip, errmsg) for chip in chips]
+
+    status = []
+
+    with pf:
+        # Accessing HDU data is not thread-safe, so read them here.
+        images = []
+        for chip in chips:
+            try:
+                images.append((chip, pf[chip].data))
+            except Exception as e:
+                errmsg = _errmsg(e)
+                if verbose:
+                    print(errmsg)
+                status.append((False, chip, errmsg))
+
+        if n_threads > 1 and len(images) > 1:
+            from multiprocessing.pool import ThreadPool
+            pool = ThreadPool(min(n_threads, len(images)))
+            try:
+                status += pool.map(_run, images)
+            finally:
+                pool.close()
+                pool.join()
         else:
-            retcode = True
-        done_queue.put((retcode, fil, chip, result))
+            status += list(map(_run, images))
+
+        del images
+
+    return status
+
+
+def iter_detsat(searchpattern, chips=[1, 4], n_processes=4, sigma=2.0,
+                low_thresh=0.1, h_thresh=0.5, small_edge=60, line_len=200,
+                line_gap=75, percentile=(4.5, 93.0), buf=200, plot=False,
+                verbose=False, n_threads=1, binning=None, prescreen=None,
+                fast_rescale=False):
+    """Like :func:`detsat` but yields the result of each image and
+    extension as soon as it is available.
+
+    Images are processed by a :class:`concurrent.futures.ProcessPoolExecutor`
+    (this requires the ``futures`` backport on Python 2) unless
+    ``n_processes=1``. Results arrive in the order in which images
+    are completed. Closing the generator cancels the images that have
+    not been started yet.
+
+    Parameters
+    ----------
+    searchpattern, chips, n_processes, sigma, low_thresh, h_thresh, small_edge, line_len, line_gap, percentile, buf, plot, verbose, n_threads, binning, prescreen, fast_rescale
+        See :func:`detsat`.
+
+    Yields
+    ------
+    filename : str
+        Image filename.
+
+    ext : int, str, or tuple
+        Extension from ``chips``.
+
+    result : ndarray or str
+        Array of endpoints of line segments as in the results of
+        :func:`detsat` if processing was successful, or the
+        error message explaining why processing failed otherwise.
+
+    Raises
+    ------
+    ImportError
+        Missing scipy or skimage>=0.11 packages.
+
+    """
+    if not HAS_OPDEP:
+        raise ImportError('Missing scipy or skimage>=0.11 packages')
+
+    files = glob.glob(searchpattern)
+    n_files = len(files)
+    n_cpu = multiprocessing.cpu_count()
+
+    if verbose:
+        print('{0} file(s) found...'.format(n_files))
+
+    # Adjust number of processes; the unit of work is a file.
+    if n_files < n_processes:
+        n_processes = n_files
+    if n_processes > n_cpu:
+        n_processes = n_cpu
+    if plot:
+        n_threads = 1
+
+    kwargs = {'sigma': sigma, 'low_thresh': low_thresh, 'h_thresh': h_thresh,
+              'small_edge': small_edge, 'line_len': line_len,
+              'line_gap': line_gap, 'percentile': percentile, 'buf': buf,
+              'binning': binning, 'prescreen': prescreen,
+              'fast_rescale': fast_rescale, 'n_threads': n_threads}
+
+    # Nothing to do
+    if n_files < 1 or len(chips) < 1:
+        return iter(())
+
+    # No multiprocessing
+    if n_processes == 1:
+        return _iter_detsat_serial(files, chips, plot, verbose, kwargs)
+
+    if verbose:
+        print('Using {0} processes'.format(n_processes))
+
+    return _iter_detsat_pool(files, chips, n_processes, kwargs)
 
-    return True
+
+def _iter_detsat_serial(files, chips, plot, verbose, kwargs):
+    """Generator for :func:`iter_detsat` without multiprocessing."""
+    for fil in files:
+        for retcode, chip, result in _detsat_file(
+                fil, chips, plot=plot, verbose=verbose, **kwargs):
+            yield fil, chip, result
+
+
+def _iter_detsat_pool(files, chips, n_processes, kwargs):
+    """Generator for :func:`iter_detsat` with a process pool."""
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+
+    with ProcessPoolExecutor(max_workers=n_processes) as executor:
+        futures = dict(
+            (executor.submit(_detsat_file, fil, chips, plot=False,
+                             verbose=False, **kwargs), fil)
+            for fil in files)
+        try:
+            for future in as_completed(futures):
+                fil = futures[future]
+                try:
+                    status = future.result()
+                except Exception as e:  # e.g., a worker died
+                    errmsg = '{0}: {1}'.format(type(e), str(e))
+                    status = [(False, chip, errmsg) for chip in chips]
+                for retcode, chip, result in status:
+                    yield fil, chip, result
+        finally:
+            # Do not wait for pending images if the consumer stopped early
+            for future in futures:
+                future.cancel()
 
 
 def detsat(searchpattern, chips=[1, 4], n_processes=4, sigma=2.0,
            low_thresh=0.1, h_thresh=0.5, small_edge=60, line_len=200,
            line_gap=75, percentile=(4.5, 93.0), buf=200, plot=False,
-           verbose=True):
+           verbose=True, n_threads=1, binning=None, prescreen=None,
+           fast_rescale=False):
     """Find satellite trails in the given images and extensions.
     The trails are calculated using Probabilistic Hough Transform.
+    Results are returned after all the images are processed; use
+    :func:`iter_detsat` to get them as soon as they are available.
 
     .. note::
 
@@ -987,8 +1648,9 @@ def detsat(searchpattern, chips=[1, 4], n_processes=4, sigma=2.0,
 
     n_processes : int
         Number of processes for multiprocessing, which is only useful
-        if you are processing a lot of images or extensions.
-        If 1 is given, no multiprocessing is done.
+        if you are processing a lot of images. Each process handles
+        all the ``chips`` of one image at a time, so that the image is
+        only opened once. If 1 is given, no multiprocessing is done.
 
     sigma : float, optional
         The size of a Gaussian filter to use before edge detection.
@@ -1031,6 +1693,44 @@ def detsat(searchpattern, chips=[1, 4], n_processes=4, sigma=2.0,
         Print extra information to the terminal, mostly for debugging.
         In multiprocessing mode, info from individual process is not printed.
 
+    n_threads : int, optional
+        Number of threads used to process the ``chips`` of an image
+        in parallel, within each process. This is ignored if
+        ``plot=True``.
+
+    binning : int or `None`, optional
+        If given (e.g., 4), trail candidates are first found in the image
+        block-averaged by this factor, and edges are only computed at full
+        resolution in narrow bands around the candidates. The endpoints
+        are still in full resolution coordinates. This is several times
+        faster, but trails too faint to be found in the binned image are
+        missed; 4 is a good compromise for ACS/WFC. If `None` (default)
+        or 1, the full resolution image is searched.
+
+    prescreen : float or `None`, optional
+        If given, each extension is first screened with a cheap statistic:
+        the significance, in units of noise, of the brightest straight
+        line in the heavily binned image. Extensions scoring below this
+        value are reported as having no trail without running the full
+        detection. Lower values skip fewer extensions but miss fewer
+        trails. As a rough guide only, in the small synthetic sample of
+        ``benchmarks/bench_satdet.py`` (6 extensions without trails and
+        20 injected trails that the full detection finds), the extensions
+        without trails scored 5.4-7.1 and the trails 8.6 or more, so 8
+        skipped all 6 extensions and missed none of the 20 trails, while
+        9 missed a faint trail in a crowded field. This is not a measured
+        miss rate for real ACS/WFC data; check a threshold on a sample of
+        your own images before relying on it.
+        If `None` (default), no pre-screening is done.
+
+    fast_rescale : bool, optional
+        Compute the ``percentile`` boundaries from a random sample of
+        500000 pixels (with a standard error of 0.03-0.04 percentile
+        points for the default `percentile`), and rescale the image in
+        single precision.
+        This is much faster, and the difference does not matter for
+        edge detection. If `False` (default), use exact percentiles.
+
     Returns
     -------
     results : dict
@@ -1055,104 +1755,245 @@ def detsat(searchpattern, chips=[1, 4], n_processes=4, sigma=2.0,
     if verbose:
         t_beg = time.time()
 
-    files = glob.glob(searchpattern)
-    n_files = len(files)
-    n_chips = len(chips)
-    n_tot = n_files * n_chips
-    n_cpu = multiprocessing.cpu_count()
     results = {}
     errors = {}
 
+    for fil, chip, result in iter_detsat(
+            searchpattern, chips=chips, n_processes=n_processes, sigma=sigma,
+            low_thresh=low_thresh, h_thresh=h_thresh, small_edge=small_edge,
+            line_len=line_len, line_gap=line_gap, percentile=percentile,
+            buf=buf, plot=plot, verbose=verbose, n_threads=n_threads,
+            binning=binning, prescreen=prescreen, fast_rescale=fast_rescale):
+        if isinstance(result, np.ndarray):
+            results[(fil, chip)] = result
+        else:
+            errors[(fil, chip)] = result
+
     if verbose:
-        print('{0} file(s) found...'.format(n_files))
+        print()
+        if len(results) > 0:
+            print('Number of trail segment(s) found:')
+        for key in sorted(results):
+            print('  {0}[{1}]: {2}'.format(
+                key[0], key[1], len(results[key])))
+        if len(errors) > 0:
+            print('These have errors:')
+        for key in sorted(errors):
+            print('  {0}[{1}]'.format(key[0], key[1]))
+        t_end = time.time()
+        print('Total run time: {0} s'.format(t_end - t_beg))
 
-    # Nothing to do
-    if n_files < 1 or n_chips < 1:
-        return results, errors
+    return results, errors
+
+
+def _dq_ext(ext):
+    """DQ extension of the given science extension, assuming that the
+    SCI, ERR, and DQ extensions of each image set follow each other,
+    as in ACS/WFC."""
+    if isinstance(ext, tuple):
+        return ('DQ',) + tuple(ext[1:])
+    elif isinstance(ext, str):
+        return 'DQ'
+    else:
+        return ext + 2
+
+
+def _make_masks_file(filename, trails, write_dq=False, dqval=16384,
+                     max_segments=1, verbose=False, **kwargs):
+    """Run :func:`make_mask` on the given ``(ext, segments)`` trails of a
+    file, trying up to ``max_segments`` segments of each, longest first.
+    If ``write_dq=True``, the masks are written to the DQ extensions of
+    the file, which is why all the trails of a file are done together.
+
+    Returns a list of ``(retcode, ext, result)``, where ``result`` is
+    the mask packed along rows, the number of masked pixels if
+    ``write_dq=True``, or the error message if ``retcode`` is `False`.
+
+    """
+    def _errmsg(e):
+        return '{0}: {1}'.format(type(e), str(e))
+
+    status = []
+
+    for ext, segments in trails:
+        segments = np.asarray(segments)
+        length = np.hypot(*(segments[:, 1] - segments[:, 0]).T)
+        order = np.argsort(-length, kind='mergesort')[:max_segments]
+
+        if verbose:
+            print('\nProcessing {0}[{1}]...'.format(filename, ext))
+
+        errmsg = None  # From the longest segment
+        for trail_coords in segments[order]:
+            try:
+                mask = make_mask(filename, ext, trail_coords,
+                                 verbose=verbose, **kwargs)
+            except Exception as e:
+                if errmsg is None:
+                    errmsg = _errmsg(e)
+                if verbose:
+                    print(_errmsg(e))
+            else:
+                break
+        else:
+            status.append((False, ext, errmsg))
+            continue
+
+        try:
+            if write_dq:
+                update_dq(filename, _dq_ext(ext), mask, dqval=dqval,
+                          verbose=verbose)
+                result = np.count_nonzero(mask)
+            else:
+                result = np.packbits(mask, axis=1)
+        except Exception as e:
+            errmsg = _errmsg(e)
+            if verbose:
+                print(errmsg)
+            status.append((False, ext, errmsg))
+        else:
+            status.append((True, ext, result))
+
+    return status
+
+
+def make_masks(results, n_processes=4, write_dq=False, dqval=16384,
+               max_segments=1, sublen=75, subwidth=200, order=3, sigma=4,
+               pad=10, verbose=True):
+    """Create DQ masks for the satellite trails found by :func:`detsat`.
 
-    # Adjust number of processes
-    if n_tot < n_processes:
-        n_processes = n_tot
+    For each image and extension with a trail, :func:`make_mask` is run
+    with the longest segment of the trail, which is the most accurate.
+    Images are processed by a
+    :class:`concurrent.futures.ProcessPoolExecutor` (this requires the
+    ``futures`` backport on Python 2) unless ``n_processes=1``.
+
+    Parameters
+    ----------
+    results : dict
+        Dictionary mapping ``(filename, ext)`` to an array of endpoints of
+        line segments, as returned by :func:`detsat`. Extensions without
+        segments are skipped.
+
+    n_processes : int
+        Number of processes for multiprocessing. Each process handles
+        all the extensions of one image at a time. If 1 is given, no
+        multiprocessing is done.
+
+    write_dq : bool, optional
+        Update the DQ extension corresponding to each extension with its
+        mask using :func:`update_dq`, instead of returning the masks. DQ
+        extensions are found assuming that the SCI, ERR, and DQ extensions
+        of each image set follow each other, as in ACS/WFC; e.g.,
+        ``('SCI', 2)`` and 4 give ``('DQ', 2)`` and 6, respectively.
+
+    dqval : int, optional
+        DQ value to use for the trail, if ``write_dq=True``.
+        Default value of 16384 is tailored for ACS/WFC.
+
+    max_segments : int, optional
+        Maximum number of segments of each trail to try, longest first,
+        until a mask is created.
+
+    sublen, subwidth, order, sigma, pad
+        See :func:`make_mask`.
+
+    verbose : bool, optional
+        Print extra information to the terminal.
+        In multiprocessing mode, info from individual process is not printed.
+
+    Returns
+    -------
+    masks : dict
+        Dictionary mapping ``(filename, ext)`` to the mask packed along
+        rows with :func:`numpy.packbits` (for an image with ``ncols``
+        columns, unpack it with
+        ``np.unpackbits(packed, axis=1)[:, :ncols].astype(bool)``),
+        or to the number of masked pixels if ``write_dq=True``.
+
+    errors : dict
+        Dictionary mapping ``(filename, ext)`` to the error message explaining
+        why no mask was created.
+
+    Raises
+    ------
+    ImportError
+        Missing scipy or skimage>=0.11 packages.
+
+    """
+    if not HAS_OPDEP:
+        raise ImportError('Missing scipy or skimage>=0.11 packages')
+
+    if verbose:
+        t_beg = time.time()
+
+    # The unit of work is a file, so that its DQ is updated by one process.
+    trails = {}
+    for (fil, ext), segments in results.items():
+        if len(segments) > 0:
+            trails.setdefault(fil, []).append((ext, segments))
+
+    n_files = len(trails)
+    n_cpu = multiprocessing.cpu_count()
+
+    if n_files < n_processes:
+        n_processes = n_files
     if n_processes > n_cpu:
         n_processes = n_cpu
 
-    # No multiprocessing
-    if n_processes == 1:
-        for fil in files:
-            for chip in chips:
-                if verbose:
-                    print('\nProcessing {0}[{1}]...'.format(fil, chip))
+    kwargs = {'write_dq': write_dq, 'dqval': dqval,
+              'max_segments': max_segments, 'sublen': sublen,
+              'subwidth': subwidth, 'order': order, 'sigma': sigma,
+              'pad': pad}
 
-                key = (fil, chip)
-                try:
-                    result = _detsat_one(
-                        fil, chip, sigma=sigma,
-                        low_thresh=low_thresh, h_thresh=h_thresh,
-                        small_edge=small_edge, line_len=line_len,
-                        line_gap=line_gap, percentile=percentile, buf=buf,
-                        plot=plot, verbose=verbose)
-                except Exception as e:
-                    errmsg = '{0}: {1}'.format(type(e), str(e))
-                    errors[key] = errmsg
-                    if verbose:
-                        print(errmsg)
-                else:
-                    results[key] = result
-        if verbose:
-            print()
+    masks = {}
+    errors = {}
+
+    def _collect(fil, status):
+        for retcode, ext, result in status:
+            if retcode:
+                masks[(fil, ext)] = result
+            else:
+                errors[(fil, ext)] = result
 
-    # Multiprocessing.
-    # The work queue is for things that need to be done and is shared by all
-    # processes. When a worker finishes, its output is put into done queue.
+    if n_processes <= 1:
+        for fil in sorted(trails):
+            _collect(fil, _make_masks_file(fil, trails[fil], verbose=verbose,
+                                           **kwargs))
     else:
+        from concurrent.futures import ProcessPoolExecutor, as_completed
+
         if verbose:
             print('Using {0} processes'.format(n_processes))
 
-        work_queue = Queue()
-        done_queue = Queue()
-        processes = []
-
-        for fil in files:
-            for chip in chips:
-                work_queue.put((fil, chip))
-
-        for w in range(n_processes):
-            p = Process(
-                target=_satdet_worker, args=(work_queue, done_queue), kwargs={
-                    'sigma': sigma, 'low_thresh': low_thresh,
-                    'h_thresh': h_thresh, 'small_edge': small_edge,
-                    'line_len': line_len, 'line_gap': line_gap,
-                    'percentile': percentile, 'buf': buf})
-            p.start()
-            processes.append(p)
-            work_queue.put('STOP')
-
-        for p in processes:
-            p.join()
-
-        done_queue.put('STOP')
-
-        # return a dictionary of lists
-        for status in iter(done_queue.get, 'STOP'):
-            key = (status[1], status[2])
-            if status[0]:  # Success
-                results[key] = status[3]
-            else:  # Failed
-                errors[key] = status[3]
-
-        if verbose:
-            if len(results) > 0:
-                print('Number of trail segment(s) found:')
-            for key in sorted(results):
-                print('  {0}[{1}]: {2}'.format(
-                    key[0], key[1], len(results[key])))
-            if len(errors) > 0:
-                print('These have errors:')
-            for key in sorted(errors):
-                print('  {0}[{1}]'.format(key[0], key[1]))
+        with ProcessPoolExecutor(max_workers=n_processes) as executor:
+            futures = dict(
+                (executor.submit(_make_masks_file, fil, trails[fil],
+                                 verbose=False, **kwargs), fil)
+                for fil in trails)
+            for future in as_completed(futures):
+                fil = futures[future]
+                try:
+                    status = future.result()
+                except Exception as e:  # e.g., a worker died
+                    errmsg = '{0}: {1}'.format(type(e), str(e))
+                    status = [(False, ext, errmsg) for ext, _ in trails[fil]]
+                _collect(fil, status)
 
     if verbose:
+        print()
+        if len(masks) > 0:
+            print('Number of pixel(s) masked:')
+        for key in sorted(masks):
+            npix = masks[key]
+            if not write_dq:
+                npix = np.unpackbits(npix).sum()
+            print('  {0}[{1}]: {2}'.format(key[0], key[1], npix))
+        if len(errors) > 0:
+            print('These have errors:')
+        for key in sorted(errors):
+            print('  {0}[{1}]'.format(key[0], key[1]))
         t_end = time.time()
         print('Total run time: {0} s'.format(t_end - t_beg))
 
-    return results, errors
+    return masks, errors
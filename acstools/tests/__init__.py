@@ -1,5 +1,4 @@
 """Unit tests for ACSTOOLS."""
 
-# Currently, tests are on a different system due to large data files being
-# used. In the future, if there are tests that can be added to the package,
-# they should go in this directory.
+# Tests that need large data files are on a different system. Tests that
+# only use small synthetic data, created on the fly, go in this directory.
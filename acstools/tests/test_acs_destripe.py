@@ -0,0 +1,215 @@
+"""Tests for :mod:`acstools.acs_destripe`."""
+from __future__ import absolute_import, division, print_function
+
+# STDLIB
+import os
+
+# THIRD-PARTY
+import numpy as np
+import pytest
+from astropy.io import fits
+
+# LOCAL
+from .. import acs_destripe
+
+SHAPE = (256, 512)
+STRIPE_SIGMA = 0.9
+
+
+def _write_image(filename, arrays, phdr=None, extnames=('SCI', )):
+    hdus = [fits.PrimaryHDU(header=phdr)]
+    for extname, data in zip(extnames, arrays):
+        hdr = fits.Header()
+        hdr['EXTNAME'] = extname
+        hdr['EXTVER'] = 1
+        hdr['LTV1'] = 0.0
+        hdr['LTV2'] = 0.0
+        hdr['LTM1_1'] = 1.0
+        hdr['LTM2_2'] = 1.0
+        if extname == 'SCI':
+            hdr['BUNIT'] = 'ELECTRONS'
+        hdus.append(fits.ImageHDU(data, header=hdr))
+    fits.HDUList(hdus).writeto(filename)
+
+
+def _make_flt(filename, refdir, calstate='COMPLETE', nrows=SHAPE[0], seed=1):
+    """Write a single-amplifier subarray FLT image with bias stripes and
+    same-size reference files. Return injected stripes."""
+    rng = np.random.RandomState(seed)
+    shape = (nrows, SHAPE[1])
+    yy, xx = np.mgrid[0:nrows, 0:SHAPE[1]]
+
+    refs = {}
+    flat = (1.0 - 0.08 * ((xx - shape[1] / 2) / shape[1]) ** 2 +
+            0.01 * rng.standard_normal(shape)).astype(np.float32)
+    dark = np.abs(0.003 + 0.001 * rng.standard_normal(shape))
+    flash = 10.0 + 0.5 * rng.standard_normal(shape)
+    for key, data in (('PFLTFILE', flat), ('DARKFILE', dark),
+                      ('FLSHFILE', flash)):
+        refname = '{0}_{1}.fits'.format(
+            os.path.splitext(os.path.basename(filename))[0], key.lower())
+        _write_image(os.path.join(refdir, refname), [data.astype(np.float32)])
+        refs[key] = 'jref$' + refname
+
+    phdr = fits.Header()
+    phdr['INSTRUME'] = 'ACS'
+    phdr['DETECTOR'] = 'WFC'
+    phdr['CCDAMP'] = 'C'
+    phdr['SUBARRAY'] = True
+    phdr['EXPSTART'] = 56000.0
+    phdr['EXPTIME'] = 500.0
+    phdr['FLASHDUR'] = 0.5
+    phdr['FLASHSTA'] = 'SUCCESSFUL'
+    phdr['DARKCORR'] = calstate
+    phdr['FLSHCORR'] = calstate
+    phdr['FLATCORR'] = calstate
+    phdr['PCTECORR'] = 'OMIT'
+    phdr.update(refs)
+
+    sky = 80.0
+    sci = sky + rng.standard_normal(shape) * np.sqrt(sky + 16.0)
+    sci[100:120, 200:260] += 500.0  # a "source"
+    err = np.sqrt(np.abs(sci) + 16.0) / flat
+
+    # stripes are constant along rows in the raw (not flatfielded) space:
+    stripes = STRIPE_SIGMA * rng.standard_normal(nrows)
+    sci += stripes[:, np.newaxis] / flat
+
+    dq = np.zeros(shape, dtype=np.int16)
+    dq.flat[rng.randint(0, dq.size, size=dq.size // 200)] |= 16
+    dq[:, 300] |= 4
+
+    _write_image(filename, [sci.astype(np.float32), err.astype(np.float32),
+                            dq], phdr=phdr, extnames=('SCI', 'ERR', 'DQ'))
+    return stripes
+
+
+@pytest.fixture
+def flt(tmpdir, monkeypatch):
+    monkeypatch.setenv('jref', str(tmpdir) + os.sep)
+    filename = str(tmpdir.join('test_flt.fits'))
+    _make_flt(filename, str(tmpdir))
+    return filename
+
+
+def _data(filename, extname):
+    with fits.open(filename) as pf:
+        return pf[extname, 1].data.astype(np.float64)
+
+
+def test_row_stripe_stats_error_scale(flt):
+    # Must match the original per-row computation, in which the scale
+    # was stored in a float64 array:
+    frame = acs_destripe.StripeArray(flt)
+    try:
+        mask = acs_destripe._mergeUserMaskAndDQ(frame.dq, None, '~16')
+        for i in (0, 110, SHAPE[0] - 1):
+            npix, bmask = acs_destripe.djs_iterstat(
+                frame.science[i], MaxIter=15, SigRej=2.0, Mask=mask[i])[3::2]
+            corr_scale = np.empty(1, dtype=np.float64)
+            corr_scale[0] = 1.0 / np.average(frame.invflat[i][bmask])
+            sigcorr2 = (corr_scale[0] ** 2 *
+                        np.sum(frame.err[i][bmask] ** 2) / npix ** 2)
+
+            stats = acs_destripe._row_stripe_stats(
+                frame, i, 'pmode1', 15, 2.0, None, None, mask[i])
+            assert stats[1] == npix
+            assert stats[2] == corr_scale[0]
+            assert stats[3] == sigcorr2
+    finally:
+        frame.close()
+
+
+def test_warm_start_converges_faster(flt, tmpdir):
+    cold = acs_destripe.clean(flt, 'cold', dqbits='~16', rpt_clean=10,
+                              atol=0.001, verbose=False,
+                              save_profile=True)[0]
+    cold_profile = str(tmpdir.join('test_flt_cold_stripes.fits'))
+    assert cold['repeated_cleanings'] > 1
+
+    warm = acs_destripe.clean(flt, 'warm', dqbits='~16', rpt_clean=10,
+                              atol=0.001, verbose=False,
+                              prior_profile=cold_profile,
+                              save_profile=True)[0]
+    assert warm['repeated_cleanings'] < cold['repeated_cleanings']
+
+    # same total corrections:
+    np.testing.assert_allclose(
+        fits.getdata(str(tmpdir.join('test_flt_warm_stripes.fits'))),
+        fits.getdata(cold_profile), rtol=0, atol=0.01)
+    np.testing.assert_allclose(
+        _data(str(tmpdir.join('test_flt_warm.fits')), 'SCI'),
+        _data(str(tmpdir.join('test_flt_cold.fits')), 'SCI'),
+        rtol=0, atol=0.01)
+
+
+def test_profile_round_trip(flt, tmpdir):
+    acs_destripe.clean(flt, 'strp', dqbits='~16', verbose=False,
+                       save_profile=True)
+    profile_file = str(tmpdir.join('test_flt_strp_stripes.fits'))
+    profile = fits.getdata(profile_file)
+    assert profile.shape == SHAPE[:1]
+    assert fits.getval(profile_file, 'IMAGE') == 'test_flt.fits'
+
+    # reading the profile back gives the same corrections as the array:
+    acs_destripe.clean(flt, 'file', dqbits='~16', verbose=False,
+                       prior_profile=profile_file)
+    acs_destripe.clean(flt, 'array', dqbits='~16', verbose=False,
+                       prior_profile=profile)
+    assert np.array_equal(
+        _data(str(tmpdir.join('test_flt_file.fits')), 'SCI'),
+        _data(str(tmpdir.join('test_flt_array.fits')), 'SCI'))
+
+    # profile of a frame with a different number of rows is rejected:
+    other = str(tmpdir.join('other_flt.fits'))
+    _make_flt(other, str(tmpdir), nrows=SHAPE[0] // 2)
+    with pytest.raises(ValueError):
+        acs_destripe.clean(other, 'strp', dqbits='~16', verbose=False,
+                           prior_profile=profile_file)
+
+
+def test_clean_session_matches_clean(flt, tmpdir):
+    mask = np.ones(SHAPE, dtype=np.uint8)
+    mask[90:130, 180:280] = 0
+    maskfile = str(tmpdir.join('mask.fits'))
+    fits.writeto(maskfile, mask)
+
+    session = acs_destripe.CleanSession(flt, dqbits='~16')
+    try:
+        for suffix, mask1 in (('nomask', None), ('mask', maskfile)):
+            acs_destripe.clean(flt, suffix, dqbits='~16', mask1=mask1,
+                               verbose=False)
+            session.clean(mask1=mask1, verbose=False)
+            session.write(str(tmpdir.join('sess_flt.fits')), clobber=True)
+            for extname in ('SCI', 'ERR', 'DQ'):
+                assert np.array_equal(
+                    _data(str(tmpdir.join('sess_flt.fits')), extname),
+                    _data(str(tmpdir.join('test_flt_{0}.fits'.format(suffix))),
+                          extname))
+    finally:
+        session.close()
+
+
+def test_calibrate_matches_unfused(tmpdir, monkeypatch):
+    monkeypatch.setenv('jref', str(tmpdir) + os.sep)
+    filename = str(tmpdir.join('test_flt.fits'))
+    _make_flt(filename, str(tmpdir), calstate='PERFORM')
+    with fits.open(filename) as pf:
+        sci = pf['sci', 1].data.copy()
+        err = pf['err', 1].data.copy()
+
+    # StripeArray calls calibrate() on ingest:
+    frame = acs_destripe.StripeArray(filename)
+    try:
+        assert frame.apply_dark and frame.apply_flash and frame.apply_flat
+        science = (sci - frame.dark - frame.flash) * frame.invflat
+        assert frame.science.dtype == science.dtype
+        assert np.array_equal(frame.science, science)
+        assert np.array_equal(frame.err, err * frame.invflat)
+
+        frame.calibrate(inverse=True)
+        assert np.array_equal(
+            frame.science, science / frame.invflat + frame.flash + frame.dark)
+        assert np.array_equal(frame.err, err * frame.invflat / frame.invflat)
+    finally:
+        frame.close()
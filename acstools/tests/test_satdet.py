@@ -0,0 +1,139 @@
+"""Tests for :mod:`acstools.satdet`."""
+from __future__ import absolute_import, division, print_function
+
+# THIRD-PARTY
+import numpy as np
+import pytest
+from astropy.io import fits
+
+# LOCAL
+from .. import satdet
+
+pytestmark = pytest.mark.skipif(not satdet.HAS_OPDEP,
+                                reason='requires scipy and skimage')
+
+SHAPE = (1024, 2048)
+TRAIL = ((0, 200), (2047, 800))
+
+
+class _FullRotation(object):
+    """Rotated image for :func:`satdet.make_mask` that rotates the whole
+    image, and the whole mask back, with :func:`skimage.transform.rotate`
+    as :func:`satdet.make_mask` originally did."""
+    def __init__(self, image, angle, order=3):
+        from skimage import transform
+        self.image = image
+        self.angle = angle
+        self.rotated = transform.rotate(image, angle, resize=True,
+                                        order=order)
+        self.shape = self.rotated.shape
+
+    def __getitem__(self, key):
+        return self.rotated[key]
+
+    def unrotate_mask(self, rectangles):
+        from skimage import transform
+        mask = np.zeros(self.shape)
+        for y0, y1, x0, x1 in rectangles:
+            mask[y0:y1, x0:x1] = 1
+        rot = transform.rotate(mask, -self.angle, resize=True, order=1)
+        rows, cols = self.image.shape
+        iy0 = int((rot.shape[0] - rows) / 2)
+        ix0 = int((rot.shape[1] - cols) / 2)
+        return rot[iy0:iy0 + rows, ix0:ix0 + cols] > 0
+
+
+@pytest.fixture
+def trail_image(tmpdir):
+    """ACS/WFC-like image set with a straight satellite trail."""
+    rng = np.random.RandomState(0)
+    sci = 80 + 10 * rng.standard_normal(SHAPE)
+    yy, xx = np.mgrid[0:SHAPE[0], 0:SHAPE[1]]
+    (x0, y0), (x1, y1) = TRAIL
+    dist = (np.abs((xx - x0) * (y1 - y0) - (yy - y0) * (x1 - x0)) /
+            np.hypot(x1 - x0, y1 - y0))
+    sci += 50 * np.exp(-4 * np.log(2) * (dist / 4.0) ** 2)
+
+    filename = str(tmpdir.join('trail_flt.fits'))
+    fits.HDUList([
+        fits.PrimaryHDU(),
+        fits.ImageHDU(sci.astype(np.float32), name='SCI'),
+        fits.ImageHDU(np.full(SHAPE, 10, dtype=np.float32), name='ERR'),
+        fits.ImageHDU(np.zeros(SHAPE, dtype=np.int16), name='DQ')
+    ]).writeto(filename)
+    return filename
+
+
+def _segment(f0, f1):
+    p0, p1 = np.array(TRAIL, dtype=float)
+    return np.array([p0 + f0 * (p1 - p0), p0 + f1 * (p1 - p0)]).astype(int)
+
+
+def _assert_close_masks(mask, ref):
+    # Same up to one pixel of dilation
+    from scipy import ndimage
+    assert mask.shape == ref.shape
+    assert ref.sum() > 0
+    assert not np.any(mask & ~ndimage.binary_dilation(ref))
+    assert not np.any(ref & ~ndimage.binary_dilation(mask))
+    assert (mask & ref).sum() / (mask | ref).sum() > 0.99
+
+
+@pytest.mark.parametrize('order', [1, 3])
+def test_rotated_image_matches_full_rotation(order):
+    from skimage import transform
+    rng = np.random.RandomState(1)
+    image = rng.uniform(0, 1, size=(300, 500)).astype(np.float32)
+    angle = 23.7
+    full = transform.rotate(image, angle, resize=True, order=order)
+    rotated = satdet._RotatedImage(image, angle, order=order)
+    assert rotated.shape == full.shape
+
+    # Up to rounding of pixel coordinates, which skimage computes in
+    # single precision for float32 images:
+    for key in [(slice(0, 40), slice(0, 60)),
+                (slice(150, 250), slice(200, 400)),
+                (slice(full.shape[0] - 30, None), slice(300, 301))]:
+        np.testing.assert_allclose(rotated[key], full[key], rtol=0,
+                                   atol=1e-4)
+
+    rects = [(100, 130, 50, 450), (120, 160, 300, 520)]
+    ref = _FullRotation(image, angle, order=order)
+    assert np.array_equal(rotated.unrotate_mask(rects),
+                          ref.unrotate_mask(rects))
+
+
+@pytest.mark.parametrize('segment', [(0.3, 0.7), (0.1, 0.5), (0.6, 0.9)])
+def test_make_mask_matches_full_rotation(trail_image, monkeypatch, segment):
+    trail_coords = _segment(*segment)
+    mask = satdet.make_mask(trail_image, 1, trail_coords)
+
+    monkeypatch.setattr(satdet, '_RotatedImage', _FullRotation)
+    ref = satdet.make_mask(trail_image, 1, trail_coords)
+
+    _assert_close_masks(mask, ref)
+
+
+def test_walk_in_chunks_matches_single_steps(trail_image, monkeypatch):
+    trail_coords = _segment(0.3, 0.7)
+    mask = satdet.make_mask(trail_image, 1, trail_coords)
+
+    monkeypatch.setattr(satdet, '_WALK_CHUNK', 1)
+    assert np.array_equal(mask,
+                          satdet.make_mask(trail_image, 1, trail_coords))
+
+
+def test_make_masks_write_dq(trail_image):
+    # The longest segment is used
+    segments = np.array([_segment(0.1, 0.3), _segment(0.3, 0.7)])
+    mask = satdet.make_mask(trail_image, 1, segments[1])
+
+    masks, errors = satdet.make_masks({(trail_image, 1): segments},
+                                      n_processes=1, write_dq=True,
+                                      verbose=False)
+    assert errors == {}
+    assert masks[trail_image, 1] == mask.sum()
+
+    dq = fits.getdata(trail_image, 3)
+    assert np.array_equal(dq == 16384, mask)
+    assert np.all(dq[~mask] == 0)
@@ -12,9 +12,9 @@ from astropy.table import Table
 from astropy.utils.exceptions import AstropyUserWarning
 
 __all__ = ['extract_dark', 'extract_flash', 'extract_flatfield',
-           'from_irafpath', 'extract_ref', 'find_line', 'get_corner', 'get_lt',
-           'from_lt', 'hdr_vals_for_overscan', 'check_oscntab',
-           'check_overscan']
+           'extract_ref_dq', 'from_irafpath', 'extract_ref', 'find_line',
+           'get_corner', 'get_lt', 'from_lt', 'hdr_vals_for_overscan',
+           'check_oscntab', 'check_overscan']
 
 
 def extract_dark(prihdr, scihdu):
@@ -160,6 +160,62 @@ def extract_flatfield(prihdr, scihdu):
     return invflat
 
 
+def extract_ref_dq(prihdr, scihdu, extver=1):
+    """Combine DQ flags of the ``DARKFILE``, ``FLSHFILE``, and ``PFLTFILE``
+    reference files that ``ACS2D`` propagates into the science image DQ
+    (with bitwise OR) when applying ``DARKCORR``, ``FLSHCORR``, and
+    ``FLATCORR``, respectively.
+
+    Other DQ flags set by ``ACS2D`` (e.g., sink pixels with ``SINKCORR``
+    or full-well saturation from ``SATUFILE``) are not included.
+
+    Parameters
+    ----------
+    prihdr : obj
+        FITS primary header HDU of an image that is yet to be
+        processed by ``ACS2D`` (e.g., ``*_blv_tmp.fits``).
+
+    scihdu : obj
+        Extension HDU of the science image.
+        This is only used to extract subarray data.
+
+    extver : int
+        ``EXTVER`` of the science extension. This is only used
+        for full-frame images.
+
+    Returns
+    -------
+    dq : ndarray
+        Combined DQ flags of reference files (zeros if none).
+
+    """
+    ampstring = prihdr['CCDAMP']
+    if ampstring == 'ABCD':
+        refver = extver
+    elif ampstring in ('A', 'B', 'AB'):
+        refver = 2
+    else:
+        refver = 1
+
+    dq = np.zeros(scihdu.data.shape, dtype=np.int16)
+
+    for calsw, refkey in (('DARKCORR', 'DARKFILE'), ('FLSHCORR', 'FLSHFILE'),
+                          ('FLATCORR', 'PFLTFILE')):
+        reffile = prihdr.get(refkey, 'N/A')
+        if prihdr.get(calsw, 'OMIT') != 'PERFORM' or reffile == 'N/A':
+            continue
+
+        with fits.open(from_irafpath(reffile)) as hduref:
+            try:
+                refhdu = hduref['dq', refver]
+            except KeyError:
+                continue
+            if refhdu.data is not None:
+                dq = dq | extract_ref(scihdu, refhdu)
+
+    return dq
+
+
 def from_irafpath(irafpath):
     """Resolve IRAF path like ``jref$`` into actual file path.
 
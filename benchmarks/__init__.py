@@ -0,0 +1,6 @@
+"""Benchmarks for ACSTOOLS, to be run with ``asv``.
+
+Input data are generated synthetically, so no external data files
+are needed to run these benchmarks.
+
+"""
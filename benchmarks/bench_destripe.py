@@ -0,0 +1,127 @@
+"""Benchmarks for :mod:`acstools.acs_destripe`.
+
+Run with ``asv run`` (or ``asv dev`` for a quick check) from the top
+level of the repository. Each benchmark is run for a full-frame and
+a 2K subarray synthetic image.
+
+The ``track_*`` benchmarks report how well the injected stripes are
+recovered, so a faster implementation can be validated against the
+current one.
+
+"""
+from __future__ import absolute_import, division, print_function
+
+# STDLIB
+import os
+
+# THIRD-PARTY
+import numpy as np
+
+# LOCAL
+from acstools import acs_destripe
+
+from .synthetic import make_flt, make_reffiles
+
+_FRAMES = ['full', 'subarray']
+
+
+def _make_data():
+    """Create reference files and FLT images in current directory."""
+    refdir = os.path.abspath('refs')
+    if not os.path.isdir(refdir):
+        os.mkdir(refdir)
+    refs = make_reffiles(refdir)
+    data = {'jref': os.environ['jref']}
+    for frame in _FRAMES:
+        filename = os.path.abspath('synth_{0}_flt.fits'.format(frame))
+        stripes = make_flt(filename, refs, subarray=(frame == 'subarray'))
+        data[frame] = (filename, stripes)
+    return data
+
+
+class _DestripeBase(object):
+    params = _FRAMES
+    param_names = ['frame']
+    timeout = 600
+    number = 1
+    repeat = 3
+
+    def setup_cache(self):
+        return _make_data()
+
+    def setup(self, data, frame):
+        os.environ['jref'] = data['jref']
+        self.filename, self.stripes = data[frame]
+        self.frame = acs_destripe.StripeArray(self.filename)
+        self.mask = acs_destripe._mergeUserMaskAndDQ(
+            self.frame.dq, None, '~16')
+
+    def teardown(self, data, frame):
+        self.frame.close()
+
+
+class TimeStripeArray(_DestripeBase):
+    """Time loading and writing of :class:`StripeArray`."""
+
+    def time_load(self, data, frame):
+        acs_destripe.StripeArray(self.filename).close()
+
+    def time_write_corrected(self, data, frame):
+        self.frame.write_corrected(
+            self.filename.replace('.fits', '_wrt.fits'), clobber=True)
+
+    def peakmem_load(self, data, frame):
+        acs_destripe.StripeArray(self.filename).close()
+
+
+class TimeStatistics(_DestripeBase):
+    """Time row statistics used by :func:`clean_streak`."""
+
+    def time_djs_iterstat_row(self, data, frame):
+        acs_destripe.djs_iterstat(
+            self.frame.science[100], MaxIter=15, SigRej=2.0,
+            Mask=self.mask[100])
+
+    def time_merge_mask_and_dq(self, data, frame):
+        acs_destripe._mergeUserMaskAndDQ(self.frame.dq, None, '~16')
+
+
+class TimeCleanStreak(_DestripeBase):
+    """Time the destriping algorithm on data already in memory."""
+
+    def time_clean_streak(self, data, frame):
+        acs_destripe.clean_streak(self.frame, mask=self.mask, verbose=False)
+
+    def time_clean_streak_rpt(self, data, frame):
+        acs_destripe.clean_streak(self.frame, mask=self.mask, rpt_clean=2,
+                                  atol=0.01, verbose=False)
+
+
+class TimeClean(_DestripeBase):
+    """Time end-to-end :func:`clean`, including file I/O."""
+
+    def time_clean(self, data, frame):
+        acs_destripe.clean(self.filename, 'bench', dqbits='~16',
+                           clobber=True, verbose=False)
+
+
+class TrackStripeAccuracy(_DestripeBase):
+    """Track how well the injected stripe amplitudes are recovered."""
+
+    unit = 'electrons'
+
+    def _residual(self):
+        sci0 = self.frame.science.copy()
+        acs_destripe.clean_streak(self.frame, mask=self.mask, verbose=False)
+
+        # Corrections are constant along a row in the raw space.
+        recovered = np.median(
+            (sci0 - self.frame.science) / self.frame.invflat, axis=1)
+        return (recovered - recovered.mean() -
+                (self.stripes - self.stripes.mean()))
+
+    def track_stripe_rms_residual(self, data, frame):
+        return float(np.sqrt(np.mean(self._residual() ** 2)))
+
+    def track_stripe_max_residual(self, data, frame):
+        return float(np.amax(np.abs(self._residual())))
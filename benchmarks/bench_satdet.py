@@ -0,0 +1,208 @@
+"""Benchmarks for :mod:`acstools.satdet`.
+
+Run with ``asv run`` (or ``asv dev`` for a quick check) from the top
+level of the repository. Each benchmark is run on a full-frame
+synthetic image with a satellite trail in ``SCI,1`` and none in
+``SCI,2``, at full resolution and with coarse-to-fine detection.
+
+The ``track_*`` benchmarks report whether the trail is found, so a
+faster detection can be validated against the full resolution one.
+:class:`TrackPrescreen` reports the false-negative and skip rates of
+the ``prescreen`` option on a set of images with and without trails.
+
+"""
+from __future__ import absolute_import, division, print_function
+
+# STDLIB
+import os
+
+# THIRD-PARTY
+import numpy as np
+from astropy.io import fits
+
+# LOCAL
+from acstools import satdet
+
+from .synthetic import make_flt, make_reffiles, add_trail
+
+_TRAIL = ((0, 300), (4095, 1700))
+
+# Source densities of images for pre-screening; each has two chips.
+_PRESCREEN_SOURCES = [200, 2000, 6000]
+
+# Amplitudes (in electrons) of the trails injected for pre-screening.
+# Full resolution detection finds some of the 10 e- trails and almost
+# all of the brighter ones.
+_PRESCREEN_AMPLITUDES = [10.0, 15.0, 25.0, 50.0]
+
+
+def _make_data():
+    """Create reference files and a trailed FLT image in current
+    directory."""
+    refdir = os.path.abspath('refs')
+    if not os.path.isdir(refdir):
+        os.mkdir(refdir)
+    refs = make_reffiles(refdir)
+    filename = os.path.abspath('synth_trail_flt.fits')
+    make_flt(filename, refs, n_sources=2000, seed=3)
+    add_trail(filename, ('SCI', 1), _TRAIL)
+    return {'jref': os.environ['jref'], 'filename': filename}
+
+
+class _SatdetBase(object):
+    params = [None, 4]
+    param_names = ['binning']
+    timeout = 600
+    number = 1
+    repeat = 3
+
+    def setup_cache(self):
+        return _make_data()
+
+    def setup(self, data, binning):
+        self.filename = data['filename']
+        with fits.open(self.filename) as pf:
+            self.trail = pf['SCI', 1].data.copy()
+            self.blank = pf['SCI', 2].data.copy()
+
+    def _detect(self, image, binning, fast_rescale=False):
+        return satdet._detsat_one(self.filename, ('SCI', 1), image=image,
+                                  binning=binning, fast_rescale=fast_rescale)
+
+
+class TimeDetsat(_SatdetBase):
+    """Time trail detection on data already in memory."""
+
+    def time_detsat_trail(self, data, binning):
+        self._detect(self.trail, binning)
+
+    def time_detsat_no_trail(self, data, binning):
+        self._detect(self.blank, binning)
+
+    def time_detsat_trail_fast_rescale(self, data, binning):
+        self._detect(self.trail, binning, fast_rescale=True)
+
+    def time_detsat_file(self, data, binning):
+        satdet.detsat(self.filename, chips=[1, 4], n_processes=1,
+                      binning=binning, verbose=False)
+
+
+class TrackDetsat(_SatdetBase):
+    """Track the number of trail segments found."""
+
+    unit = 'segments'
+
+    def track_segments_trail(self, data, binning):
+        return len(self._detect(self.trail, binning))
+
+    def track_segments_no_trail(self, data, binning):
+        return len(self._detect(self.blank, binning))
+
+    def track_segments_trail_fast_rescale(self, data, binning):
+        return len(self._detect(self.trail, binning, fast_rescale=True))
+
+
+class TimeMakeMask(object):
+    """Time making the mask of the trail from one of its segments."""
+
+    timeout = 600
+    number = 1
+    repeat = 3
+
+    def setup_cache(self):
+        return _make_data()
+
+    def setup(self, data):
+        (x0, y0), (x1, y1) = _TRAIL
+        self.segment = np.array([[x0 + (x1 - x0) // 5, y0 + (y1 - y0) // 5],
+                                 [x0 + (x1 - x0) // 2, y0 + (y1 - y0) // 2]])
+
+    def time_make_mask(self, data):
+        satdet.make_mask(data['filename'], ('SCI', 1), self.segment)
+
+
+def _make_prescreen_data():
+    """Create reference files and FLT images without trails in current
+    directory."""
+    refdir = os.path.abspath('refs')
+    if not os.path.isdir(refdir):
+        os.mkdir(refdir)
+    refs = make_reffiles(refdir)
+    filenames = []
+    for i, n_sources in enumerate(_PRESCREEN_SOURCES):
+        filename = os.path.abspath('synth_prescreen{0}_flt.fits'.format(i))
+        make_flt(filename, refs, n_sources=n_sources, seed=10 + i)
+        filenames.append(filename)
+    return filenames
+
+
+def _random_trail(rng, shape):
+    """Endpoints of a random trail crossing the whole image."""
+    ny, nx = shape
+    if rng.rand() < 0.5:  # Left to right
+        return (0, rng.uniform(0, ny)), (nx - 1, rng.uniform(0, ny))
+    else:  # Bottom to top
+        return (rng.uniform(0, nx), 0), (rng.uniform(0, nx), ny - 1)
+
+
+def _with_trail(image, endpoints, amplitude, fwhm=4.0):
+    """Like :func:`~benchmarks.synthetic.add_trail` but in memory."""
+    (x0, y0), (x1, y1) = endpoints
+    yy, xx = np.mgrid[0:image.shape[0], 0:image.shape[1]]
+    dist = (np.abs((xx - x0) * (y1 - y0) - (yy - y0) * (x1 - x0)) /
+            np.hypot(x1 - x0, y1 - y0))
+    return image + (amplitude * np.exp(-4 * np.log(2) * (dist / fwhm) ** 2)
+                    ).astype(image.dtype)
+
+
+class TrackPrescreen(object):
+    """Track the pre-screening of images for trails at several thresholds.
+
+    The false-negative rate is the fraction of images with an injected
+    trail found by the full detection that are skipped. The skip rate
+    is the fraction of images without a trail that are skipped, i.e.,
+    the fraction of the full detection work that is saved.
+
+    """
+    params = [7.0, 8.0, 9.0, 11.0]
+    param_names = ['prescreen']
+    timeout = 1200
+    unit = 'fraction'
+
+    def setup_cache(self):
+        filenames = _make_prescreen_data()
+        angle = np.radians(np.arange(2, 178, 0.5, dtype=float))
+        rng = np.random.RandomState(0)
+        blank_scores = []
+        trail_scores = []
+        for filename in filenames:
+            with fits.open(filename) as pf:
+                for ext in (('SCI', 1), ('SCI', 2)):
+                    image = pf[ext].data
+                    blank_scores.append(satdet._trail_score(image, angle))
+                    for amplitude in _PRESCREEN_AMPLITUDES:
+                        trailed = _with_trail(
+                            image, _random_trail(rng, image.shape), amplitude)
+                        result = satdet._detsat_one(filename, ext,
+                                                    image=trailed)
+                        if len(result) > 0:
+                            trail_scores.append(
+                                satdet._trail_score(trailed, angle))
+        return {'blank': blank_scores, 'trail': trail_scores}
+
+    def track_false_negative_rate(self, scores, prescreen):
+        return float(np.mean(np.asarray(scores['trail']) < prescreen))
+
+    def track_skip_rate(self, scores, prescreen):
+        return float(np.mean(np.asarray(scores['blank']) < prescreen))
+
+
+class TimePrescreen(_SatdetBase):
+    """Time pre-screening compared to full detection."""
+
+    params = [None, 8.0]
+    param_names = ['prescreen']
+
+    def time_detsat_no_trail(self, data, prescreen):
+        satdet._detsat_one(self.filename, ('SCI', 2), image=self.blank,
+                           prescreen=prescreen)
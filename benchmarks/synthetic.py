@@ -0,0 +1,239 @@
+"""Generate synthetic ACS/WFC FLT images with injected bias stripes,
+along with fake reference files pointed to by ``jref$``.
+
+The images mimic the parts of a calibrated FLT file that
+:mod:`acstools.acs_destripe` relies on: the primary header calibration
+switches, ``SCI``/``ERR``/``DQ`` extensions, and ``PFLTFILE``,
+``DARKFILE``, and ``FLSHFILE`` reference files. Satellite trails for
+:mod:`acstools.satdet` can be added with :func:`add_trail`.
+
+"""
+from __future__ import absolute_import, division, print_function
+
+# STDLIB
+import os
+
+# THIRD-PARTY
+import numpy as np
+from astropy.io import fits
+
+__all__ = ['WFC_CHIP_SHAPE', 'make_reffiles', 'make_flt', 'add_trail']
+
+#: Shape of a single full-frame ACS/WFC chip (rows, columns).
+WFC_CHIP_SHAPE = (2048, 4096)
+
+_REF_NAMES = {'PFLTFILE': 'synth_pfl.fits',
+              'DARKFILE': 'synth_drk.fits',
+              'FLSHFILE': 'synth_fls.fits'}
+
+
+def _writeto(hdulist, filename):
+    if os.path.exists(filename):
+        os.remove(filename)
+    hdulist.writeto(filename)
+
+
+def make_reffiles(refdir, seed=0):
+    """Write full-frame flatfield, dark, and post-flash reference files
+    into ``refdir`` and point the ``jref`` environment variable to it.
+
+    Parameters
+    ----------
+    refdir : str
+        Directory for the reference files.
+
+    seed : int
+        Seed for the random number generator.
+
+    Returns
+    -------
+    refs : dict
+        Mapping of header keyword to ``jref$`` reference file name.
+
+    """
+    rng = np.random.RandomState(seed)
+    ny, nx = WFC_CHIP_SHAPE
+    yy, xx = np.mgrid[0:ny, 0:nx]
+
+    for key, fname in _REF_NAMES.items():
+        hdus = [fits.PrimaryHDU()]
+        for chip in (1, 2):
+            if key == 'PFLTFILE':
+                # Smooth, vignetted-like flat with pixel-to-pixel noise.
+                data = (1.0 - 0.08 * ((xx - nx / 2) / nx) ** 2 -
+                        0.05 * ((yy - ny / 2) / ny) ** 2 +
+                        0.01 * rng.standard_normal(WFC_CHIP_SHAPE))
+            elif key == 'DARKFILE':
+                # Dark rate (e/s) with some hot pixels.
+                data = np.abs(0.003 + 0.001 * rng.standard_normal(
+                    WFC_CHIP_SHAPE))
+                hot = rng.randint(0, data.size, size=data.size // 500)
+                data.flat[hot] += rng.uniform(0.05, 1.0, size=hot.size)
+            else:
+                # Post-flash rate (e/s).
+                data = 10.0 + 0.5 * rng.standard_normal(WFC_CHIP_SHAPE)
+            hdr = fits.Header()
+            hdr['EXTNAME'] = 'SCI'
+            hdr['EXTVER'] = chip
+            hdus.append(fits.ImageHDU(data.astype(np.float32), header=hdr))
+        _writeto(fits.HDUList(hdus), os.path.join(refdir, fname))
+
+    os.environ['jref'] = refdir + os.sep
+    return dict((key, 'jref$' + fname) for key, fname in _REF_NAMES.items())
+
+
+def make_flt(filename, refs, subarray=False, stripe_sigma=0.9, sky=80.0,
+             n_sources=200, seed=1):
+    """Write a synthetic FLT image with known bias stripes.
+
+    Stripes are constant along a row in the "raw" (not flatfielded)
+    space, as assumed by :func:`acstools.acs_destripe.clean_streak`.
+
+    Parameters
+    ----------
+    filename : str
+        Output FLT filename.
+
+    refs : dict
+        Reference files returned by :func:`make_reffiles`.
+
+    subarray : bool
+        If `True`, write a 2K single-amplifier subarray (amp C of WFC1)
+        instead of a full-frame image.
+
+    stripe_sigma : float
+        Standard deviation of the injected stripe amplitudes in electrons.
+        The default is the known bias striping level (ISR ACS 2011-05).
+
+    sky : float
+        Sky background in electrons.
+
+    n_sources : int
+        Number of Gaussian sources per chip.
+
+    seed : int
+        Seed for the random number generator.
+
+    Returns
+    -------
+    stripes : ndarray
+        Injected stripe amplitudes for every row of the image as seen by
+        :class:`acstools.acs_destripe.StripeArray`, i.e., with rows
+        of the two chips merged for full-frame images.
+
+    """
+    rng = np.random.RandomState(seed)
+    exptime = 500.0
+    flashdur = 0.5
+
+    if subarray:
+        ny, nx = WFC_CHIP_SHAPE[0], WFC_CHIP_SHAPE[1] // 2
+        ccdamp = 'C'
+        chips = (1, )
+    else:
+        ny, nx = WFC_CHIP_SHAPE
+        ccdamp = 'ABCD'
+        chips = (1, 2)
+
+    stripes = stripe_sigma * rng.standard_normal(ny)
+
+    phdr = fits.Header()
+    phdr['INSTRUME'] = 'ACS'
+    phdr['DETECTOR'] = 'WFC'
+    phdr['CCDAMP'] = ccdamp
+    phdr['SUBARRAY'] = subarray
+    phdr['EXPSTART'] = 56000.0
+    phdr['EXPTIME'] = exptime
+    phdr['FLASHDUR'] = flashdur
+    phdr['FLASHSTA'] = 'SUCCESSFUL'
+    phdr['DARKCORR'] = 'COMPLETE'
+    phdr['FLSHCORR'] = 'COMPLETE'
+    phdr['FLATCORR'] = 'COMPLETE'
+    phdr['PCTECORR'] = 'OMIT'
+    phdr.update(refs)
+
+    with fits.open(refs['PFLTFILE'].replace(
+            'jref$', os.environ['jref'])) as pf:
+        flats = [pf['sci', chip].data[:ny, :nx] for chip in chips]
+
+    hdus = [fits.PrimaryHDU(header=phdr)]
+    yy, xx = np.mgrid[0:ny, 0:nx]
+
+    for chip, flat in zip(chips, flats):
+        # Calibrated sky with sources.
+        sci = np.full((ny, nx), sky, dtype=np.float64)
+        for _ in range(n_sources):
+            x0 = rng.uniform(0, nx)
+            y0 = rng.uniform(0, ny)
+            fwhm = rng.uniform(2.0, 15.0)
+            peak = rng.lognormal(4.0, 1.5)
+            r = max(int(3 * fwhm), 1)
+            sl = (slice(max(int(y0) - r, 0), min(int(y0) + r + 1, ny)),
+                  slice(max(int(x0) - r, 0), min(int(x0) + r + 1, nx)))
+            sci[sl] += peak * np.exp(-((xx[sl] - x0) ** 2 +
+                                       (yy[sl] - y0) ** 2) /
+                                     (0.36 * fwhm ** 2))
+        sci += rng.standard_normal((ny, nx)) * np.sqrt(sky + 16.0)
+        err = np.sqrt(np.abs(sci) + 16.0) / flat
+
+        # Stripes live in the raw space, so they get divided by flat.
+        # The second chip is flipped when rows are merged.
+        rowstripes = stripes if chip == 1 else stripes[::-1]
+        sci += rowstripes[:, np.newaxis] / flat
+
+        # DQ: hot pixels (16), a few bad columns (4), saturation (256).
+        dq = np.zeros((ny, nx), dtype=np.int16)
+        dq.flat[rng.randint(0, dq.size, size=dq.size // 200)] |= 16
+        dq[:, rng.randint(0, nx, size=5)] |= 4
+        dq[sci > 2000] |= 256
+
+        for extname, data in (('SCI', sci.astype(np.float32)),
+                              ('ERR', err.astype(np.float32)),
+                              ('DQ', dq)):
+            hdr = fits.Header()
+            hdr['EXTNAME'] = extname
+            hdr['EXTVER'] = chip
+            hdr['LTV1'] = 0.0
+            hdr['LTV2'] = 0.0
+            hdr['LTM1_1'] = 1.0
+            hdr['LTM2_2'] = 1.0
+            if extname == 'SCI':
+                hdr['BUNIT'] = 'ELECTRONS'
+            hdus.append(fits.ImageHDU(data, header=hdr))
+
+    _writeto(fits.HDUList(hdus), filename)
+
+    return stripes
+
+
+def add_trail(filename, ext, endpoints, amplitude=50.0, fwhm=4.0):
+    """Add a straight satellite trail to an image extension in place.
+
+    Parameters
+    ----------
+    filename : str
+        Image filename, e.g., from :func:`make_flt`.
+
+    ext : int, str, or tuple
+        Science extension, as accepted by ``astropy.io.fits``.
+
+    endpoints : tuple
+        ``((x0, y0), (x1, y1))`` of the trail. The trail is extended to
+        the edges of the image.
+
+    amplitude : float
+        Peak of the trail in electrons.
+
+    fwhm : float
+        Full width at half maximum of the Gaussian cross-section
+        of the trail in pixels.
+
+    """
+    (x0, y0), (x1, y1) = endpoints
+    with fits.open(filename, mode='update') as pf:
+        sci = pf[ext].data
+        yy, xx = np.mgrid[0:sci.shape[0], 0:sci.shape[1]]
+        dist = (np.abs((xx - x0) * (y1 - y0) - (yy - y0) * (x1 - x0)) /
+                np.hypot(x1 - x0, y1 - y0))
+        sci += (amplitude * np.exp(-4 * np.log(2) * (dist / fwhm) ** 2)
+                ).astype(sci.dtype)
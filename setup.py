@@ -48,7 +48,8 @@ setup(
     entry_points=entry_points,
     install_requires = [
         'astropy>=1.1',
-        'numpy'
+        'numpy',
+        'futures; python_version < "3"'
     ],
     use_2to3=False,
     zip_safe=False